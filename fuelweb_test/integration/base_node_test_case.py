@@ -14,7 +14,9 @@
 
 
 import logging
-from devops.helpers.helpers import SSHClient, wait, _wait
+import time
+from devops.error import TimeoutError
+from devops.helpers.helpers import SSHClient, _wait
 from paramiko import RSAKey
 from fuelweb_test.helpers import Ebtables
 from fuelweb_test.integration.base_test_case import BaseTestCase
@@ -168,12 +170,39 @@ class BaseNodeTestCase(BaseTestCase):
 
     @logwrap
     def _task_wait(self, task, timeout):
-        wait(
+        self._events_wait(
             lambda: self.client.get_task(
                 task['id'])['status'] != 'running',
-            timeout=timeout)
+            ('task',), timeout=timeout)
         return self.client.get_task(task['id'])
 
+    @logwrap
+    def _events_wait(self, predicate, event_types, timeout,
+                     retry_interval=1):
+        """Waits until predicate is true. Predicate is checked again
+        only when nailgun publishes events of given types (or resets
+        events stream), instead of polling with fixed interval.
+        """
+        deadline = time.time() + timeout
+        since_id = self.client.get_events(timeout=0)['last_id']
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError("Waiting timed out")
+            while True:
+                result = self.client.get_events(
+                    since_id=since_id, timeout=min(remaining, 30))
+                since_id = result['last_id']
+                if result['reset'] or any(
+                        e['type'] in event_types for e in result['events']):
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                if not result['events']:
+                    # nailgun answers at once if too many clients wait
+                    time.sleep(retry_interval)
+
     @logwrap
     def _upload_sample_release(self):
         release_id = self.client.get_grizzly_release_id()
@@ -250,7 +279,8 @@ class BaseNodeTestCase(BaseTestCase):
         """
         for node in devops_nodes:
             node.start()
-        wait(lambda: all(self.nailgun_nodes(devops_nodes)), 15, timeout)
+        self._events_wait(lambda: all(self.nailgun_nodes(devops_nodes)),
+                          ('node', 'notification'), timeout=timeout)
         return self.nailgun_nodes(devops_nodes)
 
     @logwrap
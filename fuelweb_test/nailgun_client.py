@@ -102,6 +102,16 @@ class NailgunClient(object):
     def get_task(self, task_id):
         return self.client.get("/api/tasks/%s" % task_id)
 
+    @logwrap
+    @json_parse
+    def get_events(self, since_id=None, timeout=None):
+        params = []
+        if since_id is not None:
+            params.append("since_id=%s" % since_id)
+        if timeout is not None:
+            params.append("timeout=%s" % timeout)
+        return self.client.get("/api/events/?%s" % "&".join(params))
+
     @logwrap
     @json_parse
     def get_releases(self):
@@ -15,20 +15,176 @@
 #    under the License.
 
 import json
+import zlib
+import base64
 
 import sqlalchemy.types as types
+from sqlalchemy import event
+from sqlalchemy.orm import mapper
+from sqlalchemy.orm.properties import ColumnProperty
+from sqlalchemy.orm.strategies import ColumnLoader
+from sqlalchemy.sql.expression import cast, type_coerce
+
+from nailgun.settings import settings
+
+
+def use_native_json():
+    return bool(settings.DATABASE.get('native_json'))
+
+
+class NativeJSON(types.UserDefinedType):
+    """
+    PostgreSQL json type. Values are passed to and received from
+    database as text, JSON type decorator does the conversion.
+    """
+
+    def get_col_spec(self):
+        return "JSON"
 
 
 class JSON(types.TypeDecorator):
+    """
+    JSON column type.
+
+    Stored in text column or, if native_json is enabled in DATABASE
+    settings, in PostgreSQL json column. When column is loaded as an
+    attribute of mapped object, text is parsed only on the first
+    access to the attribute (see LazyJSONLoader).
+    """
 
     impl = types.Text
 
+    def load_dialect_impl(self, dialect):
+        if use_native_json() and dialect.name == 'postgresql':
+            return dialect.type_descriptor(NativeJSON())
+        return dialect.type_descriptor(types.Text())
+
+    def dumps(self, value):
+        return json.dumps(value)
+
+    def loads(self, text):
+        return json.loads(text)
+
     def process_bind_param(self, value, dialect):
         if value is not None:
-            value = json.dumps(value)
+            value = self.dumps(value)
         return value
 
     def process_result_value(self, value, dialect):
-        if value is not None:
-            value = json.loads(value)
+        if isinstance(value, basestring):
+            value = self.loads(value)
         return value
+
+    @classmethod
+    def raw_column(cls, column):
+        """
+        Returns column expression which is loaded as JSON text.
+        """
+        if use_native_json():
+            return cast(column, types.Text)
+        return type_coerce(column, types.Text)
+
+
+class CompressedJSON(JSON):
+    """
+    JSON column type for big values which are rarely read (e.g. task
+    caches). Stored in text column as base64 of zlib compressed JSON,
+    values stored before compression was enabled are read as is.
+    """
+
+    prefix = "zlib:"
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(types.Text())
+
+    def dumps(self, value):
+        return self.prefix + base64.b64encode(
+            zlib.compress(json.dumps(value))
+        )
+
+    def loads(self, text):
+        if text.startswith(self.prefix):
+            text = zlib.decompress(base64.b64decode(text[len(self.prefix):]))
+        return json.loads(text)
+
+    @classmethod
+    def raw_column(cls, column):
+        return type_coerce(column, types.Text)
+
+
+class RawJSON(object):
+    """
+    JSON text of unparsed attribute value. Installed as loader
+    callable of instance state, so it's called by SQLAlchemy on the
+    first access to the attribute.
+    """
+
+    __slots__ = ('text', 'loads')
+
+    def __init__(self, text, loads=json.loads):
+        self.text = text
+        self.loads = loads
+
+    def __call__(self, passive=None):
+        return self.loads(self.text)
+
+
+class LazyJSONLoader(ColumnLoader):
+    """
+    Loader strategy for JSON columns which puts text of column into
+    instance state instead of parsed value.
+
+    Attribute which wasn't accessed has no value in instance dict,
+    so it has no history and isn't serialized again on flush. Value
+    assigned after attribute was read is serialized only if it
+    differs from read one, value assigned without reading attribute
+    is always written. Expired attributes are parsed at once
+    when they are reloaded.
+    """
+
+    def _raw_columns(self, context, adapter):
+        key = ('lazy_json_columns', self, adapter)
+        if key not in context.attributes:
+            columns = []
+            for c in self.columns:
+                if adapter:
+                    c = adapter.columns[c]
+                columns.append(c.type.raw_column(c))
+            context.attributes[key] = columns
+        return context.attributes[key]
+
+    def setup_query(self, context, entity, path, reduced_path,
+                    adapter, column_collection, **kwargs):
+        column_collection.extend(self._raw_columns(context, adapter))
+
+    def create_row_processor(self, context, path, reduced_path,
+                             mapper, row, adapter):
+        key = self.key
+        loads = self.columns[0].type.loads
+        for col in self._raw_columns(context, adapter):
+            if col in row:
+                def fetch_col(state, dict_, row):
+                    value = row[col]
+                    if value is None:
+                        dict_[key] = None
+                    elif state.callables.get(key) is state:
+                        # expired attributes are being loaded and
+                        # SQLAlchemy expects them in instance dict
+                        dict_[key] = loads(value)
+                    else:
+                        dict_.pop(key, None)
+                        state.callables[key] = RawJSON(value, loads)
+                return fetch_col, None, None
+        return super(LazyJSONLoader, self).create_row_processor(
+            context, path, reduced_path, mapper, row, adapter)
+
+
+@event.listens_for(mapper, 'mapper_configured')
+def _use_lazy_json_loader(mapper_, class_):
+    for prop in mapper_.iterate_properties:
+        if isinstance(prop, ColumnProperty) \
+                and prop.strategy_class is ColumnLoader \
+                and len(prop.columns) == 1 \
+                and isinstance(prop.columns[0].type, JSON):
+            prop.strategy_class = LazyJSONLoader
+            prop.strategy = prop._get_strategy(LazyJSONLoader)
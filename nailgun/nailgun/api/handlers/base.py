@@ -16,6 +16,8 @@
 
 import json
 import uuid
+import zlib
+import types
 from wsgiref.handlers import format_date_time
 from datetime import datetime
 
@@ -58,27 +60,269 @@ def forbid_client_caching(handler):
     return handler()
 
 
+# size of response parts yielded by streaming JSON responses
+JSON_CHUNK_SIZE = 64 * 1024
+# number of objects fetched at once by lazily rendered queries
+JSON_ROWS_BATCH = 100
+
+compact_json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def is_json_data(data):
+    return type(data) in (dict, list) \
+        or isinstance(data, types.GeneratorType)
+
+
 def content_json(func):
     def json_header(*args, **kwargs):
         web.header('Content-Type', 'application/json')
         data = func(*args, **kwargs)
-        return build_json_response(data)
+        if not is_json_data(data):
+            return data
+        chunks = json_chunks(data, pretty=is_pretty_requested())
+        if is_gzip_accepted():
+            web.header('Content-Encoding', 'gzip')
+            web.header('Vary', 'Accept-Encoding')
+            chunks = gzip_chunks(chunks)
+        return chunks
     return json_header
 
 
 def build_json_response(data):
     web.header('Content-Type', 'application/json')
-    if type(data) in (dict, list):
-        return json.dumps(data, indent=4)
+    if is_json_data(data):
+        return ''.join(json_chunks(data, pretty=is_pretty_requested()))
     return data
 
 
+def is_pretty_requested():
+    """
+    Checks if client asked for indented JSON with
+    "pretty" query parameter (e.g. /api/nodes?pretty).
+    """
+    pretty = web.input(_method='get', pretty=None).pretty
+    return pretty is not None and \
+        pretty.lower() not in ('0', 'false', 'no')
+
+
+def is_gzip_accepted():
+    """
+    Checks if client accepts gzip content coding.
+    """
+    accept_encoding = web.ctx.env.get('HTTP_ACCEPT_ENCODING', '')
+    for coding in accept_encoding.split(','):
+        params = [p.strip() for p in coding.split(';')]
+        if params[0].lower() not in ('gzip', 'x-gzip'):
+            continue
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def json_chunks(data, pretty=False):
+    """
+    Yields JSON representation of data by parts.
+
+    Lists and generators (see render_query) are serialized element
+    by element with compact separators, so the whole document is
+    never kept in memory as one string. Pretty printed output is
+    serialized at once.
+
+    :param data: Data to serialize.
+    :type  data: dict, list or generator
+    :param pretty: Indent output.
+    :type  pretty: bool
+    """
+    if pretty:
+        if isinstance(data, types.GeneratorType):
+            data = list(data)
+        yield json.dumps(data, indent=4)
+        return
+    if isinstance(data, dict):
+        yield compact_json_encoder.encode(data)
+        return
+    chunk = ['[']
+    size = 1
+    for i, item in enumerate(data):
+        if i:
+            chunk.append(',')
+        item = compact_json_encoder.encode(item)
+        chunk.append(item)
+        size += len(item) + 1
+        if size >= JSON_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+def render_query(query, render):
+    """
+    Renders objects of query lazily for content_json.
+
+    Query is executed when response body is sent, rows are fetched
+    by batches and every object is serialized right after it's
+    rendered, so neither all objects nor all their JSON are kept
+    in memory. Rendering is done after load_db_driver is left, so
+    transaction is ended here the same way: committed when all
+    objects are rendered and rolled back if rendering failed or
+    client disconnected.
+
+    :param query: Query of objects.
+    :param render: Function which renders one object.
+    :returns: Generator of rendered objects.
+    """
+    try:
+        for instance in query.yield_per(JSON_ROWS_BATCH):
+            yield render(instance)
+    except:
+        db().rollback()
+        raise
+    else:
+        db().commit()
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses parts of response on the fly into gzip stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
 handlers = {}
+serializers = {}
+
+
+class FieldsSerializer(object):
+    """
+    Serializer compiled from handler fields specification.
+
+    Fields are parsed only once and for every model class
+    serializer builds plan - list of functions which know how
+    to render particular attribute, so attributes kinds and
+    nested handlers are not resolved for every rendered object.
+    Plan is built on first rendering of model instance because
+    relationships (including backrefs) are configured by
+    SQLAlchemy only after all models are declared.
+    """
+
+    def __init__(self, fields):
+        self.fields = []
+        for field in fields:
+            if isinstance(field, (tuple,)):
+                subfields = None if field[1] == '*' else field[1:]
+                self.fields.append((field[0], subfields, True))
+            else:
+                self.fields.append((field, None, False))
+        self.plans = {}
+
+    @classmethod
+    def get(cls, fields):
+        key = tuple(fields)
+        if key not in serializers:
+            serializers[key] = cls(fields)
+        return serializers[key]
+
+    def render(self, instance):
+        model = instance.__class__
+        plan = self.plans.get(model)
+        if plan is None:
+            plan = self.plans[model] = self._build_plan(model)
+        json_data = {}
+        for render_field in plan:
+            render_field(instance, json_data)
+        return json_data
+
+    def _build_plan(self, model):
+        plan = []
+        for name, subfields, nested in self.fields:
+            rel, related = self._relation(model, name)
+            if nested:
+                render_field = self._nested_field(
+                    name, rel, self._nested_renderer(related, subfields)
+                )
+            else:
+                render_field = self._plain_field(name, rel)
+            if render_field:
+                plan.append(render_field)
+        return plan
+
+    @classmethod
+    def _relation(cls, model, name):
+        attr = getattr(model, name, None)
+        if not hasattr(attr, "impl"):
+            return None, None
+        rel = attr.impl.__class__.__name__
+        related = None
+        if rel in ('ScalarObjectAttributeImpl', 'CollectionAttributeImpl'):
+            related = attr.property.mapper.class_.__name__
+        return rel, related
+
+    @classmethod
+    def _nested_renderer(cls, related, subfields):
+        def render_nested(value):
+            handler = handlers[value.__class__.__name__]
+            return handler.render(value, fields=subfields)
+
+        handler = handlers.get(related)
+        if handler is None:
+            # handler could be registered later
+            return render_nested
+        if handler.render.im_func is not JSONHandler.render.im_func \
+                or not (subfields or handler.fields):
+            return lambda value: handler.render(value, fields=subfields)
+        return cls.get(subfields or handler.fields).render
+
+    @classmethod
+    def _nested_field(cls, name, rel, render_nested):
+        if rel == 'ScalarObjectAttributeImpl':
+            def render_field(instance, json_data):
+                value = getattr(instance, name)
+                if value is not None:
+                    json_data[name] = render_nested(value)
+        elif rel == 'CollectionAttributeImpl':
+            def render_field(instance, json_data):
+                value = getattr(instance, name)
+                if value is not None:
+                    json_data[name] = map(render_nested, value)
+        else:
+            return None
+        return render_field
+
+    @classmethod
+    def _plain_field(cls, name, rel):
+        if rel == 'ScalarObjectAttributeImpl':
+            def render_field(instance, json_data):
+                value = getattr(instance, name)
+                json_data[name] = None if value is None else value.id
+        elif rel == 'CollectionAttributeImpl':
+            def render_field(instance, json_data):
+                value = getattr(instance, name)
+                json_data[name] = None if value is None else \
+                    [v.id for v in value]
+        else:
+            def render_field(instance, json_data):
+                json_data[name] = getattr(instance, name)
+        return render_field
 
 
 class HandlerRegistrator(type):
     def __init__(cls, name, bases, dct):
         super(HandlerRegistrator, cls).__init__(name, bases, dct)
+        if cls.fields:
+            FieldsSerializer.get(cls.fields)
         if hasattr(cls, 'model'):
             key = cls.model.__name__
             if key in handlers:
@@ -140,49 +384,7 @@ class JSONHandler(object):
 
     @classmethod
     def render(cls, instance, fields=None):
-        json_data = {}
         use_fields = fields if fields else cls.fields
         if not use_fields:
             raise ValueError("No fields for serialize")
-        for field in use_fields:
-            if isinstance(field, (tuple,)):
-                if field[1] == '*':
-                    subfields = None
-                else:
-                    subfields = field[1:]
-
-                value = getattr(instance, field[0])
-                rel = getattr(
-                    instance.__class__, field[0]).impl.__class__.__name__
-                if value is None:
-                    pass
-                elif rel == 'ScalarObjectAttributeImpl':
-                    handler = handlers[value.__class__.__name__]
-                    json_data[field[0]] = handler.render(
-                        value, fields=subfields
-                    )
-                elif rel == 'CollectionAttributeImpl':
-                    if not value:
-                        json_data[field[0]] = []
-                    else:
-                        handler = handlers[value[0].__class__.__name__]
-                        json_data[field[0]] = [
-                            handler.render(v, fields=subfields) for v in value
-                        ]
-            else:
-                value = getattr(instance, field)
-                if value is None:
-                    json_data[field] = value
-                else:
-                    f = getattr(instance.__class__, field)
-                    if hasattr(f, "impl"):
-                        rel = f.impl.__class__.__name__
-                        if rel == 'ScalarObjectAttributeImpl':
-                            json_data[field] = value.id
-                        elif rel == 'CollectionAttributeImpl':
-                            json_data[field] = [v.id for v in value]
-                        else:
-                            json_data[field] = value
-                    else:
-                        json_data[field] = value
-        return json_data
+        return FieldsSerializer.get(use_fields).render(instance)
@@ -14,7 +14,6 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 import traceback
 import web
 import netaddr
@@ -33,6 +32,8 @@ from nailgun.api.validators.cluster import ClusterValidator
 from nailgun.api.validators.cluster import AttributesValidator
 from nailgun.network.manager import NetworkManager
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import render_query
+from nailgun.api.handlers.base import build_json_response
 from nailgun.api.handlers.node import NodeHandler
 from nailgun.api.handlers.tasks import TaskHandler
 from nailgun.task.helpers import TaskHelper
@@ -131,10 +132,7 @@ class ClusterCollectionHandler(JSONHandler):
 
     @content_json
     def GET(self):
-        return map(
-            ClusterHandler.render,
-            db().query(Cluster).all()
-        )
+        return render_query(db().query(Cluster), ClusterHandler.render)
 
     @content_json
     def POST(self):
@@ -175,9 +173,8 @@ class ClusterCollectionHandler(JSONHandler):
                     )
                     netmanager.assign_networks_to_main_interface(node.id)
 
-            raise web.webapi.created(json.dumps(
-                ClusterHandler.render(cluster),
-                indent=4
+            raise web.webapi.created(build_json_response(
+                ClusterHandler.render(cluster)
             ))
         except (
             errors.OutOfVLANs,
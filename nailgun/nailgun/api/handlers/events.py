@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+import web
+
+from nailgun import events
+from nailgun.logger import logger
+from nailgun.api.handlers.base import JSONHandler, content_json
+
+
+class EventCollectionHandler(JSONHandler):
+    """
+    Long polling of changes of tasks, nodes and notifications.
+
+    Client passes 'since_id' - id of the last received event (or
+    nothing on the first request) and gets newer events as soon as
+    they are published or empty list after 'timeout' seconds. Every
+    waiting client holds server thread, so number of waiting clients
+    is limited and others get response at once.
+    """
+
+    # maximum and default timeout in seconds
+    max_timeout = 30
+    # maximum number of clients waiting for events
+    max_waiters = 4
+
+    waiters = 0
+    lock = threading.Lock()
+
+    @content_json
+    def GET(self):
+        user_data = web.input(since_id=None, timeout=None)
+        try:
+            since_id = int(user_data.since_id) \
+                if user_data.since_id else None
+            timeout = float(user_data.timeout) \
+                if user_data.timeout else self.max_timeout
+        except ValueError:
+            logger.debug("Invalid events query: %s", dict(user_data))
+            raise web.badrequest("Invalid 'since_id' or 'timeout' value")
+        timeout = max(0, min(timeout, self.max_timeout))
+
+        cls = self.__class__
+        with cls.lock:
+            if cls.waiters >= cls.max_waiters:
+                timeout = 0
+            cls.waiters += 1
+        try:
+            return events.stream.get(since_id, timeout)
+        finally:
+            with cls.lock:
+                cls.waiters -= 1
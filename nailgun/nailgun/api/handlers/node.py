@@ -14,11 +14,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 import traceback
 from datetime import datetime
 
 import web
+from sqlalchemy.orm import joinedload
 
 from nailgun.db import db
 from nailgun import notifier
@@ -35,9 +35,12 @@ from nailgun.api.validators.node import NodeAttributesValidator
 from nailgun.api.validators.node import NodeVolumesValidator
 from nailgun.api.validators.network import NetAssignmentValidator
 from nailgun.network.manager import NetworkManager
+from nailgun.keepalive.heartbeat import heartbeats
 from nailgun.volumes.manager import VolumeManager
 from nailgun.api.models import Node, NodeAttributes
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import render_query
+from nailgun.api.handlers.base import build_json_response
 from nailgun.api.handlers.base import HandlerRegistrator
 
 
@@ -50,17 +53,49 @@ class NodeHandler(JSONHandler):
     validator = NodeValidator
 
     @classmethod
-    def render(cls, instance, fields=None):
+    def render(cls, instance, fields=None, topology=None):
         json_data = None
         try:
             json_data = JSONHandler.render(instance, fields=cls.fields)
-            network_manager = NetworkManager()
-            json_data['network_data'] = network_manager.get_node_networks(
-                instance.id)
+            if topology:
+                json_data['network_data'] = topology.get_node_networks(
+                    instance)
+            else:
+                network_manager = NetworkManager()
+                json_data['network_data'] = \
+                    network_manager.get_node_networks(instance.id)
         except:
             logger.error(traceback.format_exc())
         return json_data
 
+    @classmethod
+    def collection_renderer(cls):
+        """
+        Returns function which renders nodes using one network
+        topology snapshot per cluster, so number of queries doesn't
+        depend on number of nodes. Nodes are expected to be loaded
+        with their clusters.
+        """
+        network_manager = NetworkManager()
+        topologies = {}
+
+        def render(node):
+            topology = None
+            if node.cluster:
+                if node.cluster_id not in topologies:
+                    topologies[node.cluster_id] = \
+                        network_manager.get_cluster_topology(node.cluster)
+                topology = topologies[node.cluster_id]
+            return cls.render(node, topology=topology)
+        return render
+
+    @classmethod
+    def render_collection(cls, nodes):
+        """
+        Renders list of nodes (see collection_renderer).
+        """
+        return map(cls.collection_renderer(), nodes)
+
     @content_json
     def GET(self, node_id):
         node = self.get_object_or_404(Node, node_id)
@@ -125,15 +160,14 @@ class NodeCollectionHandler(JSONHandler):
     @content_json
     def GET(self):
         user_data = web.input(cluster_id=None)
+        nodes = db().query(Node).options(
+            joinedload('cluster')
+        ).order_by(Node.id)
         if user_data.cluster_id == '':
-            nodes = db().query(Node).filter_by(
-                cluster_id=None).all()
+            nodes = nodes.filter_by(cluster_id=None)
         elif user_data.cluster_id:
-            nodes = db().query(Node).filter_by(
-                cluster_id=user_data.cluster_id).all()
-        else:
-            nodes = db().query(Node).all()
-        return map(NodeHandler.render, nodes)
+            nodes = nodes.filter_by(cluster_id=user_data.cluster_id)
+        return render_query(nodes, NodeHandler.collection_renderer())
 
     @content_json
     def POST(self):
@@ -214,12 +248,12 @@ class NodeCollectionHandler(JSONHandler):
             (cores, ram, hd_size),
             node_id=node.id
         )
-        raise web.webapi.created(json.dumps(
-            NodeHandler.render(node),
-            indent=4
+        raise web.webapi.created(build_json_response(
+            NodeHandler.render(node)
         ))
 
     @content_json
+    @notifier.batched
     def PUT(self):
         data = self.checked_data(
             self.validator.validate_collection_update
@@ -237,13 +271,7 @@ class NodeCollectionHandler(JSONHandler):
             else:
                 node = q.get(nd["id"])
             if is_agent:
-                node.timestamp = datetime.now()
-                if not node.online:
-                    node.online = True
-                    msg = u"Node '{0}' is back online".format(
-                        node.human_readable_name)
-                    logger.info(msg)
-                    notifier.notify("discover", msg, node_id=node.id)
+                NodeAgentHandler.check_in(node)
                 db().commit()
             if nd.get("cluster_id") is None and node.cluster:
                 node.cluster.clear_pending_changes(node_id=node.id)
@@ -319,7 +347,157 @@ class NodeCollectionHandler(JSONHandler):
                         node.id
                     )
                     network_manager.assign_networks_to_main_interface(node.id)
-        return map(NodeHandler.render, nodes_updated)
+        heartbeats.flush_if_due()
+        return NodeHandler.render_collection(nodes_updated)
+
+
+class NodeAgentHandler(JSONHandler):
+    """
+    Check-in of node agents. Only changed node attributes,
+    volumes and NICs are updated and all changes are committed
+    at once, node ids are returned instead of full nodes.
+    """
+
+    validator = NodeValidator
+
+    agent_fields = (
+        'ip',
+        'os_platform',
+        'manufacturer',
+        'platform_name',
+        'status'
+    )
+
+    @content_json
+    def PUT(self):
+        data = self.checked_data(
+            self.validator.validate_agent_update
+        )
+
+        nodes = self.get_nodes_by_mac(data)
+        for nd in data:
+            if not nodes.get(nd["mac"]):
+                raise web.notfound(
+                    "Node with MAC {0} is not found".format(nd["mac"])
+                )
+
+        network_manager = NetworkManager()
+        with notifier.batch():
+            for nd in data:
+                self.update_node(nodes[nd["mac"]], nd, network_manager)
+        db().commit()
+        heartbeats.flush_if_due()
+        return [{"id": nodes[nd["mac"]].id} for nd in data]
+
+    @classmethod
+    def get_nodes_by_mac(cls, data):
+        """
+        Returns dict of nodes by MACs sent by agents. Node is
+        searched by MACs of interfaces from meta if agent's MAC
+        differs from node's one.
+        """
+        macs = [nd["mac"] for nd in data]
+        nodes = dict(
+            (n.mac, n) for n in db().query(Node).filter(Node.mac.in_(macs))
+        )
+
+        ifaces_macs = {}
+        for nd in data:
+            if nd["mac"] not in nodes and 'meta' in nd:
+                ifaces_macs[nd["mac"]] = [
+                    i.get('mac') for i in nd["meta"].get("interfaces", [])
+                ]
+        if ifaces_macs:
+            found = dict(
+                (n.mac, n) for n in db().query(Node).filter(
+                    Node.mac.in_(sum(ifaces_macs.values(), []))
+                )
+            )
+            for mac, macs in ifaces_macs.iteritems():
+                nodes[mac] = next(
+                    (found[m] for m in macs if m in found), None
+                )
+        return nodes
+
+    @classmethod
+    def check_in(cls, node):
+        """
+        Registers heartbeat of node. Timestamp of online node is
+        written later by heartbeats buffer, offline node is switched
+        online at once.
+        """
+        if node.online:
+            heartbeats.touch(node.id)
+            return
+        node.timestamp = datetime.now()
+        node.online = True
+        msg = u"Node '{0}' is back online".format(
+            node.human_readable_name)
+        logger.info(msg)
+        notifier.notify("discover", msg, node_id=node.id)
+
+    @classmethod
+    def update_node(cls, node, nd, network_manager):
+        cls.check_in(node)
+
+        for key in cls.agent_fields:
+            if key not in nd:
+                continue
+            if (key, nd[key]) == ("status", "discover") \
+                    and node.status == "provisioning":
+                # We don't update provisioning back to discover
+                logger.debug(
+                    "Node is already provisioning - "
+                    "status not updated by agent"
+                )
+                continue
+            setattr(node, key, nd[key])
+
+        disks_changed = False
+        interfaces_changed = False
+        if 'meta' in nd:
+            old_meta = node.meta or {}
+            meta = nd['meta']
+            meta.setdefault('interfaces', old_meta.get('interfaces', []))
+            node.update_meta(meta)
+            disks_changed = \
+                node.meta.get('disks') != old_meta.get('disks')
+            interfaces_changed = \
+                node.meta['interfaces'] != old_meta.get('interfaces')
+
+        if not node.attributes:
+            node.attributes = NodeAttributes()
+        disks_amount_changed = False
+        if disks_changed and node.attributes.volumes \
+                and not node.status in ('provisioning', 'deploying'):
+            disks_amount_changed = len(node.meta.get('disks', [])) != len(
+                filter(
+                    lambda d: d["type"] == "disk",
+                    node.attributes.volumes
+                )
+            )
+        if not node.attributes.volumes or disks_amount_changed:
+            try:
+                node.attributes.volumes = \
+                    node.volume_manager.gen_volumes_info()
+                if disks_amount_changed and node.cluster:
+                    node.cluster.add_pending_changes(
+                        "disks",
+                        node_id=node.id
+                    )
+            except Exception as exc:
+                msg = (
+                    "Failed to generate volumes "
+                    "info for node '{0}': '{1}'"
+                ).format(
+                    node.name or node.mac,
+                    str(exc) or "see logs for details"
+                )
+                logger.warning(traceback.format_exc())
+                notifier.notify("error", msg, node_id=node.id)
+
+        if interfaces_changed:
+            network_manager.update_node_interfaces(node)
 
 
 class NodeAttributesHandler(JSONHandler):
@@ -18,8 +18,10 @@ import json
 import logging
 
 import web
+from sqlalchemy import func
 
 from nailgun.db import db
+from nailgun.logger import logger
 from nailgun.api.models import Notification
 from nailgun.api.validators.notification import NotificationValidator
 from nailgun.api.handlers.base import JSONHandler, content_json
@@ -28,7 +30,6 @@ from nailgun.api.handlers.base import JSONHandler, content_json
 class NotificationHandler(JSONHandler):
     fields = (
         "id",
-        "cluster",
         "topic",
         "message",
         "status",
@@ -41,16 +42,10 @@ class NotificationHandler(JSONHandler):
     @classmethod
     def render(cls, instance, fields=None):
         json_data = JSONHandler.render(instance, fields=cls.fields)
-        json_data["time"] = ":".join([
-            instance.datetime.strftime("%H"),
-            instance.datetime.strftime("%M"),
-            instance.datetime.strftime("%S")
-        ])
-        json_data["date"] = "-".join([
-            instance.datetime.strftime("%d"),
-            instance.datetime.strftime("%m"),
-            instance.datetime.strftime("%Y")
-        ])
+        # cluster id is taken from foreign key to avoid loading clusters
+        json_data["cluster"] = instance.cluster_id
+        json_data["time"] = instance.datetime.strftime("%H:%M:%S")
+        json_data["date"] = instance.datetime.strftime("%d-%m-%Y")
         return json_data
 
     @content_json
@@ -73,23 +68,64 @@ class NotificationCollectionHandler(JSONHandler):
 
     validator = NotificationValidator
 
+    # maximum number of notifications returned at once
+    page_size = 1000
+
     @content_json
     def GET(self):
-        user_data = web.input(cluster_id=None)
+        """
+        Returns notifications ordered by id. At most 'limit'
+        notifications are returned: ones with id greater than
+        'since_id' (used for polling of new notifications), or the
+        latest ones with id less than 'before_id' (previous page),
+        or just the latest ones if no cursor is specified.
+        """
+        user_data = web.input(
+            cluster_id=None,
+            since_id=None,
+            before_id=None,
+            limit=None
+        )
+        since_id = self.get_int_param(user_data, 'since_id')
+        before_id = self.get_int_param(user_data, 'before_id')
+        limit = self.get_int_param(user_data, 'limit') or self.page_size
+        if limit < 0:
+            raise web.badrequest("Invalid 'limit' value")
+        limit = min(limit, self.page_size)
+
         query = db().query(Notification)
         if user_data.cluster_id:
             query = query.filter_by(cluster_id=user_data.cluster_id)
-        # Temporarly limit notifications number to prevent bloating UI by
-        # lots of old notifications. Normally, this should be done by querying
-        # separately unread notifications for notifier and use pagination for
-        # list of all notifications
-        query = query.limit(1000)
-        notifications = query.all()
+        if since_id is not None:
+            query = query.filter(Notification.id > since_id)
+        if before_id is not None:
+            query = query.filter(Notification.id < before_id)
+
+        if since_id is not None and before_id is None:
+            notifications = query.order_by(
+                Notification.id
+            ).limit(limit).all()
+        else:
+            notifications = query.order_by(
+                Notification.id.desc()
+            ).limit(limit).all()
+            notifications.reverse()
         return map(
             NotificationHandler.render,
             notifications
         )
 
+    @classmethod
+    def get_int_param(cls, user_data, name):
+        value = user_data.get(name)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            logger.debug("Invalid '%s' value: %s", name, value)
+            raise web.badrequest("Invalid '{0}' value".format(name))
+
     @content_json
     def PUT(self):
         data = self.validator.validate_collection_update(web.data())
@@ -106,3 +142,21 @@ class NotificationCollectionHandler(JSONHandler):
             NotificationHandler.render,
             notifications_updated
         )
+
+
+class NotificationUnreadCountHandler(JSONHandler):
+
+    @content_json
+    def GET(self):
+        """
+        Returns number of unread notifications.
+        """
+        user_data = web.input(cluster_id=None)
+        query = db().query(func.count(Notification.id)).filter(
+            Notification.status == 'unread'
+        )
+        if user_data.cluster_id:
+            query = query.filter(
+                Notification.cluster_id == user_data.cluster_id
+            )
+        return {"unread": query.scalar()}
@@ -14,8 +14,6 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
-
 import web
 
 from nailgun.db import db
@@ -23,6 +21,8 @@ from nailgun.errors import errors
 from nailgun.api.models import Release
 from nailgun.api.validators.release import ReleaseValidator
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import render_query
+from nailgun.api.handlers.base import build_json_response
 
 
 class ReleaseHandler(JSONHandler):
@@ -69,10 +69,7 @@ class ReleaseCollectionHandler(JSONHandler):
 
     @content_json
     def GET(self):
-        return map(
-            ReleaseHandler.render,
-            db().query(Release).all()
-        )
+        return render_query(db().query(Release), ReleaseHandler.render)
 
     @content_json
     def POST(self):
@@ -83,7 +80,6 @@ class ReleaseCollectionHandler(JSONHandler):
             setattr(release, key, value)
         db().add(release)
         db().commit()
-        raise web.webapi.created(json.dumps(
-            ReleaseHandler.render(release),
-            indent=4
+        raise web.webapi.created(build_json_response(
+            ReleaseHandler.render(release)
         ))
@@ -21,6 +21,7 @@ import web
 from nailgun.db import db
 from nailgun.api.models import Task
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import render_query
 
 
 class TaskHandler(JSONHandler):
@@ -62,13 +63,10 @@ class TaskCollectionHandler(JSONHandler):
         user_data = web.input(cluster_id=None)
         if user_data.cluster_id == '':
             tasks = db().query(Task).filter_by(
-                cluster_id=None).all()
+                cluster_id=None)
         elif user_data.cluster_id:
             tasks = db().query(Task).filter_by(
-                cluster_id=user_data.cluster_id).all()
+                cluster_id=user_data.cluster_id)
         else:
-            tasks = db().query(Task).all()
-        return map(
-            TaskHandler.render,
-            tasks
-        )
+            tasks = db().query(Task)
+        return render_query(tasks, TaskHandler.render)
@@ -27,7 +27,7 @@ import web
 from netaddr import IPNetwork
 from sqlalchemy import Column, UniqueConstraint, Table
 from sqlalchemy import Integer, String, Unicode, Text, Boolean, Float
-from sqlalchemy import ForeignKey, Enum, DateTime
+from sqlalchemy import ForeignKey, Enum, DateTime, Index
 from sqlalchemy import create_engine
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
@@ -35,7 +35,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from nailgun.logger import logger
 from nailgun.db import db
 from nailgun.volumes.manager import VolumeManager
-from nailgun.api.fields import JSON
+from nailgun.api.fields import JSON, CompressedJSON
 from nailgun.settings import settings
 
 Base = declarative_base()
@@ -235,21 +235,39 @@ class Node(Base):
 
     @property
     def needs_reprovision(self):
-        return self.status == 'error' and self.error_type == 'provision'
+        return self.check_needs_reprovision(self)
 
     @property
     def needs_redeploy(self):
         changes = []
         if self.cluster is not None:
-            def check_change(change):
-                return change.name != 'disks' or change.node_id == self.id
-            changes = filter(check_change, self.cluster.changes)
+            changes = self.cluster.changes
+        return self.check_needs_redeploy(self, changes)
+
+    @classmethod
+    def check_needs_reprovision(cls, node):
+        """
+        Rule of needs_reprovision for node object
+        or row with node columns.
+        """
+        return node.status == 'error' and node.error_type == 'provision'
+
+    @classmethod
+    def check_needs_redeploy(cls, node, changes):
+        """
+        Rule of needs_redeploy for node object or row with node
+        columns and changes of its cluster (objects or rows with
+        name and node_id).
+        """
+        def check_change(change):
+            return change.name != 'disks' or change.node_id == node.id
+        changes = filter(check_change, changes)
         cases = [
-            self.status == 'error' and self.error_type == 'deploy',
+            node.status == 'error' and node.error_type == 'deploy',
             changes != []
         ]
         and_cases = [
-            not self.pending_deletion
+            not node.pending_deletion
         ]
         return any(cases) and all(and_cases)
 
@@ -575,7 +593,7 @@ class Task(Base):
         default='running'
     )
     progress = Column(Integer, default=0)
-    cache = Column(JSON, default={})
+    cache = Column(CompressedJSON, default={})
     result = Column(JSON, default={})
     parent_id = Column(Integer, ForeignKey('tasks.id'))
     subtasks = relationship(
@@ -644,6 +662,14 @@ class Notification(Base):
     datetime = Column(DateTime, nullable=False)
 
 
+# unread notifications are counted and listed by time
+Index(
+    'notifications_status_datetime_idx',
+    Notification.status,
+    Notification.datetime
+)
+
+
 class L2Topology(Base):
     __tablename__ = 'l2_topologies'
     id = Column(Integer, primary_key=True)
@@ -34,6 +34,7 @@ from nailgun.api.handlers.release import ReleaseCollectionHandler
 from nailgun.api.handlers.node import NodesAllocationStatsHandler
 from nailgun.api.handlers.node import NodeHandler
 from nailgun.api.handlers.node import NodeCollectionHandler
+from nailgun.api.handlers.node import NodeAgentHandler
 from nailgun.api.handlers.node import NodeAttributesHandler
 from nailgun.api.handlers.node import NodeAttributesDefaultsHandler
 from nailgun.api.handlers.node import NodeAttributesByNameHandler
@@ -49,6 +50,9 @@ from nailgun.api.handlers.tasks import TaskCollectionHandler
 
 from nailgun.api.handlers.notifications import NotificationHandler
 from nailgun.api.handlers.notifications import NotificationCollectionHandler
+from nailgun.api.handlers.notifications import NotificationUnreadCountHandler
+
+from nailgun.api.handlers.events import EventCollectionHandler
 
 from nailgun.api.handlers.logs import LogEntryCollectionHandler
 from nailgun.api.handlers.logs import LogPackageHandler
@@ -83,6 +87,8 @@ urls = (
     'NetworkConfigurationVerifyHandler',
     r'/nodes/?$',
     'NodeCollectionHandler',
+    r'/nodes/agent/?$',
+    'NodeAgentHandler',
     r'/nodes/(?P<node_id>\d+)/?$',
     'NodeHandler',
     r'/nodes/(?P<node_id>\d+)/attributes/?$',
@@ -111,8 +117,12 @@ urls = (
     'TaskHandler',
     r'/notifications/?$',
     'NotificationCollectionHandler',
+    r'/notifications/unread/?$',
+    'NotificationUnreadCountHandler',
     r'/notifications/(?P<notification_id>\d+)/?$',
     'NotificationHandler',
+    r'/events/?$',
+    'EventCollectionHandler',
     r'/logs/?$',
     'LogEntryCollectionHandler',
     r'/logs/package/?$',
@@ -189,6 +189,32 @@ class NodeValidator(BasicValidator):
                 nd['meta'] = MetaValidator.validate_update(nd['meta'])
         return d
 
+    @classmethod
+    def validate_agent_update(cls, data):
+        d = cls.validate_json(data)
+        if isinstance(d, dict):
+            d = [d]
+        if not isinstance(d, list):
+            raise errors.InvalidData(
+                "Invalid json list",
+                log_message=True
+            )
+
+        for nd in d:
+            if not isinstance(nd, dict) or not nd.get("mac"):
+                raise errors.InvalidData(
+                    "MAC is not specified",
+                    log_message=True
+                )
+            if "status" in nd and nd["status"] not in Node.NODE_STATUSES:
+                raise errors.InvalidData(
+                    "Invalid status for node",
+                    log_message=True
+                )
+            if 'meta' in nd:
+                nd['meta'] = MetaValidator.validate_update(nd['meta'])
+        return d
+
 
 class NodeAttributesValidator(BasicValidator):
     pass
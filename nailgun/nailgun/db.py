@@ -20,7 +20,6 @@ import web
 import contextlib
 import threading
 from sqlalchemy.orm import scoped_session, sessionmaker
-from sqlalchemy.orm.query import Query
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy import create_engine
 
@@ -35,24 +34,16 @@ db_str = "{engine}://{user}:{passwd}@{host}:{port}/{name}".format(
 engine = create_engine(db_str, client_encoding='utf8')
 
 
-class NoCacheQuery(Query):
-    """
-    Override for common Query class.
-    Needed for automatic refreshing objects
-    from database during every query for evading
-    problems with multiple sessions
-    """
-    def __init__(self, *args, **kwargs):
-        self._populate_existing = True
-        super(NoCacheQuery, self).__init__(*args, **kwargs)
-
-
+# Session keeps its identity map during request (or RPC message)
+# processing, it's expired only when processing is finished. Code which
+# polls objects modified concurrently by another thread (RPC consumer,
+# fake tasks) has to refresh them explicitly with db().refresh(obj) or
+# query.populate_existing().
 db = scoped_session(
     sessionmaker(
         autoflush=True,
         autocommit=False,
-        bind=engine,
-        query_cls=NoCacheQuery
+        bind=engine
     )
 )
 
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import threading
+from collections import deque
+
+
+class EventStream(object):
+    """
+    In-memory stream of changes (tasks, nodes, notifications)
+    for clients which wait for them instead of polling collections.
+
+    Events are numbered and kept in a ring buffer, so client passes
+    id of the last received event and gets only newer ones. Events
+    should be published after changes are committed.
+    """
+
+    def __init__(self, size=1000):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=size)
+        self.last_id = 0
+
+    def publish(self, event_type, data):
+        """
+        Adds event to stream and wakes up waiting clients.
+
+        :param event_type: Kind of changed object: task, node
+        or notification.
+        :type  event_type: str
+        :param data: Changed attributes of object.
+        :type  data: dict
+        """
+        with self.condition:
+            self.last_id += 1
+            self.events.append({
+                "id": self.last_id,
+                "type": event_type,
+                "data": data
+            })
+            self.condition.notify_all()
+
+    def get(self, since_id=None, timeout=0):
+        """
+        Returns events published after event with since_id, waiting
+        for them at most timeout seconds.
+
+        :param since_id: Id of the last event received by client,
+        current events aren't returned if it isn't specified.
+        :type  since_id: int
+        :param timeout: How long to wait for events.
+        :type  timeout: float
+        :returns: Dict with list of events, id of the last event
+        and 'reset' flag which is set if some events after since_id
+        were dropped from buffer, so client should refetch objects.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            if since_id is None:
+                since_id = self.last_id
+            while self.last_id <= since_id:
+                remaining = deadline - time.time()
+                if remaining <= 0 or since_id > self.last_id:
+                    break
+                self.condition.wait(remaining)
+            first_id = self.events[0]["id"] if self.events \
+                else self.last_id + 1
+            return {
+                "last_id": self.last_id,
+                "reset": since_id > self.last_id or since_id < first_id - 1,
+                "events": [e for e in self.events if e["id"] > since_id]
+            }
+
+
+def task_data(task):
+    return {
+        "id": task.id,
+        "uuid": task.uuid,
+        "name": task.name,
+        "cluster": task.cluster_id,
+        "status": task.status,
+        "progress": task.progress,
+        "message": task.message
+    }
+
+
+def node_data(node):
+    return {
+        "id": node.id,
+        "cluster": node.cluster_id,
+        "status": node.status,
+        "progress": node.progress,
+        "online": node.online,
+        "error_type": node.error_type
+    }
+
+
+stream = EventStream()
+
+
+def publish_task(task):
+    stream.publish("task", task_data(task))
+
+
+def publish_nodes(nodes):
+    for node in nodes:
+        stream.publish("node", node_data(node))
+
+
+def publish_notifications(notifications):
+    # data has the same fields as rendered by NotificationHandler,
+    # so clients can add it to notifications collection as is
+    for n in notifications:
+        stream.publish("notification", {
+            "id": n["id"],
+            "topic": n["topic"],
+            "message": n["message"],
+            "status": n["status"],
+            "cluster": n.get("cluster_id"),
+            "node_id": n.get("node_id"),
+            "task_id": n.get("task_id"),
+            "time": n["datetime"].strftime("%H:%M:%S"),
+            "date": n["datetime"].strftime("%d-%m-%Y")
+        })
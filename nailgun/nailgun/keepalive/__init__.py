@@ -13,6 +13,7 @@
 #    under the License.
 
 
+from heartbeat import heartbeats
 from watcher import KeepAliveThread
 from nailgun.api.models import Node
 
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import threading
+from datetime import datetime
+
+from sqlalchemy.sql import text
+
+from nailgun.db import engine
+from nailgun.settings import settings
+from nailgun.api.models import Node
+from nailgun.logger import logger
+
+
+class HeartbeatBuffer(object):
+    """
+    Write-behind buffer of agents heartbeats.
+
+    Heartbeat of online node only moves node's timestamp, so instead
+    of updating node on every agent's request timestamps are kept in
+    memory, coalesced by node id and written with a single UPDATE
+    at most once per flush interval.
+    """
+
+    # maximum number of rows in one UPDATE statement
+    batch_size = 1000
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval or \
+            settings.KEEPALIVE['flush_interval']
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_seen = {}
+        self.last_flush = time.time()
+
+    def touch(self, node_id, timestamp=None):
+        """
+        Registers heartbeat of node.
+
+        :param node_id: Node id.
+        :type  node_id: int
+        :param timestamp: Time of heartbeat, now if not specified.
+        :type  timestamp: datetime
+        """
+        timestamp = timestamp or datetime.now()
+        with self.lock:
+            if self.pending.get(node_id, timestamp) <= timestamp:
+                self.pending[node_id] = timestamp
+            if self.last_seen.get(node_id, timestamp) <= timestamp:
+                self.last_seen[node_id] = timestamp
+
+    def seen_since(self, since):
+        """
+        Returns ids of nodes which sent heartbeats after given time,
+        including heartbeats which are already flushed. Older
+        heartbeats are forgotten.
+
+        :param since: Time of oldest heartbeat.
+        :type  since: datetime
+        :returns: Set of node ids.
+        """
+        with self.lock:
+            for node_id, timestamp in self.last_seen.items():
+                if timestamp <= since:
+                    del self.last_seen[node_id]
+            return set(self.last_seen)
+
+    def flush_if_due(self):
+        """
+        Flushes buffer if flush interval is passed since last flush.
+        Should be called outside of transactions which modify nodes.
+        """
+        if time.time() - self.last_flush >= self.flush_interval:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """
+        Writes buffered timestamps into database in its own
+        transaction. Timestamps are never moved back.
+
+        :returns: Number of flushed heartbeats.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.time()
+        if not pending:
+            return 0
+
+        items = pending.items()
+        try:
+            with engine.begin() as conn:
+                for i in xrange(0, len(items), self.batch_size):
+                    self._update(conn, items[i:i + self.batch_size])
+        except Exception:
+            with self.lock:
+                for node_id, timestamp in items:
+                    if self.pending.get(node_id, timestamp) <= timestamp:
+                        self.pending[node_id] = timestamp
+            raise
+        logger.debug("Flushed %d heartbeats", len(items))
+        return len(items)
+
+    def _update(self, conn, items):
+        values = []
+        params = {}
+        for i, (node_id, timestamp) in enumerate(items):
+            values.append(
+                "(:id_{0}, CAST(:ts_{0} AS timestamp))".format(i)
+            )
+            params["id_{0}".format(i)] = node_id
+            params["ts_{0}".format(i)] = timestamp
+        conn.execute(
+            text(
+                "UPDATE {0} SET timestamp = v.ts "
+                "FROM (VALUES {1}) AS v(id, ts) "
+                "WHERE {0}.id = v.id AND {0}.timestamp < v.ts".format(
+                    Node.__table__.name,
+                    ", ".join(values)
+                )
+            ),
+            **params
+        )
+
+
+heartbeats = HeartbeatBuffer()
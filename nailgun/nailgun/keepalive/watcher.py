@@ -14,31 +14,32 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import math
 import time
 import threading
 import traceback
 from datetime import datetime, timedelta
 from itertools import repeat
-from sqlalchemy.sql import not_
+from sqlalchemy.sql import and_, not_
 
 from nailgun import notifier
 from nailgun.db import db
 from nailgun.settings import settings
 from nailgun.api.models import Node
+from nailgun.task.helpers import nodes_progress
+from nailgun.keepalive.heartbeat import heartbeats as default_heartbeats
 from nailgun.logger import logger
 
 
 class KeepAliveThread(threading.Thread):
 
-    def __init__(self, interval=None, timeout=None):
+    def __init__(self, interval=None, timeout=None, heartbeats=None):
         super(KeepAliveThread, self).__init__()
         self.stop_status_checking = threading.Event()
         self.interval = interval or settings.KEEPALIVE['interval']
         self.timeout = timeout or settings.KEEPALIVE['timeout']
-
-    def reset_nodes_timestamp(self):
-        db().query(Node).update({'timestamp': datetime.now()})
-        db().commit()
+        self.heartbeats = heartbeats or default_heartbeats
+        self.started_at = datetime.now()
 
     def join(self, timeout=None):
         self.stop_status_checking.set()
@@ -47,13 +48,15 @@ class KeepAliveThread(threading.Thread):
     def sleep(self, interval=None):
         map(
             lambda i: not self.stop_status_checking.isSet() and time.sleep(i),
-            repeat(1, interval or self.interval)
+            repeat(1, int(math.ceil(interval or self.interval)))
         )
 
     def run(self):
         while True:
             try:
-                self.reset_nodes_timestamp()
+                # nodes had no chance to check in while we were down,
+                # so they aren't checked until timeout is passed
+                self.started_at = datetime.now()
                 while not self.stop_status_checking.isSet():
                     self.update_status_nodes()
                     self.sleep()
@@ -65,20 +68,52 @@ class KeepAliveThread(threading.Thread):
             if self.stop_status_checking.isSet():
                 break
 
+    def _watched_nodes(self):
+        nodes = Node.__table__
+        return and_(
+            nodes.c.online,
+            not_(nodes.c.status == 'provisioning')
+        )
+
     def update_status_nodes(self):
-        to_update = db().query(Node).filter(
-            not_(Node.status == 'provisioning')
-        ).filter(
-            datetime.now() > (Node.timestamp + timedelta(seconds=self.timeout))
-        ).filter_by(
-            online=True
+        """
+        Switches expired nodes offline with a single UPDATE and creates
+        notifications for all of them at once. Checks are done once per
+        interval, so all nodes which expired during the interval (e.g.
+        after rack power loss) are processed in one transaction.
+
+        :returns: Number of nodes which went offline.
+        """
+        # buffered heartbeats are written before checking timestamps,
+        # nodes which checked in after that are skipped as well
+        self.heartbeats.flush()
+        deadline = datetime.now() - timedelta(seconds=self.timeout)
+        if self.started_at >= deadline:
+            return 0
+
+        nodes = Node.__table__
+        condition = and_(
+            self._watched_nodes(),
+            nodes.c.timestamp < deadline
+        )
+        seen = self.heartbeats.seen_since(deadline)
+        if seen:
+            condition = and_(condition, not_(nodes.c.id.in_(seen)))
+
+        gone = db().execute(
+            nodes.update().where(condition).values(
+                online=False
+            ).returning(nodes.c.id, nodes.c.name, nodes.c.mac)
+        ).fetchall()
+        nodes_progress.invalidate(
+            nodes_ids=[node_id for node_id, name, mac in gone]
         )
-        for node_db in to_update:
-            notifier.notify(
-                "error",
-                u"Node '{0}' has gone away".format(
-                    node_db.human_readable_name),
-                node_id=node_db.id
-            )
-        to_update.update({"online": False})
-        db().commit()
+        notifier.notify_many([
+            {
+                "topic": "error",
+                "message": u"Node '{0}' has gone away".format(name or mac),
+                "node_id": node_id
+            }
+            for node_id, name, mac in gone
+        ])
+        return len(gone)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from bisect import bisect_left, insort
+
+from netaddr import IPAddress, AddrFormatError
+
+from nailgun.db import db
+from nailgun.errors import errors
+from nailgun.api.models import IPAddr
+
+
+class IPAddrAllocator(object):
+    """
+    Allocator of free IP addresses within IP ranges of
+    network group.
+
+    Used addresses are fetched from database only once and kept
+    as sorted list of integers, so free addresses are found by walking
+    gaps between them instead of querying database for every candidate.
+    Addresses handed out by allocator are marked as used, so one
+    allocator can serve several allocations before they are flushed.
+    """
+
+    def __init__(self, network_group, used_ips=None):
+        """
+        :param network_group: NetworkGroup object.
+        :type  network_group: NetworkGroup
+        :param used_ips: Set of used IP addresses as integers,
+        loaded from database if not specified.
+        :type  used_ips: set
+        """
+        self.ranges = self._merge_ranges([
+            (int(IPAddress(r.first)), int(IPAddress(r.last)))
+            for r in network_group.ip_ranges
+        ])
+        if used_ips is None:
+            used_ips = self.get_used_ips()
+        if network_group.gateway:
+            used_ips = used_ips | set([int(IPAddress(network_group.gateway))])
+        self.used = sorted(filter(self._in_ranges, used_ips))
+
+    @classmethod
+    def get_used_ips(cls):
+        """
+        Returns set of all IP addresses stored in database as integers.
+        """
+        used = set()
+        for (ip_addr,) in db().query(IPAddr.ip_addr):
+            try:
+                used.add(int(IPAddress(ip_addr)))
+            except (AddrFormatError, ValueError):
+                continue
+        return used
+
+    @classmethod
+    def _merge_ranges(cls, ranges):
+        merged = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+        return merged
+
+    def _in_ranges(self, ip):
+        for first, last in self.ranges:
+            if first <= ip <= last:
+                return True
+        return False
+
+    def __iter__(self):
+        """
+        Iterates over free IP addresses in all ranges.
+        """
+        for first, last in self.ranges:
+            cursor = first
+            for ip in self.used[bisect_left(self.used, first):]:
+                if ip > last:
+                    break
+                for free in xrange(cursor, ip):
+                    yield IPAddress(free)
+                cursor = ip + 1
+            for free in xrange(cursor, last + 1):
+                yield IPAddress(free)
+
+    def allocate(self, num=1):
+        """
+        Returns list of free IP addresses and marks them as used.
+
+        :param num: Number of IP addresses to return.
+        :type  num: int
+        :returns: List of IP addresses as strings.
+        :raises: errors.OutOfIPs
+        """
+        free_ips = []
+        if num > 0:
+            for ip in self:
+                free_ips.append(ip)
+                if len(free_ips) == num:
+                    break
+        if len(free_ips) < num:
+            raise errors.OutOfIPs()
+        for ip in free_ips:
+            insort(self.used, int(ip))
+        return map(str, free_ips)
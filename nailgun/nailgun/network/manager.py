@@ -15,7 +15,7 @@
 #    under the License.
 
 import math
-from itertools import imap, ifilter, islice, chain, tee
+from itertools import imap, islice
 
 import web
 from sqlalchemy.sql import not_
@@ -28,6 +28,8 @@ from nailgun.settings import settings
 from nailgun.api.models import NetworkAssignment
 from nailgun.api.models import Node, NodeNICInterface, IPAddr, Cluster, Vlan
 from nailgun.api.models import Network, NetworkGroup, IPAddrRange
+from nailgun.network.allocator import IPAddrAllocator
+from nailgun.network.topology import ClusterNetworkTopology
 
 
 class NetworkManager(object):
@@ -63,7 +65,7 @@ class NetworkManager(object):
         ).first()
         if not admin_net and fail_if_not_found:
             raise errors.AdminNetworkNotFound()
-        return admin_net.id
+        return admin_net.id if admin_net else None
 
     def create_network_groups(self, cluster_id):
         '''
@@ -222,32 +224,67 @@ class NetworkManager(object):
         :type  num: int
         :returns: None
         '''
-        admin_net_id = self.get_admin_network_id()
-        node_admin_ips = db().query(IPAddr).filter_by(
-            node=node_id,
-            network=admin_net_id
-        ).all()
+        self.bulk_assign_admin_ips({node_id: num})
+
+    def bulk_assign_admin_ips(self, nodes_nums):
+        '''
+        Assigns admin IP addresses to several nodes at once.
+
+        Existing admin addresses of all nodes are fetched with
+        one query, missing addresses are allocated in memory and
+        stored with one INSERT statement and one commit.
+
+        :param nodes_nums: Number of IP addresses for every node,
+        keyed by node database ID.
+        :type  nodes_nums: dict
+        :returns: Dict of lists of admin IP addresses of nodes,
+        keyed by node database ID.
+        :raises: errors.AdminNetworkNotFound, errors.OutOfIPs
+        '''
+        admin_ips = dict((node_id, []) for node_id in nodes_nums)
+        if not nodes_nums:
+            return admin_ips
 
-        if not node_admin_ips or len(node_admin_ips) < num:
-            admin_net = db().query(Network).get(admin_net_id)
+        admin_net = db().query(Network).filter_by(
+            name="fuelweb_admin"
+        ).first()
+        if not admin_net:
+            raise errors.AdminNetworkNotFound()
+
+        for node_id, ip_addr in db().query(
+            IPAddr.node,
+            IPAddr.ip_addr
+        ).filter(
+            IPAddr.node.in_(nodes_nums.keys())
+        ).filter_by(
+            network=admin_net.id
+        ).order_by(IPAddr.id):
+            admin_ips[node_id].append(ip_addr)
+
+        missing = [
+            (node_id, num - len(admin_ips[node_id]))
+            for node_id, num in sorted(nodes_nums.iteritems())
+            if num > len(admin_ips[node_id])
+        ]
+        if missing:
             logger.debug(
-                u"Trying to assign admin ips: node=%s count=%s",
-                node_id,
-                num - len(node_admin_ips)
-            )
-            free_ips = self.get_free_ips(
-                admin_net.network_group.id,
-                num=num - len(node_admin_ips)
+                u"Trying to assign admin ips: %s",
+                ", ".join("node=%s count=%s" % m for m in missing)
             )
-            logger.info(len(free_ips))
-            for ip in free_ips:
-                ip_db = IPAddr(
-                    node=node_id,
-                    ip_addr=ip,
-                    network=admin_net_id
-                )
-                db().add(ip_db)
+            allocator = IPAddrAllocator(admin_net.network_group)
+            free_ips = iter(allocator.allocate(sum(c for _, c in missing)))
+            new_ips = []
+            for node_id, count in missing:
+                for ip in islice(free_ips, count):
+                    admin_ips[node_id].append(ip)
+                    new_ips.append({
+                        'network': admin_net.id,
+                        'node': node_id,
+                        'ip_addr': ip
+                    })
+            db().execute(IPAddr.__table__.insert(), new_ips)
             db().commit()
+        return admin_ips
 
     def assign_ips(self, nodes_ids, network_name):
         """
@@ -266,11 +303,35 @@ class NetworkManager(object):
         :returns: None
         :raises: Exception, errors.AssignIPError
         """
+        self.bulk_assign_ips(nodes_ids, [network_name])
+
+    def bulk_assign_ips(self, nodes_ids, networks_names):
+        """
+        Idempotent assignment IP addresses to nodes
+        from several networks at once.
 
-        cluster_id = db().query(Node).get(nodes_ids[0]).cluster_id
+        Existing addresses of all nodes are fetched with one query,
+        free addresses are allocated in memory and new addresses
+        are stored with one INSERT statement and one commit.
+
+        :param node_ids: List of nodes IDs in database.
+        :type  node_ids: list
+        :param networks_names: List of networks names
+        :type  networks_names: list
+        :returns: None
+        :raises: Exception, errors.AssignIPError
+        """
+        if not nodes_ids:
+            return
+
+        nodes_clusters = dict(
+            db().query(Node.id, Node.cluster_id).filter(
+                Node.id.in_(nodes_ids)
+            )
+        )
+        cluster_id = nodes_clusters.get(nodes_ids[0])
         for node_id in nodes_ids:
-            node = db().query(Node).get(node_id)
-            if node.cluster_id != cluster_id:
+            if nodes_clusters.get(node_id) != cluster_id:
                 raise Exception(
                     u"Node id='{0}' doesn't belong to cluster_id='{1}'".format(
                         node_id,
@@ -278,45 +339,61 @@ class NetworkManager(object):
                     )
                 )
 
-        network = db().query(Network).join(NetworkGroup).\
-            filter(NetworkGroup.cluster_id == cluster_id).\
-            filter_by(name=network_name).first()
-
-        if not network:
-            raise errors.AssignIPError(
-                u"Network '%s' for cluster_id=%s not found." %
-                (network_name, cluster_id)
-            )
-
-        for node_id in nodes_ids:
-            node_ips = imap(
-                lambda i: i.ip_addr,
-                self._get_ips_except_admin(
-                    node_id=node_id,
-                    network_id=network.id
+        networks = {}
+        for net in db().query(Network).join(NetworkGroup).\
+                filter(NetworkGroup.cluster_id == cluster_id).\
+                filter(Network.name.in_(networks_names)).\
+                order_by(Network.id):
+            networks.setdefault(net.name, net)
+
+        for network_name in networks_names:
+            if network_name not in networks:
+                raise errors.AssignIPError(
+                    u"Network '%s' for cluster_id=%s not found." %
+                    (network_name, cluster_id)
                 )
-            )
-            # check if any of node_ips in required ranges
-            for ip in node_ips:
-                if self.check_ip_belongs_to_net(ip, network):
-                    logger.info(
-                        u"Node id='{0}' already has an IP address "
-                        "inside '{1}' network.".format(
-                            node.id,
-                            network.name
-                        )
-                    )
-                    continue
 
-            # IP address has not been assigned, let's do it
-            free_ip = self.get_free_ips(network.network_group.id)[0]
-            ip_db = IPAddr(
-                network=network.id,
-                node=node_id,
-                ip_addr=free_ip
+        assigned = set()
+        networks_by_id = dict((n.id, n) for n in networks.itervalues())
+        for ip in db().query(IPAddr).filter(
+            IPAddr.node.in_(nodes_ids)
+        ).filter(
+            IPAddr.network.in_(networks_by_id.keys())
+        ):
+            network = networks_by_id[ip.network]
+            if self.check_ip_belongs_to_net(ip.ip_addr, network):
+                logger.info(
+                    u"Node id='{0}' already has an IP address "
+                    "inside '{1}' network.".format(
+                        ip.node,
+                        network.name
+                    )
+                )
+                assigned.add((ip.node, ip.network))
+
+        used_ips = IPAddrAllocator.get_used_ips()
+        new_ips = []
+        for network_name in networks_names:
+            network = networks[network_name]
+            nodes_without_ip = filter(
+                lambda node_id: (node_id, network.id) not in assigned,
+                nodes_ids
             )
-            db().add(ip_db)
-            db().commit()
+            if not nodes_without_ip:
+                continue
+            allocator = IPAddrAllocator(network.network_group, used_ips)
+            free_ips = allocator.allocate(len(nodes_without_ip))
+            for node_id, free_ip in zip(nodes_without_ip, free_ips):
+                new_ips.append({
+                    'network': network.id,
+                    'node': node_id,
+                    'ip_addr': free_ip
+                })
+                used_ips.add(int(IPAddress(free_ip)))
+
+        if new_ips:
+            db().execute(IPAddr.__table__.insert(), new_ips)
+        db().commit()
 
     def assign_vip(self, cluster_id, network_name):
         """
@@ -376,39 +453,12 @@ class NetworkManager(object):
 
     def clear_vlans(self):
         """
-        Removes from DB all Vlans without Networks assigned to them.
-        """
-        map(
-            db().delete,
-            db().query(Vlan).filter_by(network=None)
-        )
-        db().commit()
-
-    @classmethod
-    def _chunked_range(cls, iterable, chunksize=64):
-        """
-        We want to be able to iterate over iterable chunk by chunk.
-        We instantiate iter object from itarable. We then yield
-        iter instance slice in infinite loop. Iter slice starts
-        from the last used position and finishes on the position
-        which is offset with chunksize from the last used position.
-
-        :param iterable: Iterable object.
-        :type  iterable: iterable
-        :param chunksize: Size of chunk to iterate through.
-        :type  chunksize: int
-        :yields: iterator
-        :raises: StopIteration
+        Removes from DB all Vlans without Networks assigned to them
+        with one DELETE statement, caller should commit.
         """
-        it = iter(iterable)
-        while True:
-            s = islice(it, chunksize)
-            # Here we check if iterator is not empty calling
-            # next() method which raises StopInteration if
-            # iter is empty. If iter is not empty we yield
-            # iterator which is concatenation of fisrt element in
-            # slice and the ramained elements.
-            yield chain([s.next()], s)
+        db().query(Vlan).filter(
+            ~Vlan.network.any()
+        ).delete(synchronize_session=False)
 
     def check_ip_belongs_to_net(self, ip_addr, network):
         addr = IPAddress(ip_addr)
@@ -426,57 +476,14 @@ class NetworkManager(object):
         Represents iterator over free IP addresses
         in all ranges for given Network Group
         """
-        for ip_addr in ifilter(
-            lambda ip: db().query(IPAddr).filter_by(
-                ip_addr=str(ip)
-            ).first() is None and not ip == network_group.gateway,
-            chain(*[
-                IPRange(ir.first, ir.last)
-                for ir in network_group.ip_ranges
-            ])
-        ):
-            yield ip_addr
+        return iter(IPAddrAllocator(network_group))
 
     def get_free_ips(self, network_group_id, num=1):
         """
         Returns list of free IP addresses for given Network Group
         """
         ng = db().query(NetworkGroup).get(network_group_id)
-        free_ips = []
-        for ip in self._iter_free_ips(ng):
-            free_ips.append(str(ip))
-            if len(free_ips) == num:
-                break
-        if len(free_ips) < num:
-            raise errors.OutOfIPs()
-        return free_ips
-
-    def _get_free_ips_from_range(self, iterable, num=1):
-        """
-        Method for receiving free IP addresses from range.
-
-        :param iterable: Iterable object with IP addresses.
-        :type  iterable: iterable
-        :param num: Number of IP addresses to return.
-        :type  num: int
-        :returns: List of free IP addresses from given range.
-        :raises: errors.OutOfIPs
-        """
-        free_ips = []
-        for chunk in self._chunked_range(iterable):
-            from_range = set(chunk)
-            diff = from_range - set(
-                [i.ip_addr for i in db().query(IPAddr).
-                 filter(IPAddr.ip_addr.in_(from_range))]
-            )
-            while len(free_ips) < num:
-                try:
-                    free_ips.append(diff.pop())
-                except KeyError:
-                    break
-            if len(free_ips) == num:
-                return free_ips
-        raise errors.OutOfIPs()
+        return IPAddrAllocator(ng).allocate(num)
 
     def _get_ips_except_admin(self, node_id=None, network_id=None):
         """
@@ -571,6 +578,24 @@ class NetworkManager(object):
                 main_nic.assigned_networks.append(ng_db)
             db().commit()
 
+    def get_cluster_topology(self, cluster, nodes_ids=None):
+        """
+        Method for receiving snapshot of cluster networks
+        which serves network data of cluster nodes from memory.
+
+        :param cluster: Cluster object.
+        :type  cluster: Cluster
+        :param nodes_ids: List of nodes IDs to load data for,
+        all cluster nodes are loaded if not specified.
+        :type  nodes_ids: list
+        :returns: ClusterNetworkTopology object.
+        """
+        return ClusterNetworkTopology(
+            cluster,
+            admin_net_id=self.get_admin_network_id(False),
+            nodes_ids=nodes_ids
+        )
+
     def get_node_networks(self, node_id):
         """
         Method for receiving network data for a given node.
@@ -585,66 +610,10 @@ class NetworkManager(object):
             # Node doesn't belong to any cluster, so it should not have nets
             return []
 
-        ips = self._get_ips_except_admin(node_id=node_id)
-        network_data = []
-        network_ids = []
-        for i in ips:
-            net = db().query(Network).get(i.network)
-            interface = self._get_interface_by_network_name(
-                node_db.id,
-                net.name
-            )
-
-            # Get prefix from netmask instead of cidr
-            # for public network
-            if net.name == 'public':
-                network_group = db().query(NetworkGroup).get(
-                    net.network_group_id)
-
-                # Convert netmask to prefix
-                prefix = str(IPNetwork(
-                    '0.0.0.0/' + network_group.netmask).prefixlen)
-                netmask = network_group.netmask
-            else:
-                prefix = str(IPNetwork(net.cidr).prefixlen)
-                netmask = str(IPNetwork(net.cidr).netmask)
-
-            network_data.append({
-                'name': net.name,
-                'vlan': net.vlan_id,
-                'ip': i.ip_addr + '/' + prefix,
-                'netmask': netmask,
-                'brd': str(IPNetwork(net.cidr).broadcast),
-                'gateway': net.gateway,
-                'dev': interface.name})
-            network_ids.append(net.id)
-
-        # And now let's add networks w/o IP addresses
-        nets = db().query(Network).join(NetworkGroup).\
-            filter(NetworkGroup.cluster_id == cluster_db.id)
-        if network_ids:
-            nets = nets.filter(not_(Network.id.in_(network_ids)))
-
-        # For now, we pass information about all networks,
-        #    so these vlans will be created on every node we call this func for
-        # However it will end up with errors if we precreate vlans in VLAN mode
-        #   in fixed network. We are skipping fixed nets in Vlan mode.
-        for net in nets.order_by(Network.id).all():
-            interface = self._get_interface_by_network_name(
-                node_db.id,
-                net.name
-            )
-
-            if net.name == 'fixed' and cluster_db.net_manager == 'VlanManager':
-                continue
-            network_data.append({
-                'name': net.name,
-                'vlan': net.vlan_id,
-                'dev': interface.name})
-
-        network_data.append(self._get_admin_network(node_db))
-
-        return network_data
+        return self.get_cluster_topology(
+            cluster_db,
+            nodes_ids=[node_db.id]
+        ).get_node_networks(node_db)
 
     def _update_attrs(self, node_data):
         node_db = db().query(Node).get(node_data['id'])
@@ -672,28 +641,45 @@ class NetworkManager(object):
         if not "interfaces" in node.meta:
             raise Exception("No interfaces metadata specified for node")
 
-        for interface in node.meta["interfaces"]:
-            interface_db = db().query(NodeNICInterface).filter_by(
-                mac=interface['mac']).first()
+        self.update_node_interfaces(node)
+        db().commit()
+
+    def update_node_interfaces(self, node):
+        """
+        Synchronizes NICs of node with interfaces from node meta.
+        Existing NICs are fetched by one query, changes are
+        not committed.
+
+        :param node: Node object.
+        :type  node: Node
+        """
+        interfaces = node.meta["interfaces"]
+        macs = [i['mac'] for i in interfaces]
+        interfaces_db = {}
+        if macs:
+            interfaces_db = dict(
+                (i.mac, i) for i in db().query(NodeNICInterface).filter(
+                    NodeNICInterface.mac.in_(macs)
+                )
+            )
+
+        for interface in interfaces:
+            interface_db = interfaces_db.get(interface['mac'])
             if interface_db:
-                self.__update_existing_interface(interface_db.id, interface)
+                self.__set_interface_attributes(interface_db, interface)
             else:
-                self.__add_new_interface(node, interface)
+                interfaces_db[interface['mac']] = \
+                    self.__add_new_interface(node, interface)
 
-        self.__delete_not_found_interfaces(node, node.meta["interfaces"])
+        self.__delete_not_found_interfaces(node, interfaces)
 
     def __add_new_interface(self, node, interface_attrs):
         interface = NodeNICInterface()
         interface.node_id = node.id
         self.__set_interface_attributes(interface, interface_attrs)
         db().add(interface)
-        db().commit()
         node.interfaces.append(interface)
-
-    def __update_existing_interface(self, interface_id, interface_attrs):
-        interface = db().query(NodeNICInterface).get(interface_id)
-        self.__set_interface_attributes(interface, interface_attrs)
-        db().commit()
+        return interface
 
     def __set_interface_attributes(self, interface, interface_attrs):
         interface.name = interface_attrs["name"]
@@ -740,18 +726,7 @@ class NetworkManager(object):
         return self.get_all_cluster_networkgroups(node_id)
 
     def _get_admin_network(self, node):
-        """
-        Node contain mac address which sent ohai,
-        when node was loaded. By this mac address
-        we can identify interface name for admin network.
-        """
-        for interface in node.meta.get('interfaces', []):
-            if interface['mac'] == node.mac:
-                return {
-                    'name': u'admin',
-                    'dev': interface['name']}
-
-        raise errors.CanNotFindInterface()
+        return ClusterNetworkTopology.get_admin_network(node)
 
     def _get_interface_by_network_name(self, node_id, network_name):
         """
@@ -15,12 +15,16 @@
 #    under the License.
 
 import web
+from netaddr import IPNetwork
+from sqlalchemy.sql import not_
 
 from nailgun.api.models import Node
 from nailgun.api.models import NetworkAssignment
 from nailgun.api.models import NodeNICInterface
+from nailgun.api.models import Network, NetworkGroup, IPAddr
 
 from nailgun.logger import logger
+from nailgun.errors import errors
 from nailgun.db import db
 
 
@@ -52,3 +56,207 @@ class TopoChecker(object):
     @classmethod
     def resolve_topo_conflicts(cls, data):
         raise NotImplementedError("Will be implemented later")
+
+
+class ClusterNetworkTopology(object):
+    """
+    Snapshot of cluster networks which is built once per request or
+    task and serves network data of cluster nodes from memory.
+
+    It keeps prefix, netmask, broadcast and VLAN of every cluster
+    network, IP addresses of nodes and interfaces names by network
+    names, so rendering network data doesn't require any queries.
+    """
+
+    def __init__(self, cluster, admin_net_id=None, nodes_ids=None):
+        """
+        :param cluster: Cluster object.
+        :type  cluster: Cluster
+        :param admin_net_id: Admin network ID, its IP addresses are
+        excluded from network data.
+        :type  admin_net_id: int
+        :param nodes_ids: List of nodes IDs to load data for,
+        all cluster nodes are loaded if not specified.
+        :type  nodes_ids: list
+        """
+        self.cluster_id = cluster.id
+        self.net_manager = cluster.net_manager
+
+        # Networks info by network ID in order of IDs
+        self.networks = {}
+        self.networks_ids = []
+        for net, ng_netmask in db().query(
+            Network, NetworkGroup.netmask
+        ).join(NetworkGroup).filter(
+            NetworkGroup.cluster_id == cluster.id
+        ).order_by(Network.id):
+            self._add_network(net, ng_netmask)
+            self.networks_ids.append(net.id)
+
+        # IP addresses by node ID in order of IP IDs
+        self.ips = {}
+        ips = db().query(
+            IPAddr.node, IPAddr.network, IPAddr.ip_addr
+        ).order_by(IPAddr.id)
+        if nodes_ids is not None:
+            ips = ips.filter(IPAddr.node.in_(nodes_ids or [None]))
+        else:
+            ips = ips.join(Node, Node.id == IPAddr.node).filter(
+                Node.cluster_id == cluster.id
+            )
+        if admin_net_id:
+            ips = ips.filter(not_(IPAddr.network == admin_net_id))
+        for node_id, network_id, ip_addr in ips:
+            self.ips.setdefault(node_id, []).append((network_id, ip_addr))
+
+        # IP addresses could be left from networks of other clusters
+        foreign_networks_ids = set([
+            network_id
+            for node_ips in self.ips.itervalues()
+            for network_id, _ in node_ips
+        ]) - set(self.networks_ids)
+        if foreign_networks_ids:
+            for net, ng_netmask in db().query(
+                Network, NetworkGroup.netmask
+            ).outerjoin(NetworkGroup).filter(
+                Network.id.in_(foreign_networks_ids)
+            ):
+                self._add_network(net, ng_netmask)
+
+        # Interfaces names by node ID and network name
+        self.interfaces = {}
+        assignments = db().query(
+            NodeNICInterface.node_id,
+            NodeNICInterface.name,
+            NetworkGroup.name
+        ).join(
+            NetworkAssignment,
+            NetworkAssignment.interface_id == NodeNICInterface.id
+        ).join(
+            NetworkGroup,
+            NetworkGroup.id == NetworkAssignment.network_id
+        ).order_by(NodeNICInterface.id, NetworkGroup.id)
+        if nodes_ids is not None:
+            assignments = assignments.filter(
+                NodeNICInterface.node_id.in_(nodes_ids or [None])
+            )
+        else:
+            assignments = assignments.join(
+                Node,
+                Node.id == NodeNICInterface.node_id
+            ).filter(Node.cluster_id == cluster.id)
+        for node_id, iface_name, network_name in assignments:
+            self.interfaces.setdefault(node_id, {}).setdefault(
+                network_name,
+                iface_name
+            )
+
+    def node_state(self, node_id):
+        """
+        Returns hashable state of networks, IP addresses and interfaces
+        which network data of node is built from, so network data
+        built for node can be reused while its state is the same.
+        """
+        return (
+            self.net_manager,
+            tuple(
+                (network_id, tuple(sorted(self.networks[network_id].items())))
+                for network_id in self.networks_ids
+            ),
+            tuple(self.ips.get(node_id, [])),
+            tuple(sorted(self.interfaces.get(node_id, {}).items()))
+        )
+
+    def _add_network(self, net, ng_netmask):
+        cidr = IPNetwork(net.cidr)
+        # Get prefix from netmask instead of cidr
+        # for public network
+        if net.name == 'public' and ng_netmask:
+            prefix = str(IPNetwork('0.0.0.0/' + ng_netmask).prefixlen)
+            netmask = ng_netmask
+        else:
+            prefix = str(cidr.prefixlen)
+            netmask = str(cidr.netmask)
+        self.networks[net.id] = {
+            'name': net.name,
+            'vlan': net.vlan_id,
+            'prefix': prefix,
+            'netmask': netmask,
+            'brd': str(cidr.broadcast),
+            'gateway': net.gateway
+        }
+
+    def get_interface_name(self, node_id, network_name):
+        """
+        Returns name of node interface which has appointed
+        network with specified network name.
+
+        :raises: errors.CanNotFindInterface
+        """
+        try:
+            return self.interfaces[node_id][network_name]
+        except KeyError:
+            raise errors.CanNotFindInterface()
+
+    @classmethod
+    def get_admin_network(cls, node):
+        """
+        Node contain mac address which sent ohai,
+        when node was loaded. By this mac address
+        we can identify interface name for admin network.
+        """
+        for interface in node.meta.get('interfaces', []):
+            if interface['mac'] == node.mac:
+                return {
+                    'name': u'admin',
+                    'dev': interface['name']}
+
+        raise errors.CanNotFindInterface()
+
+    def get_node_networks(self, node):
+        """
+        Method for receiving network data for a given node.
+
+        :param node: Node object.
+        :type  node: Node
+        :returns: List of network info for node.
+        """
+        if node.cluster_id is None:
+            # Node doesn't belong to any cluster, so it should not have nets
+            return []
+
+        network_data = []
+        network_ids = set()
+        for network_id, ip_addr in self.ips.get(node.id, []):
+            net = self.networks[network_id]
+            network_data.append({
+                'name': net['name'],
+                'vlan': net['vlan'],
+                'ip': ip_addr + '/' + net['prefix'],
+                'netmask': net['netmask'],
+                'brd': net['brd'],
+                'gateway': net['gateway'],
+                'dev': self.get_interface_name(node.id, net['name'])})
+            network_ids.add(network_id)
+
+        # And now let's add networks w/o IP addresses
+        # For now, we pass information about all networks,
+        #    so these vlans will be created on every node we call this func for
+        # However it will end up with errors if we precreate vlans in VLAN mode
+        #   in fixed network. We are skipping fixed nets in Vlan mode.
+        for network_id in self.networks_ids:
+            if network_id in network_ids:
+                continue
+            net = self.networks[network_id]
+            interface_name = self.get_interface_name(node.id, net['name'])
+
+            if net['name'] == 'fixed' and self.net_manager == 'VlanManager':
+                continue
+            network_data.append({
+                'name': net['name'],
+                'vlan': net['vlan'],
+                'dev': interface_name})
+
+        network_data.append(self.get_admin_network(node))
+
+        return network_data
@@ -14,42 +14,163 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
-import web
+import sys
+import threading
+import traceback
+from contextlib import contextmanager
 from datetime import datetime
+from functools import wraps
 
+from sqlalchemy import text
+
+from nailgun import events
 from nailgun.db import db
 from nailgun.logger import logger
 from nailgun.api.models import Notification, Task
 
 
+_local = threading.local()
+
+
 def notify(topic, message,
            cluster_id=None, node_id=None, task_uuid=None):
+    """
+    Creates notification and commits it. Inside of batch() block
+    notification is only collected and created when block is left.
+    """
     if topic == 'discover' and node_id is None:
         raise Exception("No node id in discover notification")
-    task = None
-    if task_uuid:
-        task = db().query(Task).filter_by(uuid=task_uuid).first()
-
-    exist = None
-    if node_id and task:
-        exist = db().query(Notification).filter_by(
-            node_id=node_id,
-            message=message,
-            task=task
-        ).first()
-
-    if not exist:
-        notification = Notification()
-        notification.topic = topic
-        notification.message = message
-        notification.cluster_id = cluster_id
-        notification.node_id = node_id
-        if task:
-            notification.task_id = task.id
-        notification.datetime = datetime.now()
-        db().add(notification)
-        db().commit()
+    notification = {
+        "topic": topic,
+        "message": message,
+        "cluster_id": cluster_id,
+        "node_id": node_id,
+        "task_uuid": task_uuid
+    }
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.append(notification)
+    else:
+        notify_many([notification])
+
+
+def notify_many(notifications):
+    """
+    Creates notifications with one INSERT and commits them.
+
+    Task uuids are resolved with one query. Notifications repeated
+    in the list are created once, and, as with notify, notifications
+    about node of task which already exist in database are skipped.
+
+    :param notifications: List of dicts with notify arguments.
+    :type  notifications: list
+    :returns: Number of created notifications.
+    """
+    for n in notifications:
+        if n["topic"] == 'discover' and n.get("node_id") is None:
+            raise Exception("No node id in discover notification")
+
+    uuids = set(n["task_uuid"] for n in notifications if n.get("task_uuid"))
+    tasks = {}
+    if uuids:
+        tasks = dict(
+            db().query(Task.uuid, Task.id).filter(Task.uuid.in_(uuids))
+        )
+
+    rows = []
+    seen = set()
+    for n in notifications:
+        node_id = n.get("node_id") and int(n["node_id"])
+        row = {
+            "topic": n["topic"],
+            "message": n["message"],
+            "cluster_id": n.get("cluster_id"),
+            "node_id": node_id,
+            "task_id": tasks.get(n.get("task_uuid"))
+        }
+        key = tuple(sorted(row.items()))
+        if key not in seen:
+            seen.add(key)
+            rows.append(row)
+
+    tasks_nodes = [r for r in rows if r["node_id"] and r["task_id"]]
+    if tasks_nodes:
+        existing = set(db().query(
+            Notification.node_id,
+            Notification.message,
+            Notification.task_id
+        ).filter(
+            Notification.task_id.in_(set(r["task_id"] for r in tasks_nodes))
+        ).filter(
+            Notification.node_id.in_(set(r["node_id"] for r in tasks_nodes))
+        ))
+        rows = [
+            r for r in rows
+            if (r["node_id"], r["message"], r["task_id"]) not in existing
+        ]
+
+    if rows:
+        # ids are reserved with one query, so rows are still
+        # inserted at once and events can refer to notifications
+        ids = db().execute(
+            text("SELECT nextval(:seq) FROM generate_series(1, :num)"),
+            {"seq": "{0}_id_seq".format(Notification.__tablename__),
+             "num": len(rows)}
+        )
+        now = datetime.now()
+        for r, (id_,) in zip(rows, ids):
+            r["id"] = id_
+            r["status"] = "unread"
+            r["datetime"] = now
+        db().execute(Notification.__table__.insert(), rows)
+    db().commit()
+    events.publish_notifications(rows)
+    for r in rows:
         logger.info(
-            "Notification: topic: %s message: %s" % (topic, message)
+            "Notification: topic: %s message: %s" % (
+                r["topic"], r["message"])
         )
+    return len(rows)
+
+
+@contextmanager
+def batch():
+    """
+    Collects notifications created inside of block and creates
+    them with notify_many when block is left. If block raises,
+    its uncommitted changes are rolled back before notifications
+    are created and the exception is re-raised.
+    Nested blocks are merged into the outermost one.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = []
+    try:
+        yield
+    except Exception:
+        exc_info = sys.exc_info()
+        pending = _local.pending
+        _local.pending = None
+        if pending:
+            db().rollback()
+            try:
+                notify_many(pending)
+            except Exception:
+                logger.error(traceback.format_exc())
+        raise exc_info[0], exc_info[1], exc_info[2]
+    pending = _local.pending
+    _local.pending = None
+    if pending:
+        notify_many(pending)
+
+
+def batched(func):
+    """
+    Decorator which runs function inside of notifications batch.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with batch():
+            return func(*args, **kwargs)
+    return wrapper
@@ -14,7 +14,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
+
 from kombu import Connection, Exchange, Queue
+from kombu.pools import producers
 
 from nailgun.settings import settings
 
@@ -54,9 +57,89 @@ nailgun_queue = Queue(
 )
 
 
+# Connection isn't opened here, it's only a template of connections
+# in process-wide pool which are opened on first cast and reused.
+connection = Connection(
+    conn_str,
+    transport_options={
+        # publishing waits for broker to confirm message if set
+        "confirm_publish": settings.RABBITMQ.get("confirm_publish", False)
+    }
+)
+
+retry_policy = {
+    "max_retries": 3,
+    "interval_start": 0,
+    "interval_step": 1,
+    "interval_max": 5
+}
+
+
+def compact(message):
+    """
+    Returns copy of message (or list of messages) where node blobs
+    which occur in message more than once (e.g. controllers in nodes
+    and in controller_nodes attribute) are moved to message's
+    'node_blobs' list and replaced by {'node_ref': index}.
+    """
+    if isinstance(message, list):
+        return map(compact, message)
+
+    counts = {}
+
+    def count(obj):
+        if isinstance(obj, dict):
+            if 'uid' in obj:
+                key = json.dumps(obj, sort_keys=True)
+                counts[key] = counts.get(key, 0) + 1
+            for value in obj.itervalues():
+                count(value)
+        elif isinstance(obj, list):
+            for value in obj:
+                count(value)
+
+    blobs = []
+    refs = {}
+
+    def replace(obj):
+        if isinstance(obj, dict):
+            if 'uid' in obj:
+                key = json.dumps(obj, sort_keys=True)
+                if counts[key] > 1:
+                    if key not in refs:
+                        refs[key] = len(blobs)
+                        blobs.append(obj)
+                    return {'node_ref': refs[key]}
+            return dict((k, replace(v)) for k, v in obj.iteritems())
+        elif isinstance(obj, list):
+            return map(replace, obj)
+        return obj
+
+    count(message)
+    if not any(c > 1 for c in counts.itervalues()):
+        return message
+    result = replace(message)
+    result['node_blobs'] = blobs
+    return result
+
+
 def cast(name, message):
-    with Connection(conn_str) as conn:
-        with conn.Producer(serializer='json') as producer:
-            producer.publish(message,
-                             exchange=naily_exchange, routing_key=name,
-                             declare=[naily_queue])
+    """
+    Publishes message to naily with producer from pool. Queue is
+    declared only once per connection, lost connection is
+    reestablished and publishing is retried.
+
+    If compact_messages is enabled in RABBITMQ settings, repeated
+    node blobs are sent once (see compact) and message is compressed.
+    """
+    compression = None
+    if settings.RABBITMQ.get("compact_messages"):
+        message = compact(message)
+        compression = 'zlib'
+    with producers[connection].acquire(block=True) as producer:
+        producer.publish(message,
+                         serializer='json',
+                         compression=compression,
+                         exchange=naily_exchange, routing_key=name,
+                         declare=[naily_queue],
+                         retry=True, retry_policy=retry_policy)
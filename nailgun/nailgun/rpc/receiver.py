@@ -18,10 +18,10 @@ import time
 import Queue
 import types
 import traceback
-import itertools
 
 from web.utils import ThreadedDict
 from sqlalchemy import or_
+from sqlalchemy.sql import text
 
 import nailgun.rpc as rpc
 from nailgun.logger import logger
@@ -29,9 +29,14 @@ from nailgun.db import db
 from nailgun.network.manager import NetworkManager
 from nailgun.settings import settings
 from nailgun.task.helpers import TaskHelper
+from nailgun.task.helpers import nodes_progress
+from nailgun.task.helpers import node_payloads
 from nailgun.api.models import Node, Network, NetworkGroup
-from nailgun.api.models import IPAddr, Task
+from nailgun.api.models import IPAddrRange, Task
+from nailgun.api.models import Cluster, ClusterChanges, Attributes
+from nailgun.api.models import NodeAttributes
 from nailgun.api.models import Release
+from nailgun import events
 from nailgun import notifier
 
 
@@ -42,6 +47,7 @@ class TaskNotFound(Exception):
 class NailgunReceiver(object):
 
     @classmethod
+    @notifier.batched
     def remove_nodes_resp(cls, **kwargs):
         logger.info("RPC method remove_nodes_resp received: %s" % kwargs)
         task_uuid = kwargs.get('task_uuid')
@@ -52,37 +58,53 @@ class NailgunReceiver(object):
         status = kwargs.get('status')
         progress = kwargs.get('progress')
 
+        nodes_ids = [int(n['uid']) for n in nodes]
+        inaccessible_ids = [int(n['uid']) for n in inaccessible_nodes]
+        error_ids = [int(n['uid']) for n in error_nodes]
+        found = {}
+        if nodes_ids or inaccessible_ids or error_ids:
+            found = dict(
+                (node_id, (name, mac)) for node_id, name, mac in
+                db().query(Node.id, Node.name, Node.mac).filter(
+                    Node.id.in_(nodes_ids + inaccessible_ids + error_ids)
+                )
+            )
+
         for node in nodes:
-            node_db = db().query(Node).get(node['uid'])
-            if not node_db:
+            if int(node['uid']) not in found:
                 logger.error(
                     u"Failed to delete node '%s': node doesn't exist",
                     str(node)
                 )
-                break
-            db().delete(node_db)
 
         for node in inaccessible_nodes:
             # Nodes which not answered by rpc just removed from db
-            node_db = db().query(Node).get(node['uid'])
-            if node_db:
+            if int(node['uid']) in found:
+                name, mac = found[int(node['uid'])]
                 logger.warn(
                     u'Node %s not answered by RPC, removing from db',
-                    node_db.human_readable_name)
-                db().delete(node_db)
+                    name or mac)
+
+        deleted_ids = set(nodes_ids + inaccessible_ids) & set(found)
+        cls._delete_nodes(list(deleted_ids))
 
+        failed_ids = []
         for node in error_nodes:
-            node_db = db().query(Node).get(node['uid'])
-            if not node_db:
+            if int(node['uid']) not in found:
                 logger.error(
                     u"Failed to delete node '%s' marked as error from Naily:"
                     " node doesn't exist", str(node)
                 )
-                break
-            node_db.pending_deletion = False
-            node_db.status = 'error'
-            db().add(node_db)
-            node['name'] = node_db.name
+                continue
+            node['name'] = found[int(node['uid'])][0]
+            if int(node['uid']) not in deleted_ids:
+                failed_ids.append(int(node['uid']))
+        if failed_ids:
+            db().query(Node).filter(Node.id.in_(failed_ids)).update(
+                {'pending_deletion': False, 'status': 'error'},
+                synchronize_session=False
+            )
+            nodes_progress.invalidate(nodes_ids=failed_ids)
         db().commit()
 
         success_msg = u"No nodes were removed"
@@ -106,6 +128,7 @@ class NailgunReceiver(object):
         TaskHelper.update_task_status(task_uuid, status, progress, error_msg)
 
     @classmethod
+    @notifier.batched
     def remove_cluster_resp(cls, **kwargs):
         network_manager = NetworkManager()
         logger.info("RPC method remove_cluster_resp received: %s" % kwargs)
@@ -113,27 +136,19 @@ class NailgunReceiver(object):
 
         cls.remove_nodes_resp(**kwargs)
 
-        task = db().query(Task).filter_by(uuid=task_uuid).first()
+        task = db().query(Task).populate_existing().filter_by(
+            uuid=task_uuid
+        ).first()
         cluster = task.cluster
 
         if task.status in ('ready',):
             logger.debug("Removing environment itself")
             cluster_name = cluster.name
 
-            nws = itertools.chain(
-                *[n.networks for n in cluster.network_groups]
-            )
-            ips = db().query(IPAddr).filter(
-                IPAddr.network.in_([n.id for n in nws])
-            )
-            map(db().delete, ips)
-            db().commit()
-
-            db().delete(cluster)
-            db().commit()
-
+            cls._delete_cluster(cluster.id)
             # Dmitry's hack for clearing VLANs without networks
             network_manager.clear_vlans()
+            db().commit()
 
             notifier.notify(
                 "done",
@@ -160,6 +175,7 @@ class NailgunReceiver(object):
             )
 
     @classmethod
+    @notifier.batched
     def deploy_resp(cls, **kwargs):
         logger.info("RPC method deploy_resp received: %s" % kwargs)
         task_uuid = kwargs.get('task_uuid')
@@ -168,7 +184,9 @@ class NailgunReceiver(object):
         status = kwargs.get('status')
         progress = kwargs.get('progress')
 
-        task = db().query(Task).filter_by(uuid=task_uuid).first()
+        task = db().query(Task).populate_existing().filter_by(
+            uuid=task_uuid
+        ).first()
         if not task:
             # No task found - nothing to do here, returning
             logger.warning(
@@ -180,85 +198,19 @@ class NailgunReceiver(object):
         if not status:
             status = task.status
 
-        error_nodes = []
         # First of all, let's update nodes in database
-        for node in nodes:
-            node_db = db().query(Node).get(node['uid'])
-
-            if not node_db:
-                logger.warning(
-                    u"No node found with uid '{0}' - nothing changed".format(
-                        node['uid']
-                    )
-                )
-                continue
-
-            update_fields = (
-                'error_msg',
-                'error_type',
-                'status',
-                'progress',
-                'online'
-            )
-            for param in update_fields:
-                if param in node:
-                    logger.debug(
-                        u"Updating node {0} - set {1} to {2}".format(
-                            node['uid'],
-                            param,
-                            node[param]
-                        )
-                    )
-                    setattr(node_db, param, node[param])
-
-                    if param == 'progress' and node.get('status') == 'error' \
-                            or node.get('online') is False:
-                        # If failure occurred with node
-                        # it's progress should be 100
-                        node_db.progress = 100
-                        # Setting node error_msg for offline nodes
-                        if node.get('online') is False \
-                                and not node_db.error_msg:
-                            node_db.error_msg = u"Node is offline"
-                        # Notification on particular node failure
-                        notifier.notify(
-                            "error",
-                            u"Failed to deploy node '{0}': {1}".format(
-                                node_db.name,
-                                node_db.error_msg or "Unknown error"
-                            ),
-                            cluster_id=task.cluster_id,
-                            node_id=node['uid'],
-                            task_uuid=task_uuid
-                        )
-
-            db().add(node_db)
-            db().commit()
+        nodes_db = cls._update_nodes(task, nodes)
+        db().commit()
+        events.publish_nodes(nodes_db)
 
         # We should calculate task progress by nodes info
-        task = db().query(Task).filter_by(uuid=task_uuid).first()
-        coeff = settings.PROVISIONING_PROGRESS_COEFF or 0.3
+        task = db().query(Task).populate_existing().filter_by(
+            uuid=task_uuid
+        ).first()
         if nodes and not progress:
-            nodes_progress = []
-            nodes_db = db().query(Node).filter_by(
-                cluster_id=task.cluster_id).all()
-            for node in nodes_db:
-                if node.status == "discover":
-                    nodes_progress.append(0)
-                elif not node.online:
-                    nodes_progress.append(100)
-                elif node.status in ['provisioning', 'provisioned'] or \
-                        node.needs_reprovision:
-                    nodes_progress.append(float(node.progress) * coeff)
-                elif node.status in ['deploying', 'ready'] or \
-                        node.needs_redeploy:
-                    nodes_progress.append(
-                        100.0 * coeff + float(node.progress) * (1.0 - coeff)
-                    )
-            if nodes_progress:
-                progress = int(
-                    float(sum(nodes_progress)) / len(nodes_progress)
-                )
+            progress = nodes_progress.update(task, nodes_db)
+        if status in ('error', 'ready'):
+            nodes_progress.forget(task.uuid)
 
         # Let's check the whole task status
         if status in ('error',):
@@ -269,6 +221,7 @@ class NailgunReceiver(object):
             TaskHelper.update_task_status(task.uuid, status, progress, message)
 
     @classmethod
+    @notifier.batched
     def provision_resp(cls, **kwargs):
         # For now provision task is nothing more than just adding
         # system into cobbler and rebooting node. Then we think task
@@ -280,13 +233,207 @@ class NailgunReceiver(object):
         status = kwargs.get('status')
         progress = kwargs.get('progress')
 
-        task = db().query(Task).filter_by(uuid=task_uuid).first()
+        task = db().query(Task).populate_existing().filter_by(
+            uuid=task_uuid
+        ).first()
         if not task:
             logger.warning(u"No task with uuid %s found", task_uuid)
             return
 
         TaskHelper.update_task_status(task.uuid, status, progress, message)
 
+    # node attributes which are updated by deploy_resp
+    node_update_fields = (
+        'error_msg',
+        'error_type',
+        'status',
+        'progress',
+        'online'
+    )
+
+    @classmethod
+    def _update_nodes(cls, task, nodes):
+        """
+        Applies nodes updates from deploy_resp message. Failed nodes
+        are updated one by one with notifications, all other nodes
+        are updated with one UPDATE per set of updated attributes.
+
+        :returns: List of updated nodes (objects or rows).
+        """
+        failed = {}
+        groups = {}
+        for node in nodes:
+            fields = tuple(
+                f for f in cls.node_update_fields if f in node
+            )
+            if not fields:
+                continue
+            uid = int(node['uid'])
+            if node.get('status') == 'error' and 'progress' in node \
+                    or node.get('online') is False:
+                failed[uid] = node
+            else:
+                groups.setdefault(fields, []).append((uid, node))
+
+        updated = []
+        if failed:
+            failed_db = db().query(Node).populate_existing().filter(
+                Node.id.in_(failed.keys())
+            ).all()
+            for node_db in failed_db:
+                cls._update_failed_node(task, node_db, failed[node_db.id])
+            db().flush()
+            updated.extend(failed_db)
+        for fields, group in groups.iteritems():
+            updated.extend(cls._bulk_update_nodes(fields, group))
+
+        found = set(n.id for n in updated)
+        for node in nodes:
+            if int(node['uid']) not in found:
+                logger.warning(
+                    u"No node found with uid '{0}' - nothing changed".format(
+                        node['uid']
+                    )
+                )
+        return updated
+
+    @classmethod
+    def _update_failed_node(cls, task, node_db, node):
+        for param in cls.node_update_fields:
+            if param in node:
+                logger.debug(
+                    u"Updating node {0} - set {1} to {2}".format(
+                        node['uid'],
+                        param,
+                        node[param]
+                    )
+                )
+                setattr(node_db, param, node[param])
+        # If failure occurred with node
+        # it's progress should be 100
+        node_db.progress = 100
+        # Setting node error_msg for offline nodes
+        if node.get('online') is False \
+                and not node_db.error_msg:
+            node_db.error_msg = u"Node is offline"
+        # Notification on particular node failure
+        notifier.notify(
+            "error",
+            u"Failed to deploy node '{0}': {1}".format(
+                node_db.name,
+                node_db.error_msg or "Unknown error"
+            ),
+            cluster_id=task.cluster_id,
+            node_id=node_db.id,
+            task_uuid=task.uuid
+        )
+
+    @classmethod
+    def _delete_nodes(cls, nodes_ids):
+        """
+        Deletes nodes with bulk DELETE statements without committing.
+        Interfaces, IP addresses and changes of nodes are removed
+        by database cascades, notifications about nodes are kept.
+
+        :param nodes_ids: List of nodes ids.
+        :type  nodes_ids: list
+        """
+        if not nodes_ids:
+            return
+        db().query(NodeAttributes).filter(
+            NodeAttributes.node_id.in_(nodes_ids)
+        ).delete(synchronize_session=False)
+        db().query(Node).filter(
+            Node.id.in_(nodes_ids)
+        ).delete(synchronize_session=False)
+        node_payloads.invalidate(nodes_ids)
+        nodes_progress.invalidate(nodes_ids=nodes_ids)
+
+    @classmethod
+    def _delete_cluster(cls, cluster_id):
+        """
+        Deletes cluster with all its nodes, networks, attributes and
+        tasks without committing. Each kind of objects is deleted with
+        one DELETE statement, before objects it references. IP addresses
+        of networks are removed by database cascade, notifications
+        about cluster are kept.
+
+        :param cluster_id: Cluster id.
+        :type  cluster_id: int
+        """
+        cls._delete_nodes([
+            node_id for (node_id,) in
+            db().query(Node.id).filter_by(cluster_id=cluster_id)
+        ])
+        network_groups = db().query(NetworkGroup.id).filter_by(
+            cluster_id=cluster_id
+        ).subquery()
+        db().query(Network).filter(
+            Network.network_group_id.in_(network_groups)
+        ).delete(synchronize_session=False)
+        db().query(IPAddrRange).filter(
+            IPAddrRange.network_group_id.in_(network_groups)
+        ).delete(synchronize_session=False)
+        for model in (NetworkGroup, Attributes, ClusterChanges, Task):
+            db().query(model).filter_by(
+                cluster_id=cluster_id
+            ).delete(synchronize_session=False)
+        nodes_progress.invalidate(clusters_ids=[cluster_id])
+        # loaded cluster is kept readable like after session delete
+        db().query(Cluster).filter_by(
+            id=cluster_id
+        ).delete(synchronize_session='evaluate')
+
+    @classmethod
+    def _bulk_update_nodes(cls, fields, group):
+        """
+        Updates given fields of nodes with a single
+        UPDATE ... FROM (VALUES ...) statement.
+
+        :param fields: Names of updated columns.
+        :type  fields: tuple
+        :param group: List of (node id, node data) tuples.
+        :type  group: list
+        :returns: List of rows of updated nodes.
+        """
+        table = Node.__table__
+        dialect = db().bind.dialect
+        casts = [
+            "CAST(:{0}_{{0}} AS {1})".format(
+                f, table.c[f].type.compile(dialect=dialect)
+            )
+            for f in fields
+        ]
+        values = []
+        params = {}
+        for i, (uid, node) in enumerate(group):
+            values.append("(:id_{0}, {1})".format(
+                i, ", ".join(c.format(i) for c in casts)
+            ))
+            params["id_{0}".format(i)] = uid
+            for f in fields:
+                params["{0}_{1}".format(f, i)] = node[f]
+        logger.debug(
+            u"Updating nodes %s - set %s",
+            [uid for uid, node in group],
+            ", ".join(fields)
+        )
+        return db().execute(
+            text(
+                "UPDATE nodes SET {0} "
+                "FROM (VALUES {1}) AS v(id, {2}) "
+                "WHERE nodes.id = v.id "
+                "RETURNING nodes.id, nodes.cluster_id, nodes.status, "
+                "nodes.progress, nodes.online, nodes.error_type, "
+                "nodes.pending_deletion".format(
+                    ", ".join("{0} = v.{0}".format(f) for f in fields),
+                    ", ".join(values),
+                    ", ".join(fields)
+                )
+            ),
+            params
+        ).fetchall()
+
     @classmethod
     def _generate_error_message(cls, task, error_types, names_only=False):
         nodes_info = []
@@ -438,7 +585,9 @@ class NailgunReceiver(object):
         progress = kwargs.get('progress')
 
         # We simply check that each node received all vlans for cluster
-        task = db().query(Task).filter_by(uuid=task_uuid).first()
+        task = db().query(Task).populate_existing().filter_by(
+            uuid=task_uuid
+        ).first()
         if not task:
             logger.error("verify_networks_resp: task \
                     with UUID %s not found!", task_uuid)
@@ -558,6 +707,7 @@ class NailgunReceiver(object):
                                       progress, error_msg, result)
 
     @classmethod
+    @notifier.batched
     def download_release_resp(cls, **kwargs):
         logger.info("RPC method download_release_resp received: %s" % kwargs)
         task_uuid = kwargs.get('task_uuid')
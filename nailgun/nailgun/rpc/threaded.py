@@ -15,8 +15,11 @@
 #    under the License.
 
 import time
+import socket
 import traceback
 import threading
+from collections import OrderedDict
+from Queue import Queue as WorkQueue, Empty
 
 from kombu import Connection, Exchange, Queue
 from kombu.mixins import ConsumerMixin
@@ -25,22 +28,217 @@ import nailgun.rpc as rpc
 from nailgun.settings import settings
 from nailgun.logger import logger
 from nailgun.rpc.receiver import NailgunReceiver
+from nailgun.api.models import Task
 from nailgun.db import db
 
 
+class RPCWorker(threading.Thread):
+    """
+    Thread which processes messages dispatched to it by RPCConsumer
+    in the order of dispatching. Processed messages are returned to
+    consumer to be acked from the thread which owns the channel.
+    """
+
+    def __init__(self, consumer, index):
+        super(RPCWorker, self).__init__(name="rpc-worker-{0}".format(index))
+        self.daemon = True
+        self.consumer = consumer
+        self.queue = WorkQueue()
+        self.processed = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def put(self, body, msgs):
+        self.queue.put((time.time(), body, msgs))
+
+    def stop(self):
+        self.queue.put(None)
+
+    def run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    self.queue.task_done()
+                    break
+                queued_at, body, msgs = item
+                self.lag = time.time() - queued_at
+                self.max_lag = max(self.max_lag, self.lag)
+                try:
+                    self.consumer.process_msg(body)
+                except Exception:
+                    # worker should survive any message, otherwise
+                    # messages of its clusters are never processed
+                    logger.error(traceback.format_exc())
+                    db().rollback()
+                finally:
+                    self.processed += 1
+                    self.consumer.acks.put(msgs)
+                    self.queue.task_done()
+        finally:
+            db.remove()
+
+    def metrics(self):
+        """
+        Returns queue lag metrics of worker: number of queued
+        messages, number of processed messages, how long the last
+        message waited in queue and the longest wait in seconds.
+        """
+        return {
+            "worker": self.name,
+            "queued": self.queue.qsize(),
+            "processed": self.processed,
+            "lag": self.lag,
+            "max_lag": self.max_lag
+        }
+
+
 class RPCConsumer(ConsumerMixin):
+    """
+    Consumer of nailgun queue. Messages are received in batches and
+    progress messages which are superseded by newer messages of the
+    same task in batch are merged before they are processed.
+
+    Messages are processed by pool of workers. Messages of the same
+    cluster (or of the same task if task has no cluster) always go
+    to the same worker, so they are processed in order, while
+    messages of different clusters are processed in parallel.
+    """
 
-    def __init__(self, connection, receiver):
+    # maximum number of messages processed at once
+    batch_size = 100
+    # how long to wait for more messages before processing batch
+    batch_timeout = 0.1
+    # methods whose progress-only messages can be merged
+    coalesced_methods = ('deploy_resp',)
+    # arguments of progress-only message
+    progress_args = frozenset(('task_uuid', 'nodes', 'progress'))
+
+    # maximum number of cached clusters of tasks
+    max_tasks = 1000
+
+    def __init__(self, connection, receiver, workers=None):
         self.connection = connection
         self.receiver = receiver
+        self.pending = []
+        self.acks = WorkQueue()
+        self.clusters = OrderedDict()
+        self.metrics_interval = settings.RPC_CONSUMER['metrics_interval']
+        self.last_metrics = time.time()
+        self.workers = [
+            RPCWorker(self, i) for i in xrange(
+                workers or settings.RPC_CONSUMER['workers']
+            )
+        ]
+        for worker in self.workers:
+            worker.start()
 
     def get_consumers(self, Consumer, channel):
-        return [Consumer(queues=[rpc.nailgun_queue],
-                         callbacks=[self.consume_msg])]
+        consumer = Consumer(queues=[rpc.nailgun_queue],
+                            callbacks=[self.consume_msg])
+        consumer.qos(prefetch_count=self.batch_size)
+        return [consumer]
+
+    def consume(self, *args, **kwargs):
+        # messages processed by workers are acked between waits
+        # for new messages, so waits should be short
+        kwargs.setdefault("safety_interval", self.batch_timeout)
+        return super(RPCConsumer, self).consume(*args, **kwargs)
 
     def consume_msg(self, body, msg):
-        callback = getattr(self.receiver, body["method"])
+        self.pending.append((body, msg))
+
+    def on_iteration(self):
+        self.ack_processed()
+        # messages which are already delivered are collected
+        # without waiting for the whole batch timeout on each
+        while self.pending and len(self.pending) < self.batch_size:
+            try:
+                self.connection.drain_events(timeout=self.batch_timeout)
+            except socket.timeout:
+                break
+        self.process_pending()
+        if time.time() - self.last_metrics >= self.metrics_interval:
+            self.log_metrics()
+
+    def process_pending(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        batch = self.coalesce(pending)
+        if len(batch) < len(pending):
+            logger.debug(
+                "Merged %d RPC messages into %d",
+                len(pending), len(batch)
+            )
+        for body, msgs in batch:
+            self.worker_for(body).put(body, msgs)
+        db().commit()
+
+    def worker_for(self, body):
+        """
+        Returns worker which processes messages of the same
+        cluster as given message.
+        """
+        task_uuid = (body.get("args") or {}).get("task_uuid")
+        key = task_uuid
+        if task_uuid is not None:
+            if task_uuid in self.clusters:
+                key = self.clusters[task_uuid]
+            else:
+                task = db().query(Task.cluster_id).filter_by(
+                    uuid=task_uuid
+                ).first()
+                # key is cached even if task isn't found, so
+                # all messages of task go to the same worker
+                if task and task.cluster_id:
+                    key = task.cluster_id
+                self.clusters[task_uuid] = key
+                if len(self.clusters) > self.max_tasks:
+                    self.clusters.popitem(last=False)
+        return self.workers[hash(key) % len(self.workers)]
+
+    def ack_processed(self):
+        while True:
+            try:
+                msgs = self.acks.get_nowait()
+            except Empty:
+                return
+            for msg in msgs:
+                msg.ack()
+
+    def wait(self):
+        """
+        Waits until all dispatched messages are processed
+        and acks them.
+        """
+        for worker in self.workers:
+            worker.queue.join()
+        self.ack_processed()
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join()
+        self.ack_processed()
+
+    def metrics(self):
+        return [worker.metrics() for worker in self.workers]
+
+    def log_metrics(self):
+        self.last_metrics = time.time()
+        for m in self.metrics():
+            logger.info(
+                "RPC worker %s: queued %d, processed %d, "
+                "lag %.3fs, max lag %.3fs",
+                m["worker"], m["queued"], m["processed"],
+                m["lag"], m["max_lag"]
+            )
+
+    def process_msg(self, body):
         try:
+            callback = getattr(self.receiver, body["method"])
             callback(**body["args"])
         except Exception as exc:
             logger.error(traceback.format_exc())
@@ -48,7 +246,68 @@ class RPCConsumer(ConsumerMixin):
         finally:
             db().commit()
             db().expire_all()
-        msg.ack()
+
+    @classmethod
+    def is_progress_msg(cls, body):
+        """
+        Checks if message only reports progress, so it can be
+        replaced by newer message. Messages with task status,
+        error or failed nodes are never merged.
+        """
+        args = body.get("args") or {}
+        if body.get("method") not in cls.coalesced_methods or \
+                not args.get("task_uuid") or \
+                not cls.progress_args.issuperset(args):
+            return False
+        for node in args.get("nodes") or []:
+            if node.get("status") == "error" or \
+                    not set(node).issubset(("uid", "status", "progress")):
+                return False
+        return True
+
+    @classmethod
+    def coalesce(cls, messages):
+        """
+        Merges progress messages of the same task. Merged message
+        takes place of the first one and keeps the latest state of
+        every node and the latest task progress. Any other message
+        of the task ends merging, so order of status transitions
+        of task is preserved.
+
+        :param messages: List of (body, message) tuples.
+        :type  messages: list
+        :returns: List of (body, list of messages) tuples.
+        """
+        batch = []
+        merging = {}
+        for body, msg in messages:
+            args = body.get("args") or {}
+            task_uuid = args.get("task_uuid")
+            if not cls.is_progress_msg(body):
+                merging.pop(task_uuid, None)
+                batch.append((body, [msg]))
+                continue
+
+            if task_uuid not in merging:
+                merging[task_uuid] = len(batch)
+                batch.append((body, [msg]))
+                continue
+
+            index = merging[task_uuid]
+            prev, msgs = batch[index]
+            nodes = OrderedDict(
+                (n["uid"], dict(n)) for n in prev["args"].get("nodes") or []
+            )
+            for node in args.get("nodes") or []:
+                nodes.setdefault(node["uid"], {}).update(node)
+            merged = dict(args)
+            if nodes:
+                merged["nodes"] = nodes.values()
+            batch[index] = (
+                {"method": body["method"], "args": merged},
+                msgs + [msg]
+            )
+        return batch
 
 
 class RPCKombuThread(threading.Thread):
@@ -69,4 +328,7 @@ class RPCKombuThread(threading.Thread):
     def run(self):
         with Connection(rpc.conn_str) as conn:
             self.consumer = RPCConsumer(conn, self.receiver)
-            self.consumer.run()
+            try:
+                self.consumer.run()
+            finally:
+                self.consumer.stop_workers()
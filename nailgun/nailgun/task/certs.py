@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import shlex
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from nailgun.db import db
+from nailgun.logger import logger
+from nailgun.settings import settings
+from nailgun.api.models import Task
+
+
+class PuppetCertCleaner(threading.Thread):
+    """
+    Thread which removes certificates of deleted nodes from
+    puppet master outside of request thread.
+
+    Commands are run by a bounded pool of threads and results are
+    stored into 'puppet_certs' of deletion task result as lists of
+    cleaned hostnames and errors keyed by failed hostnames.
+    """
+
+    def __init__(self, task_uuid, hostnames, workers=None):
+        """
+        :param task_uuid: UUID of deletion task.
+        :type  task_uuid: str
+        :param hostnames: FQDNs of deleted nodes.
+        :type  hostnames: list
+        :param workers: Maximum number of concurrent commands.
+        :type  workers: int
+        """
+        super(PuppetCertCleaner, self).__init__(
+            name="puppet-cert-clean-{0}".format(task_uuid)
+        )
+        self.daemon = True
+        self.task_uuid = task_uuid
+        self.hostnames = hostnames
+        self.workers = workers or settings.PUPPET_CERT_CLEAN['workers']
+        self.cleaned = []
+        self.failed = {}
+
+    @classmethod
+    def clean_cert(cls, hostname):
+        """
+        Removes certificate of one node.
+
+        :param hostname: FQDN of node.
+        :type  hostname: str
+        :returns: Error message or None if certificate is removed.
+        """
+        logger.info("Removing node cert from puppet: %s", hostname)
+        cmd = "puppet cert clean {0}".format(hostname)
+        try:
+            proc = subprocess.Popen(
+                shlex.split(cmd),
+                shell=False,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            p_stdout, p_stderr = proc.communicate()
+        except Exception as e:
+            logger.warning(
+                "Exception occurred while trying to run '{0}': '{1}'".format(
+                    cmd, e
+                )
+            )
+            return str(e)
+
+        logger.info(
+            "'{0}' executed, STDOUT: '{1}',"
+            " STDERR: '{2}'".format(
+                cmd,
+                p_stdout,
+                p_stderr
+            )
+        )
+        if proc.returncode:
+            logger.warning(
+                "'{0}' returned non-zero exit code".format(cmd)
+            )
+            return p_stderr.strip() or \
+                "exit code {0}".format(proc.returncode)
+
+    def run(self):
+        try:
+            if self.hostnames:
+                pool = ThreadPool(min(self.workers, len(self.hostnames)))
+                try:
+                    results = pool.map(self.clean_cert, self.hostnames)
+                finally:
+                    pool.close()
+                    pool.join()
+                for hostname, error in zip(self.hostnames, results):
+                    if error:
+                        self.failed[hostname] = error
+                    else:
+                        self.cleaned.append(hostname)
+            self.report()
+        finally:
+            db.remove()
+
+    def report(self):
+        """
+        Stores results into deletion task. Task can be already
+        removed together with its cluster, then results are
+        only logged. Task row is locked until commit, so result
+        written by RPC receiver at the same time isn't lost.
+        """
+        logger.info(
+            "Puppet certs of task %s: cleaned %s, failed %s",
+            self.task_uuid, self.cleaned, self.failed.keys()
+        )
+        task = db().query(Task).populate_existing().with_lockmode(
+            'update'
+        ).filter_by(uuid=self.task_uuid).first()
+        if not task:
+            db().commit()
+            return
+        task.result = dict(
+            task.result or {},
+            puppet_certs={
+                'cleaned': self.cleaned,
+                'failed': self.failed
+            }
+        )
+        db().commit()
@@ -15,14 +15,24 @@
 #    under the License.
 
 import os
+import copy
 import shutil
 import logging
+import threading
+from collections import OrderedDict
 
+from sqlalchemy import event
+from sqlalchemy.orm import defer, undefer, joinedload
+from sqlalchemy.orm.attributes import get_history, PASSIVE_NO_INITIALIZE
+from sqlalchemy.sql import text
+
+from nailgun import events
 from nailgun.db import db
 from nailgun.logger import logger
 from nailgun.api.models import Task
 from nailgun.api.models import IPAddr
 from nailgun.api.models import Node
+from nailgun.api.models import ClusterChanges
 from nailgun.settings import settings
 from nailgun.network.manager import NetworkManager
 
@@ -48,24 +58,55 @@ class TaskHelper(object):
 
     @classmethod
     def prepare_syslog_dir(cls, node, prefix=None):
-        logger.debug("Preparing syslog directories for node: %s", node.fqdn)
+        cls.prepare_syslog_dirs([node], prefix=prefix)
+
+    @classmethod
+    def prepare_syslog_dirs(cls, nodes, admin_ips=None, prefix=None):
+        """
+        Prepares syslog directories of nodes and makes rsyslog
+        reopen them with one HUP signal.
+
+        :param nodes: List of nodes.
+        :type  nodes: list
+        :param admin_ips: Lists of admin IP addresses keyed by node id,
+        fetched with one query if not specified.
+        :type  admin_ips: dict
+        :param prefix: Syslog directory, settings.SYSLOG_DIR by default.
+        :type  prefix: str
+        """
+        if not nodes:
+            return
         if not prefix:
             prefix = settings.SYSLOG_DIR
         logger.debug("prepare_syslog_dir prefix=%s", prefix)
 
+        if admin_ips is None:
+            admin_ips = dict((n.id, []) for n in nodes)
+            admin_net_id = NetworkManager().get_admin_network_id()
+            for node_id, ip_addr in db().query(
+                IPAddr.node,
+                IPAddr.ip_addr
+            ).filter(
+                IPAddr.node.in_(admin_ips.keys())
+            ).filter_by(network=admin_net_id):
+                admin_ips[node_id].append(ip_addr)
+
+        for node in nodes:
+            cls._prepare_node_syslog_dir(
+                node,
+                [os.path.join(prefix, ip) for ip in admin_ips[node.id]],
+                prefix
+            )
+
+        os.system("/usr/bin/pkill -HUP rsyslog")
+
+    @classmethod
+    def _prepare_node_syslog_dir(cls, node, links, prefix):
+        logger.debug("Preparing syslog directories for node: %s", node.fqdn)
         old = os.path.join(prefix, str(node.ip))
         bak = os.path.join(prefix, "%s.bak" % str(node.fqdn))
         new = os.path.join(prefix, str(node.fqdn))
 
-        netmanager = NetworkManager()
-        admin_net_id = netmanager.get_admin_network_id()
-        links = map(
-            lambda i: os.path.join(prefix, i.ip_addr),
-            db().query(IPAddr.ip_addr).
-            filter_by(node=node.id).
-            filter_by(network=admin_net_id).all()
-        )
-
         logger.debug("prepare_syslog_dir old=%s", old)
         logger.debug("prepare_syslog_dir new=%s", new)
         logger.debug("prepare_syslog_dir bak=%s", bak)
@@ -110,44 +151,63 @@ class TaskHelper(object):
             logger.debug("Creating symlink %s -> %s", l, new)
             os.symlink(str(node.fqdn), l)
 
-        os.system("/usr/bin/pkill -HUP rsyslog")
-
     @classmethod
     def update_task_status(cls, uuid, status, progress, msg="", result=None):
         logger.debug("Updating task: %s", uuid)
-        task = db().query(Task).filter_by(uuid=uuid).first()
+        task = db().query(Task).populate_existing().filter_by(
+            uuid=uuid
+        ).first()
         if not task:
             logger.error("Can't set status='%s', message='%s':no task \
                     with UUID %s found!", status, msg, uuid)
             return
         previous_status = task.status
+        previous_progress = task.progress
+        if progress is not None:
+            # progress is stored as integer, so messages which don't
+            # move rounded progress don't change anything
+            progress = int(round(progress))
         data = {'status': status, 'progress': progress,
                 'message': msg, 'result': result}
-        for key, value in data.iteritems():
-            if value is not None:
-                setattr(task, key, value)
-                logger.info(
-                    u"Task {0} {1} is set to {2}".format(
-                        task.uuid,
-                        key,
-                        value
-                    )
+        changed = dict(
+            (key, value) for key, value in data.iteritems()
+            if value is not None and getattr(task, key) != value
+        )
+        if not changed:
+            logger.debug("Task %s is not changed", uuid)
+            db().commit()
+            return
+        for key, value in changed.iteritems():
+            setattr(task, key, value)
+            logger.info(
+                u"Task {0} {1} is set to {2}".format(
+                    task.uuid,
+                    key,
+                    value
                 )
+            )
         db().add(task)
         db().commit()
+        events.publish_task(task)
 
-        if previous_status != status and task.cluster_id:
+        status_changed = task.status != previous_status
+        if status_changed and task.cluster_id:
             logger.debug("Updating cluster status: "
                          "cluster_id: %s status: %s",
                          task.cluster_id, status)
             cls.update_cluster_status(uuid)
-        if task.parent:
-            logger.debug("Updating parent task: %s", task.parent.uuid)
-            cls.update_parent_task(task.parent.uuid)
+        if task.parent_id:
+            if status_changed:
+                logger.debug("Updating parent task: %s", task.parent.uuid)
+                cls.update_parent_task(task.parent.uuid)
+            elif task.progress != previous_progress:
+                cls.update_parent_progress(task.parent_id)
 
     @classmethod
     def update_parent_task(cls, uuid):
-        task = db().query(Task).filter_by(uuid=uuid).first()
+        task = db().query(Task).populate_existing().filter_by(
+            uuid=uuid
+        ).first()
         subtasks = task.subtasks
         if len(subtasks):
             if all(map(lambda s: s.status == 'ready', subtasks)):
@@ -158,6 +218,7 @@ class TaskHelper(object):
                         lambda s: s.message is not None, subtasks)))
                 db().add(task)
                 db().commit()
+                events.publish_task(task)
                 cls.update_cluster_status(uuid)
             elif all(map(lambda s: s.status in ('ready', 'error'), subtasks)):
                 task.status = 'error'
@@ -167,32 +228,47 @@ class TaskHelper(object):
                         lambda s: s.status == 'error', subtasks)))
                 db().add(task)
                 db().commit()
+                events.publish_task(task)
                 cls.update_cluster_status(uuid)
             else:
-                subtasks_with_progress = filter(
-                    lambda s: s.progress is not None,
-                    subtasks
-                )
-                if subtasks_with_progress:
-                    task.progress = int(
-                        round(
-                            sum(
-                                [s.weight * s.progress for s
-                                 in subtasks_with_progress]
-                            ) /
-                            sum(
-                                [s.weight for s
-                                 in subtasks_with_progress]
-                            ), 0)
-                    )
-                else:
-                    task.progress = 0
-                db().add(task)
-                db().commit()
+                cls.update_parent_progress(task.id)
+
+    @classmethod
+    def update_parent_progress(cls, parent_id):
+        """
+        Sets weighted progress of subtasks to parent task
+        with a single UPDATE. Nothing is written if rounded
+        progress of parent task isn't changed.
+
+        :param parent_id: Id of parent task.
+        :type  parent_id: int
+        :returns: True if parent task progress was changed.
+        """
+        changed = db().execute(
+            text(
+                "UPDATE tasks SET progress = agg.progress "
+                "FROM (SELECT COALESCE(ROUND(CAST("
+                "SUM(weight * progress) / NULLIF(SUM(weight), 0) "
+                "AS numeric)), 0) AS progress "
+                "FROM tasks WHERE parent_id = :parent_id "
+                "AND progress IS NOT NULL) AS agg "
+                "WHERE tasks.id = :parent_id "
+                "AND tasks.progress IS DISTINCT FROM agg.progress "
+                "RETURNING tasks.id"
+            ),
+            {"parent_id": parent_id}
+        ).first() is not None
+        db().commit()
+        if changed:
+            parent = db().query(Task).populate_existing().get(parent_id)
+            events.publish_task(parent)
+        return changed
 
     @classmethod
     def update_cluster_status(cls, uuid):
-        task = db().query(Task).filter_by(uuid=uuid).first()
+        task = db().query(Task).populate_existing().filter_by(
+            uuid=uuid
+        ).first()
         # FIXME: should be moved to task/manager "finish" method after
         # web.ctx.orm issue is addressed
         cluster = task.cluster
@@ -231,23 +307,30 @@ class TaskHelper(object):
 
     @classmethod
     def nodes_to_deploy(cls, cluster):
+        # meta isn't needed here, payloads of
+        # nodes in deployment are mostly cached
         return sorted(filter(
             lambda n: any([
                 n.pending_addition,
                 n.needs_reprovision,
                 n.needs_redeploy
             ]),
-            cluster.nodes
+            NodePayloadCache.load_nodes(
+                db().query(Node).filter_by(cluster_id=cluster.id)
+            )
         ), key=lambda n: n.id)
 
     @classmethod
     def nodes_to_provision(cls, cluster):
+        # volumes of every node are needed for provisioning
         return sorted(filter(
             lambda n: any([
                 n.pending_addition,
                 n.needs_reprovision
             ]),
-            cluster.nodes
+            db().query(Node).filter_by(
+                cluster_id=cluster.id
+            ).options(joinedload(Node.attributes))
         ), key=lambda n: n.id)
 
     @classmethod
@@ -257,3 +340,273 @@ class TaskHelper(object):
             status="error",
             progress=100,
             msg=str(message))
+
+
+class NodesProgress(object):
+    """
+    Deployment progress of cluster nodes.
+
+    Progress of every node of cluster is loaded once per task and
+    then only nodes from deploy_resp message are recalculated, so
+    progress message doesn't load all nodes of cluster with their
+    changes. Tasks are reloaded when their nodes are changed or
+    deleted outside of deploy_resp (see invalidate).
+    """
+
+    # maximum number of tracked tasks
+    max_tasks = 100
+    # node columns progress depends on, updates of
+    # them outside of deploy_resp invalidate progress
+    node_columns = (
+        'status',
+        'online',
+        'progress',
+        'error_type',
+        'pending_deletion',
+        'cluster_id'
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = OrderedDict()
+
+    @classmethod
+    def node_progress(cls, node, changes):
+        """
+        Returns progress of node in deployment or None if node
+        doesn't take part in it.
+
+        :param node: Node object or row with node columns.
+        :param changes: List of (name, node_id) of cluster changes.
+        """
+        coeff = settings.PROVISIONING_PROGRESS_COEFF or 0.3
+        progress = float(node.progress or 0)
+        if node.status == "discover":
+            return 0
+        elif not node.online:
+            return 100
+        elif node.status in ['provisioning', 'provisioned'] or \
+                Node.check_needs_reprovision(node):
+            return progress * coeff
+        elif node.status in ['deploying', 'ready'] or \
+                Node.check_needs_redeploy(node, changes):
+            return 100.0 * coeff + progress * (1.0 - coeff)
+        return None
+
+    def _load(self, task):
+        changes = list(db().query(
+            ClusterChanges.name,
+            ClusterChanges.node_id
+        ).filter_by(cluster_id=task.cluster_id))
+        nodes = db().query(
+            Node.id,
+            *[getattr(Node, c) for c in self.node_columns]
+        ).filter_by(cluster_id=task.cluster_id)
+        return {
+            "cluster_id": task.cluster_id,
+            "changes": changes,
+            "nodes": dict(
+                (n.id, self.node_progress(n, changes)) for n in nodes
+            )
+        }
+
+    def update(self, task, nodes):
+        """
+        Updates progress of given nodes and returns
+        progress of deployment task.
+
+        :param task: Deployment task.
+        :type  task: Task
+        :param nodes: Updated nodes of task's cluster.
+        :returns: Progress as integer or None if there are
+        no nodes in deployment.
+        """
+        with self.lock:
+            state = self.tasks.pop(task.uuid, None)
+            if state is None:
+                state = self._load(task)
+            else:
+                for node in nodes:
+                    if node.cluster_id == task.cluster_id:
+                        state["nodes"][node.id] = self.node_progress(
+                            node, state["changes"]
+                        )
+            self.tasks[task.uuid] = state
+            while len(self.tasks) > self.max_tasks:
+                self.tasks.popitem(last=False)
+
+            nodes_progress = filter(
+                lambda p: p is not None,
+                state["nodes"].itervalues()
+            )
+            if nodes_progress:
+                return int(float(sum(nodes_progress)) / len(nodes_progress))
+            return None
+
+    def forget(self, task_uuid):
+        with self.lock:
+            self.tasks.pop(task_uuid, None)
+
+    def invalidate(self, nodes_ids=(), clusters_ids=()):
+        """
+        Drops progress of tasks which track any of given nodes or
+        deploy any of given clusters, it's reloaded on next message.
+
+        :param nodes_ids: Ids of changed or deleted nodes.
+        :type  nodes_ids: list
+        :param clusters_ids: Ids of clusters with changed nodes.
+        :type  clusters_ids: list
+        """
+        nodes_ids = set(nodes_ids)
+        clusters_ids = set(clusters_ids)
+        with self.lock:
+            for task_uuid, state in self.tasks.items():
+                if state["cluster_id"] in clusters_ids or \
+                        nodes_ids.intersection(state["nodes"]):
+                    del self.tasks[task_uuid]
+
+
+nodes_progress = NodesProgress()
+
+
+class NodePayloadCache(object):
+    """
+    Payloads of nodes in deployment messages.
+
+    Payload of node is built once and reused while node's attributes,
+    meta and network state are the same. Entries are keyed by node
+    attributes which are sent to orchestrator and by network state
+    of node (see ClusterNetworkTopology.node_state). Changes of node
+    meta and recorded cluster changes invalidate entries.
+    """
+
+    # node attributes which payload depends on, besides meta
+    node_fields = (
+        'cluster_id',
+        'status',
+        'error_type',
+        'ip',
+        'mac',
+        'role',
+        'fqdn',
+        'progress',
+        'online'
+    )
+    # maximum number of cached payloads
+    max_nodes = 2000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.payloads = OrderedDict()
+
+    @classmethod
+    def load_nodes(cls, query):
+        """
+        Loads nodes for payloads without meta, meta is loaded
+        later only for nodes which payloads aren't cached.
+        """
+        return query.options(defer(Node.meta)).all()
+
+    def node_key(self, node, topology):
+        return (
+            tuple(getattr(node, f) for f in self.node_fields),
+            topology.node_state(node.id)
+        )
+
+    def get_many(self, nodes, topology, build):
+        """
+        Returns payloads of nodes in the same order, building
+        only payloads which aren't cached.
+
+        :param nodes: Nodes loaded with load_nodes.
+        :type  nodes: list
+        :param topology: Network topology of nodes cluster.
+        :type  topology: ClusterNetworkTopology
+        :param build: Function which builds payload of node.
+        :returns: List of payloads (deep copies of cached ones,
+        so callers can change them).
+        """
+        keys = dict((n.id, self.node_key(n, topology)) for n in nodes)
+        result = {}
+        with self.lock:
+            for node_id, key in keys.iteritems():
+                cached = self.payloads.get(node_id)
+                if cached is not None and cached[0] == key:
+                    result[node_id] = cached[1]
+
+        missed = [n for n in nodes if n.id not in result]
+        if missed:
+            # meta of all nodes which payloads are built
+            # is loaded with one query
+            db().query(Node).options(undefer(Node.meta)).filter(
+                Node.id.in_([n.id for n in missed])
+            ).all()
+            with self.lock:
+                for node in missed:
+                    payload = build(node, topology)
+                    result[node.id] = payload
+                    self.payloads.pop(node.id, None)
+                    self.payloads[node.id] = (keys[node.id], payload)
+                while len(self.payloads) > self.max_nodes:
+                    self.payloads.popitem(last=False)
+        logger.debug(
+            "Built %d of %d nodes payloads", len(missed), len(nodes)
+        )
+        return [copy.deepcopy(result[n.id]) for n in nodes]
+
+    def invalidate(self, nodes_ids=None):
+        """
+        Drops payloads of given nodes or all payloads.
+        """
+        with self.lock:
+            if nodes_ids is None:
+                self.payloads.clear()
+            else:
+                for node_id in nodes_ids:
+                    self.payloads.pop(node_id, None)
+
+
+node_payloads = NodePayloadCache()
+
+
+@event.listens_for(Node, 'after_update')
+def _invalidate_node_payload(mapper, connection, node):
+    if get_history(node, 'meta', PASSIVE_NO_INITIALIZE).has_changes():
+        node_payloads.invalidate([node.id])
+
+
+@event.listens_for(Node, 'after_update')
+def _invalidate_node_progress(mapper, connection, node):
+    if any(
+        get_history(node, column, PASSIVE_NO_INITIALIZE).has_changes()
+        for column in NodesProgress.node_columns
+    ):
+        nodes_progress.invalidate(nodes_ids=[node.id])
+
+
+@event.listens_for(Node, 'after_delete')
+def _forget_node_payload(mapper, connection, node):
+    node_payloads.invalidate([node.id])
+    nodes_progress.invalidate(nodes_ids=[node.id])
+
+
+@event.listens_for(ClusterChanges, 'after_insert')
+@event.listens_for(ClusterChanges, 'after_delete')
+def _invalidate_cluster_progress(mapper, connection, change):
+    # changes define which nodes need redeployment
+    nodes_progress.invalidate(clusters_ids=[change.cluster_id])
+
+
+@event.listens_for(ClusterChanges, 'after_insert')
+def _invalidate_cluster_payloads(mapper, connection, change):
+    # cluster attributes aren't part of nodes payloads
+    if change.node_id:
+        node_payloads.invalidate([change.node_id])
+    elif change.name == 'networks':
+        node_payloads.invalidate(
+            [node_id for (node_id,) in connection.execute(
+                Node.__table__.select().with_only_columns(
+                    [Node.__table__.c.id]
+                ).where(Node.__table__.c.cluster_id == change.cluster_id)
+            )]
+        )
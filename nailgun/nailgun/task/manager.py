@@ -100,8 +100,20 @@ class DeploymentTaskManager(TaskManager):
         db().commit()
         task_deletion, task_provision, task_deployment = None, None, None
 
+        # all subtasks are created before deletion is launched,
+        # otherwise quick deletion response finishes supertask
         if nodes_to_delete:
             task_deletion = supertask.create_subtask("node_deletion")
+        if nodes_to_provision:
+            task_provision = supertask.create_subtask("provision")
+            # we assume here that task_provision just adds system to
+            # cobbler and reboots it, so it has extremely small weight
+            task_provision.weight = 0.05
+            db().commit()
+        if nodes_to_deploy:
+            task_deployment = supertask.create_subtask("deployment")
+
+        if task_deletion:
             logger.debug("Launching deletion task: %s", task_deletion.uuid)
             self._call_silently(
                 task_deletion,
@@ -113,10 +125,6 @@ class DeploymentTaskManager(TaskManager):
             TaskHelper.update_slave_nodes_fqdn(nodes_to_provision)
             logger.debug("There are nodes to provision: %s",
                          " ".join([n.fqdn for n in nodes_to_provision]))
-            task_provision = supertask.create_subtask("provision")
-            # we assume here that task_provision just adds system to
-            # cobbler and reboots it, so it has extremely small weight
-            task_provision.weight = 0.05
             provision_message = self._call_silently(
                 task_provision,
                 tasks.ProvisionTask,
@@ -131,7 +139,6 @@ class DeploymentTaskManager(TaskManager):
             TaskHelper.update_slave_nodes_fqdn(nodes_to_deploy)
             logger.debug("There are nodes to deploy: %s",
                          " ".join([n.fqdn for n in nodes_to_deploy]))
-            task_deployment = supertask.create_subtask("deployment")
             deployment_message = self._call_silently(
                 task_deployment,
                 tasks.DeploymentTask,
@@ -17,13 +17,11 @@
 import uuid
 import itertools
 import traceback
-import subprocess
-import shlex
 import json
 
 import web
 import netaddr
-from sqlalchemy.orm import object_mapper, ColumnProperty
+from sqlalchemy.orm import object_mapper, ColumnProperty, defer
 from sqlalchemy import or_
 
 import nailgun.rpc as rpc
@@ -37,11 +35,13 @@ from nailgun.api.models import Network
 from nailgun.api.models import NetworkGroup
 from nailgun.api.models import Node
 from nailgun.api.models import Cluster
-from nailgun.api.models import IPAddr
 from nailgun.api.models import Release
 from nailgun.task.fake import FAKE_THREADS
 from nailgun.errors import errors
 from nailgun.task.helpers import TaskHelper
+from nailgun.task.certs import PuppetCertCleaner
+from nailgun.task.helpers import node_payloads
+from nailgun.task.helpers import nodes_progress
 
 
 def fake_cast(queue, messages, **kwargs):
@@ -118,22 +118,53 @@ class DeploymentTask(object):
         nodes_ids = [n.id for n in nodes]
         if nodes_ids:
             logger.info("Assigning IP addresses to nodes..")
-            netmanager.assign_ips(nodes_ids, "management")
-            netmanager.assign_ips(nodes_ids, "public")
-            netmanager.assign_ips(nodes_ids, "storage")
+            netmanager.bulk_assign_ips(
+                nodes_ids,
+                ("management", "public", "storage")
+            )
+            # nodes are expired by commit of assigned IPs,
+            # they are reloaded at once without meta
+            nodes = node_payloads.load_nodes(
+                db().query(Node).filter(
+                    Node.id.in_(nodes_ids)
+                ).order_by(Node.id)
+            )
 
-        nodes_with_attrs = []
         for n in nodes:
             n.pending_addition = False
             if n.status in ('ready', 'deploying'):
                 n.status = 'provisioned'
             n.progress = 0
             db().add(n)
-            db().commit()
-            nodes_with_attrs.append(cls.__format_node_for_naily(n))
+        db().commit()
+
+        # network data of all nodes is served by one snapshot
+        topology = netmanager.get_cluster_topology(task.cluster)
+        controllers_ids = cls.__controller_nodes_ids(cluster_id)
+        # payloads of nodes are built once for nodes and
+        # controller_nodes and only for changed nodes
+        payloads = {}
+        payload_nodes_ids = set(nodes_ids) | set(controllers_ids)
+        if payload_nodes_ids:
+            payload_nodes = node_payloads.load_nodes(
+                db().query(Node).filter(
+                    Node.id.in_(payload_nodes_ids)
+                ).order_by(Node.id)
+            )
+            payloads = dict(zip(
+                [n.id for n in payload_nodes],
+                node_payloads.get_many(
+                    payload_nodes,
+                    topology,
+                    cls.__format_node_for_naily
+                )
+            ))
+        nodes_with_attrs = [payloads[node_id] for node_id in nodes_ids]
 
         cluster_attrs = task.cluster.attributes.merged_attrs_values()
-        cluster_attrs['controller_nodes'] = cls.__controller_nodes(cluster_id)
+        cluster_attrs['controller_nodes'] = [
+            dict(payloads[node_id]) for node_id in controllers_ids
+        ]
 
         nets_db = db().query(Network).join(NetworkGroup).\
             filter(NetworkGroup.cluster_id == cluster_id).all()
@@ -143,8 +174,9 @@ class DeploymentTask(object):
         for net in ng_db:
             net_name = net.name + '_network_range'
             if net.name == 'floating':
-                cluster_attrs[net_name] = \
-                    cls.__get_ip_addresses_in_ranges(net)
+                # ranges are expanded into addresses on nodes
+                # (see expand_ip_ranges puppet function)
+                cluster_attrs[net_name] = cls.__get_ip_ranges(net)
             elif net.name == 'public':
                 # We shouldn't pass public_network_range attribute
                 continue
@@ -161,7 +193,7 @@ class DeploymentTask(object):
         if cluster_attrs['network_manager'] == 'VlanManager':
             cluster_attrs['num_networks'] = fixed_net.amount
             cluster_attrs['vlan_start'] = fixed_net.vlan_start
-            cls.__add_vlan_interfaces(nodes_with_attrs)
+            cls.__add_vlan_interfaces(nodes_with_attrs, topology)
 
         if task.cluster.mode == 'ha':
             logger.info("HA mode chosen, creating VIP addresses for it..")
@@ -195,54 +227,59 @@ class DeploymentTask(object):
         rpc.cast('naily', message)
 
     @classmethod
-    def __format_node_for_naily(cls, n):
-        netmanager = NetworkManager()
+    def __format_node_for_naily(cls, n, topology):
         return {
             'id': n.id, 'status': n.status, 'error_type': n.error_type,
             'uid': n.id, 'ip': n.ip, 'mac': n.mac, 'role': n.role,
             'fqdn': n.fqdn, 'progress': n.progress, 'meta': n.meta,
-            'network_data': netmanager.get_node_networks(n.id),
+            'network_data': topology.get_node_networks(n),
             'online': n.online
         }
 
     @classmethod
-    def __add_vlan_interfaces(cls, nodes):
+    def __add_vlan_interfaces(cls, nodes, topology):
         """
         We shouldn't pass to orchetrator fixed network
         when network manager is VlanManager, but we should specify
         fixed_interface (private_interface in terms of fuel) as result
         we just pass vlan_interface as node attribute.
         """
-        netmanager = NetworkManager()
         for node in nodes:
-            node_db = db().query(Node).get(node['id'])
-
-            fixed_interface = netmanager._get_interface_by_network_name(
-                node_db.id, 'fixed')
-
-            node['vlan_interface'] = fixed_interface.name
+            node['vlan_interface'] = topology.get_interface_name(
+                node['id'], 'fixed')
 
     @classmethod
-    def __controller_nodes(cls, cluster_id):
-        nodes = db().query(Node).filter_by(
+    def __controller_nodes_ids(cls, cluster_id):
+        return [node_id for (node_id,) in db().query(Node.id).filter_by(
             cluster_id=cluster_id,
             role='controller',
-            pending_deletion=False).order_by(Node.id)
-
-        return map(cls.__format_node_for_naily, nodes)
+            pending_deletion=False).order_by(Node.id)]
 
     @classmethod
-    def __get_ip_addresses_in_ranges(cls, network_group):
+    def __get_ip_ranges(cls, network_group):
         """
-        Get array of all possibale ip addresses in all ranges
+        Get IP ranges of network group merged into non-overlapping
+        ranges in ascending order. Range is rendered as 'first-last',
+        range of one address as the address itself.
         """
-        ranges = []
-        for ip_range in network_group.ip_ranges:
-            ranges += map(lambda ip: str(ip),
-                          list(netaddr.IPRange(ip_range.first, ip_range.last)))
+        ranges = sorted(
+            sorted([int(netaddr.IPAddress(ir.first)),
+                    int(netaddr.IPAddress(ir.last))])
+            for ir in network_group.ip_ranges
+        )
+        merged = []
+        for first, last in ranges:
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
 
-        # Return only uniq ip addresses
-        return sorted(list(set(ranges)))
+        return [
+            str(netaddr.IPAddress(first)) if first == last else
+            "{0}-{1}".format(netaddr.IPAddress(first),
+                             netaddr.IPAddress(last))
+            for first, last in merged
+        ]
 
 
 class ProvisionTask(object):
@@ -255,10 +292,6 @@ class ProvisionTask(object):
         netmanager = NetworkManager()
 
         USE_FAKE = settings.FAKE_TASKS or settings.FAKE_TASKS_AMQP
-        # TODO: For now we send nodes data to orchestrator
-        # which is cobbler oriented. But for future we
-        # need to use more abstract data structure.
-        nodes_data = []
         for node in nodes:
             if not node.online:
                 if not USE_FAKE:
@@ -274,106 +307,42 @@ class ProvisionTask(object):
                         (node.name, node.id)
                     )
 
-            cobbler_profile = cluster_attrs['cobbler']['profile']
-
-            node_data = {
-                'profile': cobbler_profile,
-                'power_type': 'ssh',
-                'power_user': 'root',
-                'power_address': node.ip,
-                'name': TaskHelper.make_slave_name(node.id, node.role),
-                'hostname': node.fqdn,
-                'name_servers': '\"%s\"' % settings.DNS_SERVERS,
-                'name_servers_search': '\"%s\"' % settings.DNS_SEARCH,
-                'netboot_enabled': '1',
-                'ks_meta': {
-                    'puppet_auto_setup': 1,
-                    'puppet_master': settings.PUPPET_MASTER_HOST,
-                    'puppet_version': settings.PUPPET_VERSION,
-                    'puppet_enable': 0,
-                    'mco_auto_setup': 1,
-                    'install_log_2_syslog': 1,
-                    'mco_pskey': settings.MCO_PSKEY,
-                    'mco_vhost': settings.MCO_VHOST,
-                    'mco_host': settings.MCO_HOST,
-                    'mco_user': settings.MCO_USER,
-                    'mco_password': settings.MCO_PASSWORD,
-                    'mco_connector': settings.MCO_CONNECTOR,
-                    'mco_enable': 1,
-                    'auth_key': "\"%s\"" % cluster_attrs.get('auth_key', ''),
-                    'ks_spaces': "\"%s\"" % json.dumps(
-                        node.attributes.volumes).replace("\"", "\\\"")
-                }
-            }
-
-            if node.status == "discover":
-                logger.info(
-                    "Node %s seems booted with bootstrap image",
-                    node.id
-                )
-                node_data['power_pass'] = settings.PATH_TO_BOOTSTRAP_SSH_KEY
-            else:
-                # If it's not in discover, we expect it to be booted
-                #   in target system.
-                # TODO: Get rid of expectations!
-                logger.info(
-                    "Node %s seems booted with real system",
-                    node.id
-                )
-                node_data['power_pass'] = settings.PATH_TO_SSH_KEY
-
+        # TODO: For now we send nodes data to orchestrator
+        # which is cobbler oriented. But for future we
+        # need to use more abstract data structure.
+        nodes_data = [cls.node_data(node, cluster_attrs) for node in nodes]
+        # nodes are expired after admin IPs are committed
+        nodes_ids = [node.id for node in nodes]
+        nodes_interfaces = [
+            [i['name'] for i in node.meta.get('interfaces', [])]
+            for node in nodes
+        ]
+
+        # here we assign admin network IPs for nodes
+        # one IP for every node interface
+        admin_ips = netmanager.bulk_assign_admin_ips(dict(
+            zip(nodes_ids, map(len, nodes_interfaces))
+        ))
+        for node_id, node_data, interfaces in zip(
+                nodes_ids, nodes_data, nodes_interfaces):
+            ips = set(admin_ips[node_id])
+            for name in interfaces:
+                node_data['interfaces'][name]['ip_address'] = ips.pop()
+
+        if not USE_FAKE and nodes:
             # FIXME: move this code (updating) into receiver.provision_resp
-            if not USE_FAKE:
-                node.status = "provisioning"
-                db().add(node)
-                db().commit()
-
-            # here we assign admin network IPs for node
-            # one IP for every node interface
-            netmanager.assign_admin_ips(
-                node.id,
-                len(node.meta.get('interfaces', []))
+            db().query(Node).filter(Node.id.in_(nodes_ids)).update(
+                {'status': 'provisioning'},
+                synchronize_session=False
+            )
+            db().commit()
+            nodes_progress.invalidate(nodes_ids=nodes_ids)
+            TaskHelper.prepare_syslog_dirs(
+                db().query(Node).filter(Node.id.in_(nodes_ids)).options(
+                    defer(Node.meta)
+                ).all(),
+                admin_ips
             )
-            admin_net_id = netmanager.get_admin_network_id()
-            admin_ips = set([i.ip_addr for i in db().query(IPAddr).
-                            filter_by(node=node.id).
-                            filter_by(network=admin_net_id)])
-            for i in node.meta.get('interfaces', []):
-                if 'interfaces' not in node_data:
-                    node_data['interfaces'] = {}
-                node_data['interfaces'][i['name']] = {
-                    'mac_address': i['mac'],
-                    'static': '0',
-                    'netmask': settings.ADMIN_NETWORK['netmask'],
-                    'ip_address': admin_ips.pop(),
-                }
-                # interfaces_extra field in cobbler ks_meta
-                # means some extra data for network interfaces
-                # configuration. It is used by cobbler snippet.
-                # For example, cobbler interface model does not
-                # have 'peerdns' field, but we need this field
-                # to be configured. So we use interfaces_extra
-                # branch in order to set this unsupported field.
-                if 'interfaces_extra' not in node_data:
-                    node_data['interfaces_extra'] = {}
-                node_data['interfaces_extra'][i['name']] = {
-                    'peerdns': 'no',
-                    'onboot': 'no'
-                }
-
-                # We want node to be able to PXE boot via any of its
-                # interfaces. That is why we add all discovered
-                # interfaces into cobbler system. But we want
-                # assignted fqdn to be resolved into one IP address
-                # because we don't completely support multiinterface
-                # configuration yet.
-                if i['mac'] == node.mac:
-                    node_data['interfaces'][i['name']]['dns_name'] = node.fqdn
-                    node_data['interfaces_extra'][i['name']]['onboot'] = 'yes'
-
-            nodes_data.append(node_data)
-            if not USE_FAKE:
-                TaskHelper.prepare_syslog_dir(node)
 
         message = {
             'method': 'provision',
@@ -390,6 +359,91 @@ class ProvisionTask(object):
         }
         return message
 
+    @classmethod
+    def node_data(cls, node, cluster_attrs):
+        """
+        Builds provisioning data of node without admin IP addresses
+        of interfaces, they are assigned for all nodes at once.
+        """
+        node_data = {
+            'profile': cluster_attrs['cobbler']['profile'],
+            'power_type': 'ssh',
+            'power_user': 'root',
+            'power_address': node.ip,
+            'name': TaskHelper.make_slave_name(node.id, node.role),
+            'hostname': node.fqdn,
+            'name_servers': '\"%s\"' % settings.DNS_SERVERS,
+            'name_servers_search': '\"%s\"' % settings.DNS_SEARCH,
+            'netboot_enabled': '1',
+            'ks_meta': {
+                'puppet_auto_setup': 1,
+                'puppet_master': settings.PUPPET_MASTER_HOST,
+                'puppet_version': settings.PUPPET_VERSION,
+                'puppet_enable': 0,
+                'mco_auto_setup': 1,
+                'install_log_2_syslog': 1,
+                'mco_pskey': settings.MCO_PSKEY,
+                'mco_vhost': settings.MCO_VHOST,
+                'mco_host': settings.MCO_HOST,
+                'mco_user': settings.MCO_USER,
+                'mco_password': settings.MCO_PASSWORD,
+                'mco_connector': settings.MCO_CONNECTOR,
+                'mco_enable': 1,
+                'auth_key': "\"%s\"" % cluster_attrs.get('auth_key', ''),
+                'ks_spaces': "\"%s\"" % json.dumps(
+                    node.attributes.volumes).replace("\"", "\\\"")
+            }
+        }
+
+        if node.status == "discover":
+            logger.info(
+                "Node %s seems booted with bootstrap image",
+                node.id
+            )
+            node_data['power_pass'] = settings.PATH_TO_BOOTSTRAP_SSH_KEY
+        else:
+            # If it's not in discover, we expect it to be booted
+            #   in target system.
+            # TODO: Get rid of expectations!
+            logger.info(
+                "Node %s seems booted with real system",
+                node.id
+            )
+            node_data['power_pass'] = settings.PATH_TO_SSH_KEY
+
+        for i in node.meta.get('interfaces', []):
+            if 'interfaces' not in node_data:
+                node_data['interfaces'] = {}
+            node_data['interfaces'][i['name']] = {
+                'mac_address': i['mac'],
+                'static': '0',
+                'netmask': settings.ADMIN_NETWORK['netmask'],
+            }
+            # interfaces_extra field in cobbler ks_meta
+            # means some extra data for network interfaces
+            # configuration. It is used by cobbler snippet.
+            # For example, cobbler interface model does not
+            # have 'peerdns' field, but we need this field
+            # to be configured. So we use interfaces_extra
+            # branch in order to set this unsupported field.
+            if 'interfaces_extra' not in node_data:
+                node_data['interfaces_extra'] = {}
+            node_data['interfaces_extra'][i['name']] = {
+                'peerdns': 'no',
+                'onboot': 'no'
+            }
+
+            # We want node to be able to PXE boot via any of its
+            # interfaces. That is why we add all discovered
+            # interfaces into cobbler system. But we want
+            # assignted fqdn to be resolved into one IP address
+            # because we don't completely support multiinterface
+            # configuration yet.
+            if i['mac'] == node.mac:
+                node_data['interfaces'][i['name']]['dns_name'] = node.fqdn
+                node_data['interfaces_extra'][i['name']]['onboot'] = 'yes'
+        return node_data
+
     @classmethod
     def execute(cls, task):
         logger.debug("ProvisionTask.execute(task=%s)" % task.uuid)
@@ -472,6 +526,7 @@ class DeletionTask(object):
 
         # only real tasks
         engine_nodes = []
+        cert_hostnames = []
         if not USE_FAKE:
             for node in nodes_to_delete_constant:
                 slave_name = TaskHelper.make_slave_name(
@@ -480,41 +535,12 @@ class DeletionTask(object):
                 logger.debug("Pending node to be removed from cobbler %s",
                              slave_name)
                 engine_nodes.append(slave_name)
-                try:
-                    node_db = db().query(Node).get(node['id'])
-                    if node_db and node_db.fqdn:
-                        node_hostname = node_db.fqdn
-                    else:
-                        node_hostname = TaskHelper.make_slave_fqdn(
-                            node['id'], node['role'])
-                    logger.info("Removing node cert from puppet: %s",
-                                node_hostname)
-                    cmd = "puppet cert clean {0}".format(node_hostname)
-                    proc = subprocess.Popen(
-                        shlex.split(cmd),
-                        shell=False,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE
-                    )
-                    p_stdout, p_stderr = proc.communicate()
-                    logger.info(
-                        "'{0}' executed, STDOUT: '{1}',"
-                        " STDERR: '{2}'".format(
-                            cmd,
-                            p_stdout,
-                            p_stderr
-                        )
-                    )
-                except OSError:
-                    logger.warning(
-                        "'{0}' returned non-zero exit code".format(
-                            cmd
-                        )
-                    )
-                except Exception as e:
-                    logger.warning("Exception occurred while trying to \
-                            remove the system from Cobbler: '{0}'".format(
-                        e.message))
+                node_db = db().query(Node).get(node['id'])
+                if node_db and node_db.fqdn:
+                    cert_hostnames.append(node_db.fqdn)
+                else:
+                    cert_hostnames.append(TaskHelper.make_slave_fqdn(
+                        node['id'], node['role']))
 
         msg_delete = {
             'method': 'remove_nodes',
@@ -537,6 +563,11 @@ class DeletionTask(object):
         logger.debug("Calling rpc remove_nodes method")
         rpc.cast('naily', msg_delete)
 
+        # certs are removed in background, results
+        # are stored into task when all commands are finished
+        if cert_hostnames:
+            PuppetCertCleaner(task_uuid, cert_hostnames).start()
+
 
 class ClusterDeletionTask(object):
 
@@ -31,6 +31,7 @@ from datetime import datetime
 from functools import partial, wraps
 
 from paste.fixture import TestApp, AppError
+from sqlalchemy import event
 
 import nailgun
 from nailgun.api.models import Node
@@ -48,7 +49,7 @@ from nailgun.api.models import Vlan
 from nailgun.logger import logger
 from nailgun.api.urls import urls
 from nailgun.wsgi import build_app
-from nailgun.db import dropdb, syncdb, flush, db
+from nailgun.db import dropdb, syncdb, flush, db, engine
 from nailgun.fixtures.fixman import upload_fixture
 from nailgun.network.manager import NetworkManager
 from nailgun.network.topology import TopoChecker
@@ -58,6 +59,34 @@ class TimeoutError(Exception):
     pass
 
 
+class QueriesCounter(object):
+    """
+    Context manager which counts SQL statements
+    executed by engine inside of its block
+    """
+    active = []
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __enter__(self):
+        self.count = 0
+        self.statements = []
+        QueriesCounter.active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        QueriesCounter.active.remove(self)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count_queries(conn, cursor, statement, parameters, context, many):
+    for counter in QueriesCounter.active:
+        counter.count += 1
+        counter.statements.append(statement)
+
+
 class Environment(object):
 
     def __init__(self, app):
@@ -579,6 +608,8 @@ class Environment(object):
                     )
                 )
             time.sleep(1)
+        # objects were changed by task threads, reload them on access
+        self.db.expire_all()
         self.tester.assertEquals(task.progress, 100)
         if isinstance(message, type(re.compile("regexp"))):
             self.tester.assertIsNotNone(re.match(message, task.message))
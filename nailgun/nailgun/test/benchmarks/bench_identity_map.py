@@ -0,0 +1,96 @@
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compares API request latency of session keeping identity map
+during request with session refreshing objects on every query
+(former NoCacheQuery behaviour).
+
+Usage: python -m nailgun.test.benchmarks.bench_identity_map [nodes] [runs]
+"""
+
+import sys
+import json
+import time
+
+from paste.fixture import TestApp
+from sqlalchemy.orm.query import Query
+
+from nailgun.db import db, syncdb, flush
+from nailgun.wsgi import build_app
+from nailgun.test.base import Environment
+from nailgun.test.base import reverse
+
+
+class PopulateExistingQuery(Query):
+    def __init__(self, *args, **kwargs):
+        self._populate_existing = True
+        super(PopulateExistingQuery, self).__init__(*args, **kwargs)
+
+
+def measure(app, requests, runs):
+    timings = {}
+    for name, request in requests:
+        started = time.time()
+        for i in xrange(runs):
+            request(app)
+        timings[name] = (time.time() - started) / runs * 1000
+    return timings
+
+
+def main(nodes_count=100, runs=20):
+    app = TestApp(build_app().wsgifunc())
+    headers = {"Content-Type": "application/json"}
+    syncdb()
+    flush()
+    env = Environment(app)
+    env.upload_fixtures(["admin_network"])
+    env.create(nodes_kwargs=[{} for i in xrange(nodes_count)])
+    cluster_id = env.clusters[0].id
+    nodes_update = json.dumps([
+        {'id': n.id, 'pending_addition': True} for n in env.nodes
+    ])
+
+    requests = (
+        ("GET /api/nodes", lambda app: app.get(
+            reverse('NodeCollectionHandler'), headers=headers)),
+        ("GET /api/clusters", lambda app: app.get(
+            reverse('ClusterCollectionHandler'), headers=headers)),
+        ("GET /api/clusters/<id>", lambda app: app.get(
+            reverse('ClusterHandler', {'cluster_id': cluster_id}),
+            headers=headers)),
+        ("PUT /api/nodes", lambda app: app.put(
+            reverse('NodeCollectionHandler'), nodes_update,
+            headers=headers)),
+    )
+
+    results = []
+    for query_cls in (PopulateExistingQuery, Query):
+        db.remove()
+        db.configure(query_cls=query_cls)
+        results.append(measure(app, requests, runs))
+    db.remove()
+    db.configure(query_cls=Query)
+    flush()
+
+    print "{0} nodes, {1} runs, ms per request".format(nodes_count, runs)
+    print "{0:<32}{1:>18}{2:>18}".format(
+        "request", "populate existing", "identity map")
+    for name, request in requests:
+        print "{0:<32}{1:>18.2f}{2:>18.2f}".format(
+            name, results[0][name], results[1][name])
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
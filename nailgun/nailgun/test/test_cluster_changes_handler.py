@@ -56,7 +56,9 @@ class TestHandlers(BaseHandlers):
         # Set ip ranges for floating ips
         ranges = [['240.0.0.2', '240.0.0.4'],
                   ['240.0.0.3', '240.0.0.5'],
-                  ['240.0.0.10', '240.0.0.12']]
+                  ['240.0.0.6', '240.0.0.7'],
+                  ['240.0.0.10', '240.0.0.12'],
+                  ['240.0.0.20', '240.0.0.20']]
 
         floating_network_group = self.db.query(NetworkGroup).filter(
             NetworkGroup.name == 'floating').filter(
@@ -99,15 +101,11 @@ class TestHandlers(BaseHandlers):
             if net.name != 'public':
                 cluster_attrs[net.name + '_network_range'] = net.cidr
 
+        # overlapping and adjacent ranges are merged
         cluster_attrs['floating_network_range'] = [
-            '240.0.0.10',
-            '240.0.0.11',
-            '240.0.0.12',
-
-            '240.0.0.2',
-            '240.0.0.3',
-            '240.0.0.4',
-            '240.0.0.5']
+            '240.0.0.2-240.0.0.7',
+            '240.0.0.10-240.0.0.12',
+            '240.0.0.20']
 
         management_vip = self.env.network_manager.assign_vip(
             cluster_db.id,
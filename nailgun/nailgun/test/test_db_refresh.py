@@ -23,7 +23,7 @@ from sqlalchemy.orm.events import orm
 
 from nailgun.api.models import Node
 from nailgun.db import engine
-from nailgun.db import dropdb, syncdb, flush, NoCacheQuery
+from nailgun.db import dropdb, syncdb, flush
 from nailgun.wsgi import build_app
 
 
@@ -32,10 +32,10 @@ class TestDBRefresh(TestCase):
     def setUp(self):
         self.app = TestApp(build_app().wsgifunc())
         self.db = orm.scoped_session(
-            orm.sessionmaker(bind=engine, query_cls=NoCacheQuery)
+            orm.sessionmaker(bind=engine)
         )()
         self.db2 = orm.scoped_session(
-            orm.sessionmaker(bind=engine, query_cls=NoCacheQuery)
+            orm.sessionmaker(bind=engine)
         )()
         self.default_headers = {
             "Content-Type": "application/json"
@@ -58,4 +58,8 @@ class TestDBRefresh(TestCase):
         node1 = self.db.query(Node).filter(
             Node.id == node.id
         ).first()
+        self.assertEquals(node1.mac, u"ASDFGHJKLMNOPR")
+        node1 = self.db.query(Node).populate_existing().filter(
+            Node.id == node.id
+        ).first()
         self.assertEquals(node.mac, u"12345678")
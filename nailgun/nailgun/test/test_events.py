@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import time
+import uuid
+import threading
+
+from nailgun import notifier
+from nailgun.events import EventStream
+from nailgun.api.handlers.events import EventCollectionHandler
+from nailgun.api.models import Task
+from nailgun.api.models import Notification
+from nailgun.task.helpers import TaskHelper
+from nailgun.test.base import BaseHandlers
+from nailgun.test.base import reverse
+
+
+class TestEventStream(BaseHandlers):
+
+    def test_get_events_since_id(self):
+        stream = EventStream(size=3)
+        self.assertEquals(
+            stream.get(),
+            {"last_id": 0, "reset": False, "events": []}
+        )
+        for i in range(2):
+            stream.publish("task", {"id": i})
+
+        result = stream.get(0)
+        self.assertFalse(result["reset"])
+        self.assertEquals(result["last_id"], 2)
+        self.assertEquals(
+            [(e["id"], e["data"]) for e in result["events"]],
+            [(1, {"id": 0}), (2, {"id": 1})]
+        )
+        self.assertEquals(stream.get(2)["events"], [])
+
+    def test_reset_when_events_dropped(self):
+        stream = EventStream(size=2)
+        for i in range(4):
+            stream.publish("task", {"id": i})
+        self.assertTrue(stream.get(1)["reset"])
+        self.assertFalse(stream.get(2)["reset"])
+        # client's id from before restart of server
+        self.assertTrue(stream.get(10)["reset"])
+
+    def test_waits_for_events(self):
+        stream = EventStream()
+        timer = threading.Timer(
+            0.2, stream.publish, args=("node", {"id": 1}))
+        timer.start()
+        started = time.time()
+        result = stream.get(0, timeout=5)
+        self.assertTrue(time.time() - started < 5)
+        self.assertEquals([e["type"] for e in result["events"]], ["node"])
+
+        started = time.time()
+        self.assertEquals(stream.get(1, timeout=0.2)["events"], [])
+        self.assertTrue(time.time() - started >= 0.2)
+
+    def get_events(self, **params):
+        resp = self.app.get(
+            reverse('EventCollectionHandler'),
+            params=params,
+            headers=self.default_headers,
+            expect_errors=True
+        )
+        if resp.status != 200:
+            return resp.status
+        return json.loads(resp.body)
+
+    def test_events_handler(self):
+        last_id = self.get_events(timeout=0)["last_id"]
+
+        cluster = self.env.create_cluster(api=False)
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deploy",
+            cluster_id=cluster.id
+        )
+        self.db.add(task)
+        self.db.commit()
+        TaskHelper.update_task_status(task.uuid, "running", 10)
+        notifier.notify("done", "Done", cluster_id=cluster.id)
+
+        result = self.get_events(since_id=last_id, timeout=0)
+        self.assertEquals(
+            [e["type"] for e in result["events"]],
+            ["task", "notification"]
+        )
+        task_data, notification_data = [e["data"] for e in result["events"]]
+        self.assertEquals(
+            (task_data["id"], task_data["status"], task_data["progress"]),
+            (task.id, "running", 10)
+        )
+        notification = self.db.query(Notification).get(
+            notification_data["id"]
+        )
+        self.assertEquals(
+            (notification.message, notification.cluster_id),
+            ("Done", cluster.id)
+        )
+        self.assertEquals(notification_data["status"], "unread")
+
+        self.assertEquals(self.get_events(since_id='abc'), 400)
+
+    def test_number_of_waiting_clients_limited(self):
+        EventCollectionHandler.max_waiters = 0
+        try:
+            started = time.time()
+            result = self.get_events(timeout=10)
+            self.assertTrue(time.time() - started < 10)
+            self.assertEquals(result["events"], [])
+        finally:
+            EventCollectionHandler.max_waiters = 4
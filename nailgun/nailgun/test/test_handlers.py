@@ -16,9 +16,19 @@
 
 import unittest
 import json
+import zlib
 
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
+from nailgun.test.base import QueriesCounter
+from nailgun.api.models import Node
+from nailgun.api.handlers.base import JSONHandler
+from nailgun.api.handlers.base import json_chunks
+from nailgun.api.handlers.base import render_query
+from nailgun.api.handlers.base import serializers
+from nailgun.api.handlers.cluster import ClusterHandler
+from nailgun.api.handlers.node import NodeNICsHandler
+from nailgun.api.handlers.release import ReleaseHandler
 
 
 class TestHandlers(BaseHandlers):
@@ -38,3 +48,149 @@ class TestHandlers(BaseHandlers):
             self.assertTrue(resp.status in [404, 405])
             resp = self.app.post(test_url, expect_errors=True)
             self.assertTrue(resp.status in [404, 405])
+
+    def test_fields_serializer_renders_relations(self):
+        self.env.create(
+            cluster_kwargs={"api": False},
+            nodes_kwargs=[{}]
+        )
+        cluster = self.env.clusters[0]
+        node = self.env.nodes[0]
+
+        json_data = JSONHandler.render(
+            node,
+            fields=('id', 'cluster', ('interfaces', 'id', 'mac'))
+        )
+        self.assertEquals(json_data['id'], node.id)
+        self.assertEquals(json_data['cluster'], cluster.id)
+        self.assertEquals(
+            json_data['interfaces'],
+            [{'id': i.id, 'mac': i.mac} for i in node.interfaces]
+        )
+
+        json_data = JSONHandler.render(
+            cluster,
+            fields=('nodes', ('release', 'id', 'name'))
+        )
+        self.assertEquals(json_data['nodes'], [node.id])
+        self.assertEquals(json_data['release'], {
+            'id': cluster.release.id,
+            'name': cluster.release.name
+        })
+
+        json_data = ClusterHandler.render(cluster)
+        self.assertEquals(json_data['release']['id'], cluster.release.id)
+        self.assertEquals(
+            json_data['release']['name'],
+            ReleaseHandler.render(cluster.release)['name']
+        )
+
+    def test_fields_serializers_are_compiled_on_registration(self):
+        for handler in (ClusterHandler, NodeNICsHandler, ReleaseHandler):
+            self.assertIn(tuple(handler.fields), serializers)
+
+    def test_json_response_is_compact_by_default(self):
+        self.env.create_node(api=False)
+        self.env.create_node(api=False)
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertNotIn('\n', resp.body)
+        self.assertNotIn(', "', resp.body)
+        self.assertEquals(2, len(json.loads(resp.body)))
+
+    def test_json_response_pretty_printed_on_request(self):
+        self.env.create_node(api=False)
+        resp = self.app.get(
+            reverse('NodeCollectionHandler') + '?pretty',
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertIn('\n    ', resp.body)
+        self.assertEquals(1, len(json.loads(resp.body)))
+
+    def test_json_response_gzipped_if_accepted(self):
+        self.env.create_node(api=False)
+        headers = dict(self.default_headers)
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertEquals('gzip', resp.header('Content-Encoding'))
+        body = zlib.decompress(resp.body, 16 + zlib.MAX_WBITS)
+        self.assertEquals(1, len(json.loads(body)))
+
+        headers['Accept-Encoding'] = 'gzip;q=0'
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=headers
+        )
+        self.assertEquals(1, len(json.loads(resp.body)))
+
+    def test_query_rendered_while_response_is_sent(self):
+        nodes_ids = [self.env.create_node(api=False).id for i in xrange(3)]
+        rendered = []
+
+        def render(node):
+            rendered.append(node.id)
+            return {'id': node.id}
+
+        with QueriesCounter() as counter:
+            chunks = json_chunks(render_query(
+                self.db.query(Node).order_by(Node.id), render
+            ))
+        self.assertEquals(counter.count, 0)
+        self.assertEquals(
+            json.loads(''.join(chunks)),
+            [{'id': node_id} for node_id in nodes_ids]
+        )
+        self.assertEquals(rendered, nodes_ids)
+
+        resp = self.app.get(
+            reverse('NodeCollectionHandler') + '?pretty',
+            headers=self.default_headers
+        )
+        self.assertEquals(
+            [n['id'] for n in json.loads(resp.body)], nodes_ids
+        )
+
+    def test_failed_query_rendering_rolled_back(self):
+        nodes_ids = [self.env.create_node(api=False).id for i in xrange(3)]
+        names = dict(
+            self.db.query(Node.id, Node.name).filter(Node.id.in_(nodes_ids))
+        )
+
+        def render(node):
+            if node.id == nodes_ids[-1]:
+                raise ValueError("Rendering failed")
+            node.name = "Changed"
+            return {'id': node.id}
+
+        chunks = json_chunks(render_query(
+            self.db.query(Node).order_by(Node.id), render
+        ))
+        self.assertRaises(ValueError, list, chunks)
+
+        # nothing is committed and session is usable by next request
+        self.db.expire_all()
+        self.assertEquals(
+            dict(self.db.query(Node.id, Node.name).filter(
+                Node.id.in_(nodes_ids))),
+            names
+        )
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertEquals(len(json.loads(resp.body)), 3)
+
+    def test_json_chunks_splits_long_lists(self):
+        data = [{'id': i, 'meta': 'x' * 1024} for i in xrange(256)]
+        chunks = list(json_chunks(data))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals(data, json.loads(''.join(chunks)))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import time
+from datetime import datetime, timedelta
+
+from nailgun.api.models import Node
+from nailgun.keepalive.heartbeat import HeartbeatBuffer
+from nailgun.keepalive.heartbeat import heartbeats
+from nailgun.keepalive.watcher import KeepAliveThread
+from nailgun.test.base import BaseHandlers
+from nailgun.test.base import QueriesCounter
+from nailgun.test.base import reverse
+
+
+class TestHeartbeatBuffer(BaseHandlers):
+
+    def setUp(self):
+        super(TestHeartbeatBuffer, self).setUp()
+        self.buffer = HeartbeatBuffer(flush_interval=60)
+
+    def set_timestamp(self, node, timestamp):
+        node.timestamp = timestamp
+        self.db.commit()
+
+    def test_heartbeats_coalesced_by_node(self):
+        node1 = self.env.create_node()
+        node2 = self.env.create_node()
+        self.set_timestamp(node1, datetime(2013, 1, 1))
+        self.set_timestamp(node2, datetime(2013, 1, 1))
+
+        for minute in range(3):
+            self.buffer.touch(node1.id, datetime(2013, 1, 2, 0, minute))
+        self.buffer.touch(node2.id, datetime(2013, 1, 3))
+        self.buffer.touch(node2.id, datetime(2013, 1, 2))
+
+        self.assertEquals(self.buffer.flush(), 2)
+        self.assertEquals(self.buffer.flush(), 0)
+        self.db.expire_all()
+        self.assertEquals(node1.timestamp, datetime(2013, 1, 2, 0, 2))
+        self.assertEquals(node2.timestamp, datetime(2013, 1, 3))
+
+    def test_flush_does_not_move_timestamp_back(self):
+        node = self.env.create_node()
+        self.set_timestamp(node, datetime(2013, 1, 2))
+        self.buffer.touch(node.id, datetime(2013, 1, 1))
+        self.buffer.flush()
+        self.db.expire_all()
+        self.assertEquals(node.timestamp, datetime(2013, 1, 2))
+
+    def test_flush_if_due(self):
+        self.buffer.touch(1)
+        self.assertEquals(self.buffer.flush_if_due(), 0)
+        self.buffer.last_flush -= self.buffer.flush_interval
+        self.assertEquals(self.buffer.flush_if_due(), 1)
+
+    def test_agent_heartbeat_is_buffered(self):
+        node = self.env.create_node(api=True)
+        node_db = self.env.nodes[0]
+        self.set_timestamp(node_db, datetime.now() - timedelta(hours=1))
+        timestamp = node_db.timestamp
+        heartbeats.last_flush = time.time()
+
+        with QueriesCounter() as counter:
+            resp = self.app.put(
+                reverse('NodeAgentHandler'),
+                json.dumps({'mac': node_db.mac, 'is_agent': True}),
+                headers=self.default_headers
+            )
+        self.assertEquals(resp.status, 200)
+        self.assertEquals(
+            [], filter(lambda s: s.startswith('UPDATE nodes'),
+                       counter.statements)
+        )
+        self.assertIn(node_db.id, heartbeats.pending)
+
+        heartbeats.flush()
+        self.db.expire_all()
+        self.assertTrue(node_db.timestamp > timestamp)
+
+    def test_keepalive_consults_heartbeats(self):
+        watcher = KeepAliveThread(timeout=60, heartbeats=self.buffer)
+        stale = datetime.now() - timedelta(hours=1)
+        watcher.started_at = stale
+        alive = self.env.create_node()
+        gone = self.env.create_node()
+        flushed = self.env.create_node()
+        for node in (alive, gone, flushed):
+            self.set_timestamp(node, stale)
+
+        self.buffer.touch(alive.id)
+        self.buffer.touch(flushed.id)
+        self.buffer.flush()
+        # node which checked in after flush but before check of timestamps
+        self.set_timestamp(flushed, stale)
+
+        watcher.update_status_nodes()
+        self.db.expire_all()
+        self.assertTrue(alive.online)
+        self.assertTrue(flushed.online)
+        self.assertFalse(gone.online)
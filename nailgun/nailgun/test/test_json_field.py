@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+from mock import patch
+from sqlalchemy import Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+
+from nailgun.settings import settings
+from nailgun.api.fields import JSON
+from nailgun.api.fields import CompressedJSON
+from nailgun.api.fields import LazyJSONLoader
+from nailgun.api.models import Node
+from nailgun.api.models import Task
+from nailgun.test.base import BaseHandlers
+from nailgun.test.base import QueriesCounter
+
+
+class TestJSONField(BaseHandlers):
+
+    def _load_node(self, node_id):
+        self.db.expunge_all()
+        return self.db.query(Node).get(node_id)
+
+    def _drop_table(self, table):
+        self.db.rollback()
+        table.drop(self.db.connection())
+        self.db.commit()
+
+    def test_json_parsed_on_first_access(self):
+        node_id = self.env.create_node(api=False, meta={'tag': 'x'}).id
+        node = self._load_node(node_id)
+        self.assertNotIn('meta', node.__dict__)
+        self.assertEquals(node.meta['tag'], 'x')
+        self.assertIn('meta', node.__dict__)
+
+    def test_json_not_parsed_by_query(self):
+        nodes_ids = [
+            self.env.create_node(api=False, meta={'tag': i}).id
+            for i in xrange(3)
+        ]
+        self.db.expunge_all()
+        with patch('nailgun.api.fields.json.loads',
+                   wraps=json.loads) as loads:
+            nodes = self.db.query(Node).filter(
+                Node.id.in_(nodes_ids)
+            ).order_by(Node.id).all()
+            self.assertEquals(loads.call_count, 0)
+            self.assertEquals(nodes[1].meta['tag'], 1)
+            self.assertEquals(loads.call_count, 1)
+
+        meta = dict(nodes[1].meta, tag='changed')
+        nodes[1].meta = meta
+        self.db.commit()
+        self.assertEquals(self._load_node(nodes_ids[1]).meta, meta)
+        self.assertEquals(self._load_node(nodes_ids[2]).meta['tag'], 2)
+
+    def test_lazy_loader_installed_for_json_columns(self):
+        self.assertIsInstance(Node.meta.property.strategy, LazyJSONLoader)
+        self.assertNotIsInstance(Node.name.property.strategy, LazyJSONLoader)
+
+    def test_native_json_column(self):
+        Base = declarative_base()
+
+        class Item(Base):
+            __tablename__ = 'test_native_json_items'
+            id = Column(Integer, primary_key=True)
+            data = Column(JSON)
+
+        with patch.dict(settings.DATABASE, native_json=True):
+            # table is created and dropped in test session, so
+            # the session doesn't hold locks of dropped table
+            Item.__table__.create(self.db.connection())
+            self.addCleanup(self._drop_table, Item.__table__)
+            self.assertEquals(
+                self.db.execute(
+                    "SELECT data_type FROM information_schema.columns "
+                    "WHERE table_name = 'test_native_json_items' "
+                    "AND column_name = 'data'"
+                ).scalar(),
+                'json'
+            )
+            self.db.add(Item(data={'a': [1, 2]}))
+            self.db.commit()
+            self.db.expunge_all()
+            item = self.db.query(Item).one()
+            self.assertIsInstance(
+                Item.data.property.strategy, LazyJSONLoader
+            )
+            self.assertNotIn('data', item.__dict__)
+            self.assertEquals(item.data, {'a': [1, 2]})
+
+    def test_json_column_queries_return_parsed_values(self):
+        node_id = self.env.create_node(api=False, meta={'tag': 'x'}).id
+        meta = self.db.query(Node.meta).filter_by(id=node_id).scalar()
+        self.assertEquals(meta['tag'], 'x')
+
+    def test_not_changed_json_is_not_written(self):
+        node_id = self.env.create_node(api=False).id
+        node = self._load_node(node_id)
+        with QueriesCounter() as counter:
+            node.status = 'ready'
+            self.db.commit()
+        updates = filter(lambda s: s.startswith('UPDATE'), counter.statements)
+        self.assertEquals(len(updates), 1)
+        self.assertNotIn('meta', updates[0])
+
+        node = self._load_node(node_id)
+        with QueriesCounter() as counter:
+            node.meta = dict(node.meta)
+            self.db.commit()
+        self.assertEquals(counter.count, 0)
+
+    def test_assigned_json_is_written_if_not_read(self):
+        node_id = self.env.create_node(api=False, meta={'tag': 'x'}).id
+        node = self._load_node(node_id)
+        with QueriesCounter() as counter:
+            node.meta = {'tag': 'x'}
+            self.db.commit()
+        updates = filter(lambda s: s.startswith('UPDATE'), counter.statements)
+        self.assertEquals(len(updates), 1)
+        self.assertIn('meta', updates[0])
+
+    def test_changed_json_is_written(self):
+        node_id = self.env.create_node(api=False).id
+        node = self._load_node(node_id)
+        meta = dict(node.meta, tag='y')
+        node.meta = meta
+        self.db.commit()
+        node = self._load_node(node_id)
+        self.assertEquals(node.meta, meta)
+
+    def test_compressed_json_stored_compressed(self):
+        cache = {'args': {'nodes': [{'uid': i} for i in xrange(100)]}}
+        task = Task(name='deployment', cache=cache)
+        self.db.add(task)
+        self.db.commit()
+        task_id = task.id
+        raw = self.db.query(
+            CompressedJSON.raw_column(Task.__table__.c.cache)
+        ).filter(Task.id == task_id).scalar()
+        self.assertTrue(raw.startswith(CompressedJSON.prefix))
+
+        self.db.expunge_all()
+        task = self.db.query(Task).get(task_id)
+        self.assertNotIn('cache', task.__dict__)
+        self.assertEquals(task.cache, cache)
+
+    def test_uncompressed_json_is_read(self):
+        task = Task(name='deployment')
+        self.db.add(task)
+        self.db.commit()
+        task_id = task.id
+        self.db.execute(
+            "UPDATE tasks SET cache = :cache WHERE id = :id",
+            {'cache': '{"a": 1}', 'id': task_id}
+        )
+        self.db.commit()
+        self.db.expunge_all()
+        self.assertEquals(self.db.query(Task).get(task_id).cache, {'a': 1})
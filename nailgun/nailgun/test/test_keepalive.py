@@ -16,6 +16,7 @@
 
 import json
 import time
+from datetime import datetime, timedelta
 
 from mock import patch
 
@@ -28,6 +29,7 @@ from nailgun.task.manager import DeploymentTaskManager
 from nailgun.task.fake import FAKE_THREADS
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
+from nailgun.test.base import QueriesCounter
 from nailgun.api.models import Cluster, Attributes, Task, Notification, Node
 from nailgun.api.models import IPAddr, NetworkGroup, Network
 
@@ -70,3 +72,74 @@ class TestKeepalive(BaseHandlers):
         time.sleep(self.watcher.interval + 2)
         self.env.refresh_nodes()
         self.assertEqual(node.online, True)
+
+
+class TestKeepaliveStatusCheck(BaseHandlers):
+
+    def setUp(self):
+        super(TestKeepaliveStatusCheck, self).setUp()
+        self.watcher = KeepAliveThread(interval=30, timeout=60)
+        self.stale = datetime.now() - timedelta(hours=1)
+        self.watcher.started_at = self.stale
+
+    def create_stale_node(self, **kwargs):
+        node = self.env.create_node(**kwargs)
+        node.timestamp = self.stale
+        self.db.commit()
+        return node
+
+    def test_nodes_go_offline_in_one_transaction(self):
+        nodes = [self.create_stale_node() for i in range(5)]
+        provisioning = self.create_stale_node(status="provisioning")
+        alive = self.env.create_node()
+
+        with QueriesCounter() as counter:
+            self.assertEquals(self.watcher.update_status_nodes(), 5)
+        self.assertEquals(
+            1, len(filter(lambda s: s.startswith('UPDATE nodes'),
+                          counter.statements))
+        )
+        self.assertEquals(
+            1, len(filter(lambda s: s.startswith('INSERT INTO notif'),
+                          counter.statements))
+        )
+
+        self.db.expire_all()
+        self.assertEquals([False] * 5, [n.online for n in nodes])
+        self.assertTrue(provisioning.online)
+        self.assertTrue(alive.online)
+        notifications = self.db.query(Notification).filter_by(
+            topic="error"
+        ).all()
+        self.assertEquals(
+            sorted(n.id for n in nodes),
+            sorted(n.node_id for n in notifications)
+        )
+        self.assertEquals(
+            u"Node '{0}' has gone away".format(
+                nodes[0].human_readable_name),
+            filter(lambda n: n.node_id == nodes[0].id,
+                   notifications)[0].message
+        )
+        self.assertEquals(self.watcher.update_status_nodes(), 0)
+
+    def test_nodes_not_checked_until_timeout_after_start(self):
+        self.create_stale_node()
+        self.watcher.started_at = datetime.now()
+        self.assertEquals(self.watcher.update_status_nodes(), 0)
+
+    def test_nodes_expired_during_interval_go_offline_at_once(self):
+        deadline = datetime.now() - timedelta(seconds=self.watcher.timeout)
+        nodes = [self.env.create_node() for i in range(3)]
+        for i, node in enumerate(nodes):
+            node.timestamp = deadline - timedelta(
+                seconds=i * self.watcher.interval / len(nodes) + 1
+            )
+        self.db.commit()
+
+        with QueriesCounter() as counter:
+            self.assertEquals(self.watcher.update_status_nodes(), 3)
+        self.assertEquals(
+            1, len(filter(lambda s: s.startswith('UPDATE nodes'),
+                          counter.statements))
+        )
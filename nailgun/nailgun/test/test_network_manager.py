@@ -28,6 +28,7 @@ from nailgun.api.models import Node, IPAddr, Vlan, IPAddrRange
 from nailgun.api.models import Network, NetworkGroup
 from nailgun.settings import settings
 from nailgun.test.base import fake_tasks
+from nailgun.test.base import QueriesCounter
 
 
 class TestNetworkManager(BaseHandlers):
@@ -84,6 +85,51 @@ class TestNetworkManager(BaseHandlers):
         self.assertEquals(False, gateway in assigned_ips)
         self.assertEquals(False, broadcast in assigned_ips)
 
+    def test_bulk_assign_ips_is_idempotent(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True},
+                {"pending_addition": True}
+            ]
+        )
+        nodes_ids = [n.id for n in self.env.nodes]
+        networks_names = ("management", "public", "storage")
+
+        self.env.network_manager.bulk_assign_ips(nodes_ids, networks_names)
+        ips = set([
+            (ip.node, ip.network, ip.ip_addr)
+            for ip in self.db.query(IPAddr).filter(
+                IPAddr.node.in_(nodes_ids)
+            )
+        ])
+        self.assertEquals(len(ips), len(nodes_ids) * len(networks_names))
+        self.assertEquals(
+            len(set([ip_addr for _, _, ip_addr in ips])),
+            len(ips)
+        )
+
+        self.env.network_manager.bulk_assign_ips(nodes_ids, networks_names)
+        ips_after = set([
+            (ip.node, ip.network, ip.ip_addr)
+            for ip in self.db.query(IPAddr).filter(
+                IPAddr.node.in_(nodes_ids)
+            )
+        ])
+        self.assertEquals(ips, ips_after)
+
+    def test_bulk_assign_ips_fails_for_unknown_network(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"pending_addition": True}]
+        )
+        self.assertRaises(
+            errors.AssignIPError,
+            self.env.network_manager.bulk_assign_ips,
+            [self.env.nodes[0].id],
+            ["management", "unknown"]
+        )
+
     def test_assign_vip(self):
         cluster = self.env.create_cluster(api=True)
         vip = self.env.network_manager.assign_vip(cluster['id'], "management")
@@ -122,6 +168,37 @@ class TestNetworkManager(BaseHandlers):
         fixed_nets = filter(lambda net: net['name'] == 'fixed', network_data)
         self.assertEquals(fixed_nets, [])
 
+    def test_cluster_topology_serves_nodes_networks(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True},
+                {"pending_addition": True},
+                {"pending_addition": True}
+            ]
+        )
+        nodes_ids = [n.id for n in self.env.nodes]
+        self.env.network_manager.bulk_assign_ips(
+            nodes_ids,
+            ("management", "public", "storage")
+        )
+
+        topology = self.env.network_manager.get_cluster_topology(
+            self.env.clusters[0]
+        )
+        for node in self.env.nodes:
+            network_data = topology.get_node_networks(node)
+            self.assertEquals(
+                network_data,
+                self.env.network_manager.get_node_networks(node.id)
+            )
+            nets_with_ip = filter(lambda net: 'ip' in net, network_data)
+            self.assertEquals(
+                sorted([net['name'] for net in nets_with_ip]),
+                ['management', 'public', 'storage']
+            )
+            self.assertEquals(network_data[-1]['name'], 'admin')
+
     def test_nets_empty_list_if_node_does_not_belong_to_cluster(self):
         node = self.env.create_node(api=False)
         network_data = self.env.network_manager.get_node_networks(node.id)
@@ -210,6 +287,30 @@ class TestNetworkManager(BaseHandlers):
         self.assertEquals(len(admin_ips), 1)
         self.assertEquals(admin_ips[0].ip_addr, '10.0.0.1')
 
+    def test_bulk_assign_admin_ips(self):
+        nodes_ids = [self.env.create_node().id for _ in xrange(3)]
+        self.env.network_manager.assign_admin_ips(nodes_ids[0], 1)
+        admin_net_id = self.env.network_manager.get_admin_network_id()
+        nums = dict(zip(nodes_ids, [2, 1, 3]))
+
+        with QueriesCounter() as counter:
+            admin_ips = self.env.network_manager.bulk_assign_admin_ips(nums)
+        inserts = filter(
+            lambda s: s.startswith('INSERT'),
+            counter.statements
+        )
+        self.assertEquals(len(inserts), 1)
+
+        for node_id, num in nums.iteritems():
+            db_ips = [i.ip_addr for i in self.db.query(IPAddr).
+                      filter_by(node=node_id).
+                      filter_by(network=admin_net_id).
+                      order_by(IPAddr.id)]
+            self.assertEquals(admin_ips[node_id], db_ips)
+            self.assertEquals(len(db_ips), num)
+        all_ips = sum(admin_ips.values(), [])
+        self.assertEquals(len(set(all_ips)), len(all_ips))
+
     def test_vlan_set_null(self):
         cluster = self.env.create_cluster(api=True)
         cluster_db = self.env.clusters[0]
@@ -313,3 +414,58 @@ class TestNetworkManager(BaseHandlers):
             ),
             itertools.product((0, 1), ('eth0', 'eth1'))
         )
+
+    def test_get_free_ips_skips_used_ips_and_gateway(self):
+        cluster = self.env.create_cluster(api=True)
+        management_ng = self.db.query(NetworkGroup).filter_by(
+            cluster_id=cluster['id'],
+            name='management'
+        ).first()
+        first_ip = IPAddress(management_ng.ip_ranges[0].first)
+        management_ng.gateway = str(first_ip + 1)
+        self.db.add(IPAddr(ip_addr=str(first_ip)))
+        self.db.add(IPAddr(ip_addr=str(first_ip + 3)))
+        self.db.commit()
+
+        free_ips = self.env.network_manager.get_free_ips(
+            management_ng.id,
+            num=3
+        )
+        self.assertEquals(
+            free_ips,
+            [str(first_ip + 2), str(first_ip + 4), str(first_ip + 5)]
+        )
+
+    def test_get_free_ips_from_several_ranges(self):
+        cluster = self.env.create_cluster(api=True)
+        management_ng = self.db.query(NetworkGroup).filter_by(
+            cluster_id=cluster['id'],
+            name='management'
+        ).first()
+        map(self.db.delete, management_ng.ip_ranges)
+        self.db.add_all([
+            IPAddrRange(
+                first='192.168.10.1',
+                last='192.168.10.2',
+                network_group_id=management_ng.id
+            ),
+            IPAddrRange(
+                first='192.168.20.1',
+                last='192.168.20.1',
+                network_group_id=management_ng.id
+            )
+        ])
+        self.db.add(IPAddr(ip_addr='192.168.10.2'))
+        self.db.commit()
+
+        free_ips = self.env.network_manager.get_free_ips(
+            management_ng.id,
+            num=2
+        )
+        self.assertEquals(free_ips, ['192.168.10.1', '192.168.20.1'])
+        self.assertRaises(
+            errors.OutOfIPs,
+            self.env.network_manager.get_free_ips,
+            management_ng.id,
+            num=3
+        )
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+from nailgun.api.models import Node
+from nailgun.api.models import NodeNICInterface
+from nailgun.api.models import Notification
+from nailgun.test.base import BaseHandlers
+from nailgun.test.base import QueriesCounter
+from nailgun.test.base import reverse
+
+
+class TestHandlers(BaseHandlers):
+
+    def _agent_put(self, data, expect_errors=False):
+        return self.app.put(
+            reverse('NodeAgentHandler'),
+            json.dumps(data),
+            headers=self.default_headers,
+            expect_errors=expect_errors
+        )
+
+    def test_agent_checkin_returns_ids(self):
+        node = self.env.create_node(api=True, meta=self.env.default_metadata())
+        node_db = self.env.nodes[0]
+        resp = self._agent_put([
+            {'mac': node_db.mac, 'is_agent': True, 'manufacturer': 'new',
+             'meta': self.env.default_metadata()}
+        ])
+        self.assertEquals(resp.status, 200)
+        self.assertEquals(json.loads(resp.body), [{'id': node_db.id}])
+        node_db = self.db.query(Node).get(node_db.id)
+        self.assertEquals('new', node_db.manufacturer)
+
+    def test_agent_checkin_does_not_change_provisioning_status(self):
+        self.env.create_node(
+            api=True,
+            status='provisioning',
+            meta=self.env.default_metadata()
+        )
+        node_db = self.env.nodes[0]
+        resp = self._agent_put([
+            {'mac': node_db.mac, 'is_agent': True, 'status': 'discover'}
+        ])
+        self.assertEquals(resp.status, 200)
+        node_db = self.db.query(Node).get(node_db.id)
+        self.assertEquals('provisioning', node_db.status)
+
+    def test_agent_checkin_sets_node_online(self):
+        self.env.create_node(api=True, meta=self.env.default_metadata())
+        node_db = self.env.nodes[0]
+        node_db.online = False
+        self.db.commit()
+        timestamp = node_db.timestamp
+
+        resp = self._agent_put({'mac': node_db.mac, 'is_agent': True})
+        self.assertEquals(resp.status, 200)
+        node_db = self.db.query(Node).get(node_db.id)
+        self.assertTrue(node_db.online)
+        self.assertTrue(node_db.timestamp > timestamp)
+        notification = self.db.query(Notification).filter_by(
+            node_id=node_db.id,
+            topic='discover'
+        ).order_by(Notification.id.desc()).first()
+        self.assertIn('is back online', notification.message)
+
+    def test_agent_checkin_updates_only_changed_interfaces(self):
+        meta = self.env.default_metadata()
+        meta.update(self.env.generate_interfaces_in_meta(2))
+        self.env.create_node(api=True, meta=meta)
+        node_db = self.env.nodes[0]
+
+        with QueriesCounter() as counter:
+            self._agent_put([
+                {'mac': node_db.mac, 'is_agent': True, 'meta': meta}
+            ])
+        self.assertEquals(
+            [], filter(lambda s: 'node_nic_interfaces' in s and
+                       not s.startswith('SELECT'), counter.statements)
+        )
+
+        meta['interfaces'][1]['current_speed'] = 1000
+        new_iface = self.env.generate_interfaces_in_meta(1)['interfaces'][0]
+        meta['interfaces'] = [meta['interfaces'][1], new_iface]
+        resp = self._agent_put([
+            {'mac': node_db.mac, 'is_agent': True, 'meta': meta}
+        ])
+        self.assertEquals(resp.status, 200)
+        interfaces = self.db.query(NodeNICInterface).filter_by(
+            node_id=node_db.id
+        ).order_by(NodeNICInterface.id).all()
+        self.assertEquals(
+            [(i.mac, i.current_speed) for i in interfaces],
+            [(iface['mac'], iface['current_speed'])
+             for iface in meta['interfaces']]
+        )
+
+    def test_agent_checkin_finds_node_by_interface_mac(self):
+        meta = self.env.default_metadata()
+        meta.update(self.env.generate_interfaces_in_meta(1))
+        self.env.create_node(
+            api=True,
+            mac=meta['interfaces'][0]['mac'],
+            meta=meta
+        )
+        node_db = self.env.nodes[0]
+        resp = self._agent_put([
+            {'mac': '00:00:00:00:00:00', 'is_agent': True, 'meta': meta}
+        ])
+        self.assertEquals(resp.status, 200)
+        self.assertEquals(json.loads(resp.body), [{'id': node_db.id}])
+
+    def test_agent_checkin_fails_for_unknown_node(self):
+        resp = self._agent_put(
+            [{'mac': '00:00:00:00:00:00', 'is_agent': True}],
+            expect_errors=True
+        )
+        self.assertEquals(resp.status, 404)
+
+    def test_agent_checkin_fails_without_mac(self):
+        resp = self._agent_put(
+            [{'is_agent': True}],
+            expect_errors=True
+        )
+        self.assertEquals(resp.status, 400)
@@ -20,6 +20,8 @@ from paste.fixture import TestApp
 
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
+from nailgun.test.base import QueriesCounter
+from nailgun.keepalive.heartbeat import heartbeats
 from nailgun.api.models import Node, Notification
 
 
@@ -70,6 +72,42 @@ class TestHandlers(BaseHandlers):
             response[0]['id']
         )
 
+    def test_node_list_queries_count_does_not_depend_on_nodes(self):
+        def get_nodes_queries_count():
+            with QueriesCounter() as counter:
+                resp = self.app.get(
+                    reverse('NodeCollectionHandler'),
+                    headers=self.default_headers
+                )
+            self.assertEquals(200, resp.status)
+            self.assertEquals(
+                len(self.env.nodes),
+                len(json.loads(resp.body))
+            )
+            return counter.count
+
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"pending_addition": True}] * 2
+        )
+        self.env.create_node(api=False)
+        self.env.network_manager.bulk_assign_ips(
+            [n.id for n in self.env.nodes if n.cluster_id],
+            ("management", "public", "storage")
+        )
+        queries_for_few_nodes = get_nodes_queries_count()
+
+        cluster_id = self.env.clusters[0].id
+        for i in xrange(10):
+            self.env.create_node(api=False, cluster_id=cluster_id)
+        self.env.network_manager.bulk_assign_ips(
+            [n.id for n in self.env.nodes if n.cluster_id],
+            ("management", "public", "storage")
+        )
+        queries_for_many_nodes = get_nodes_queries_count()
+
+        self.assertEquals(queries_for_few_nodes, queries_for_many_nodes)
+
     def test_node_get_with_cluster_None(self):
         self.env.create(
             cluster_kwargs={"api": False},
@@ -177,6 +215,7 @@ class TestHandlers(BaseHandlers):
             ]),
             headers=self.default_headers)
         self.assertEquals(resp.status, 200)
+        heartbeats.flush()
         node = self.db.query(Node).get(node.id)
         self.assertNotEquals(node.timestamp, timestamp)
         self.assertEquals('new', node.manufacturer)
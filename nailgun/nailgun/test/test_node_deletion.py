@@ -21,8 +21,12 @@ from mock import Mock, patch
 import nailgun
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
-from nailgun.api.models import Node, IPAddr
+from nailgun.test.base import QueriesCounter
+from nailgun.api.models import Node, IPAddr, Task
 from nailgun.api.models import Network, NetworkGroup
+from nailgun.task.certs import PuppetCertCleaner
+from nailgun.task.helpers import TaskHelper
+from nailgun.task.task import DeletionTask
 from nailgun.test.base import fake_tasks
 
 logger = logging.getLogger(__name__)
@@ -67,3 +71,89 @@ class TestNodeDeletion(BaseHandlers):
 
         self.assertEquals(list(management_net.nodes), [])
         self.assertEquals(list(ipaddrs), [])
+
+
+class TestPuppetCertCleaner(BaseHandlers):
+
+    def create_deletion_task(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_deletion": True},
+                {"pending_deletion": True}
+            ]
+        )
+        task = Task(name="node_deletion", cluster=self.env.clusters[0])
+        self.db.add(task)
+        self.db.commit()
+        return task
+
+    @patch('nailgun.rpc.cast')
+    def test_certs_not_cleaned_in_request(self, mocked_rpc):
+        task = self.create_deletion_task()
+        fqdns = [
+            TaskHelper.make_slave_fqdn(n.id, n.role) for n in self.env.nodes
+        ]
+        with patch.multiple('nailgun.task.task.settings',
+                            FAKE_TASKS=False, FAKE_TASKS_AMQP=False):
+            with patch('nailgun.task.task.PuppetCertCleaner') as cleaner:
+                with patch('nailgun.task.certs.subprocess.Popen') as popen:
+                    DeletionTask.execute(task)
+        self.assertEquals(popen.call_count, 0)
+        self.assertEquals(cleaner.call_count, 1)
+        task_uuid, hostnames = cleaner.call_args[0]
+        self.assertEquals(task_uuid, task.uuid)
+        self.assertEquals(sorted(hostnames), sorted(fqdns))
+        cleaner.return_value.start.assert_called_once_with()
+        self.assertEquals(mocked_rpc.call_count, 1)
+
+    def test_results_stored_into_task(self):
+        task = self.create_deletion_task()
+        task_uuid = task.uuid
+
+        def popen(args, **kwargs):
+            proc = Mock()
+            proc.returncode = 0 if args[-1] == "ok.example.com" else 1
+            proc.communicate.return_value = ("", "no cert")
+            return proc
+
+        with patch('nailgun.task.certs.subprocess.Popen',
+                   side_effect=popen) as mocked_popen:
+            cleaner = PuppetCertCleaner(
+                task_uuid,
+                ["ok.example.com", "bad.example.com"],
+                workers=2
+            )
+            cleaner.start()
+            cleaner.join()
+        self.assertEquals(mocked_popen.call_count, 2)
+
+        self.db.expire_all()
+        task = self.db.query(Task).filter_by(uuid=task_uuid).first()
+        self.assertEquals(task.result['puppet_certs'], {
+            'cleaned': ["ok.example.com"],
+            'failed': {"bad.example.com": "no cert"}
+        })
+
+    def test_results_merged_into_current_task_result(self):
+        task = self.create_deletion_task()
+        self.assertEquals(task.result, {})
+        # result is changed by another session after task was loaded
+        self.db.bind.execute(
+            Task.__table__.update().where(
+                Task.__table__.c.id == task.id
+            ).values(result={'removed': [1]})
+        )
+        cleaner = PuppetCertCleaner(task.uuid, [])
+        with QueriesCounter() as counter:
+            cleaner.report()
+        self.assertTrue(any(
+            s.startswith('SELECT') and 'FOR UPDATE' in s
+            for s in counter.statements
+        ))
+
+        self.db.expire_all()
+        self.assertEquals(task.result, {
+            'removed': [1],
+            'puppet_certs': {'cleaned': [], 'failed': {}}
+        })
@@ -22,6 +22,7 @@ from nailgun.rpc import receiver as rcvr
 from nailgun.test.base import BaseHandlers
 from nailgun.api.models import Node, Task, Notification
 from nailgun.test.base import reverse
+from nailgun.test.base import QueriesCounter
 from nailgun import notifier
 
 
@@ -161,3 +162,112 @@ class TestNotification(BaseHandlers):
             notifications[0].message,
             "Cluster deletion fake error"
         )
+
+    def test_notify_many(self):
+        cluster = self.env.create_cluster(api=False)
+        node = self.env.create_node(api=False)
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="super",
+            cluster_id=cluster.id
+        )
+        self.db.add(task)
+        self.db.commit()
+        notifier.notify("error", "Node failed",
+                        node_id=node.id, task_uuid=task.uuid)
+
+        failed = {
+            "topic": "error",
+            "message": "Node failed",
+            "cluster_id": cluster.id,
+            "node_id": node.id,
+            "task_uuid": task.uuid
+        }
+        done = {"topic": "done", "message": "Done"}
+        with QueriesCounter() as counter:
+            created = notifier.notify_many([failed, done, done])
+        self.assertEquals(created, 1)
+        self.assertEquals(
+            1, len(filter(lambda s: s.startswith('INSERT'),
+                          counter.statements))
+        )
+
+        notifications = self.db.query(Notification).order_by(
+            Notification.id
+        ).all()
+        self.assertEquals(
+            [(n.topic, n.message, n.task_id) for n in notifications],
+            [("error", "Node failed", task.id), ("done", "Done", None)]
+        )
+
+    def test_notifications_batch(self):
+        node = self.env.create_node(api=False)
+        with notifier.batch():
+            notifier.notify("done", "First")
+            with notifier.batch():
+                notifier.notify("discover", "Second", node_id=node.id)
+            self.assertEquals(self.db.query(Notification).count(), 0)
+            self.assertRaises(
+                Exception,
+                notifier.notify,
+                "discover", "No node")
+        self.assertEquals(
+            [n.message for n in self.db.query(Notification).order_by(
+                Notification.id)],
+            ["First", "Second"]
+        )
+
+        name = node.name
+        try:
+            with notifier.batch():
+                notifier.notify("done", "Third")
+                node.name = "Changed"
+                raise ValueError()
+        except ValueError:
+            pass
+        # notifications are created, but changes of block aren't committed
+        self.assertEquals(self.db.query(Notification).count(), 3)
+        self.db.refresh(node)
+        self.assertEquals(node.name, name)
+        notifier.notify("done", "Fourth")
+        self.assertEquals(self.db.query(Notification).count(), 4)
+
+    def test_deploy_errors_notified_at_once(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"status": "deploying"},
+                {"status": "deploying"},
+                {"status": "deploying"}
+            ]
+        )
+        cluster = self.env.clusters[0]
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deploy",
+            cluster_id=cluster.id
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        nodes = [
+            {"uid": n.id, "status": "error", "progress": 100,
+             "error_type": "deploy"}
+            for n in self.env.nodes
+        ]
+        with QueriesCounter() as counter:
+            rcvr.NailgunReceiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=nodes
+            )
+        self.assertEquals(
+            1, len(filter(lambda s: s.startswith('INSERT INTO notif'),
+                          counter.statements))
+        )
+        notifications = self.db.query(Notification).filter_by(
+            task_id=task.id
+        ).all()
+        self.assertEquals(
+            sorted(n.id for n in self.env.nodes),
+            sorted(n.node_id for n in notifications)
+        )
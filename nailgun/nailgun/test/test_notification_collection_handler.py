@@ -20,6 +20,7 @@ from paste.fixture import TestApp
 
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
+from nailgun.api.handlers.notifications import NotificationCollectionHandler
 
 
 class TestHandlers(BaseHandlers):
@@ -85,3 +86,69 @@ class TestHandlers(BaseHandlers):
         self.assertEquals(rn1['status'], 'read')
         self.assertIsNone(rn0.get('cluster', None))
         self.assertEquals(rn0['status'], 'read')
+
+    def get_notifications(self, **params):
+        resp = self.app.get(
+            reverse('NotificationCollectionHandler'),
+            params=params,
+            headers=self.default_headers,
+            expect_errors=True
+        )
+        if resp.status != 200:
+            return resp.status
+        return [n['id'] for n in json.loads(resp.body)]
+
+    def test_pagination(self):
+        ids = [self.env.create_notification().id for i in range(5)]
+
+        self.assertEquals(self.get_notifications(), ids)
+        self.assertEquals(self.get_notifications(limit=2), ids[3:])
+        self.assertEquals(
+            self.get_notifications(since_id=ids[1]),
+            ids[2:]
+        )
+        self.assertEquals(
+            self.get_notifications(since_id=ids[1], limit=2),
+            ids[2:4]
+        )
+        self.assertEquals(self.get_notifications(since_id=ids[-1]), [])
+        self.assertEquals(
+            self.get_notifications(before_id=ids[3], limit=2),
+            ids[1:3]
+        )
+        self.assertEquals(
+            self.get_notifications(since_id=ids[0], before_id=ids[3]),
+            ids[1:3]
+        )
+
+    def test_pagination_invalid_params(self):
+        self.assertEquals(self.get_notifications(since_id='abc'), 400)
+        self.assertEquals(self.get_notifications(limit=-1), 400)
+
+    def test_page_size_limited(self):
+        NotificationCollectionHandler.page_size = 3
+        try:
+            ids = [self.env.create_notification().id for i in range(5)]
+            self.assertEquals(self.get_notifications(limit=10), ids[2:])
+        finally:
+            NotificationCollectionHandler.page_size = 1000
+
+    def test_unread_count(self):
+        c = self.env.create_cluster(api=False)
+        self.env.create_notification()
+        self.env.create_notification(cluster_id=c.id)
+        self.env.create_notification(cluster_id=c.id, status='read')
+
+        resp = self.app.get(
+            reverse('NotificationUnreadCountHandler'),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertEquals(json.loads(resp.body), {"unread": 2})
+
+        resp = self.app.get(
+            reverse('NotificationUnreadCountHandler'),
+            params={'cluster_id': c.id},
+            headers=self.default_headers
+        )
+        self.assertEquals(json.loads(resp.body), {"unread": 1})
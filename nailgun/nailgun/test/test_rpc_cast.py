@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import zlib
+from unittest import TestCase
+
+from kombu import Connection
+from kombu import pools
+from mock import patch
+
+import nailgun.rpc as rpc
+from nailgun.api.fields import CompressedJSON
+from nailgun.api.models import Task
+from nailgun.test.base import BaseHandlers
+from nailgun.test.base import fake_tasks
+
+
+class TestRPCCast(TestCase):
+
+    def setUp(self):
+        self.connection = Connection('memory://')
+        patcher = patch.object(rpc, 'connection', self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(pools.reset)
+
+    def received(self):
+        messages = []
+        with Connection('memory://') as conn:
+            queue = conn.SimpleQueue(rpc.naily_queue)
+            while queue.qsize():
+                msg = queue.get(timeout=1)
+                messages.append(msg.payload)
+                msg.ack()
+            queue.close()
+        return messages
+
+    def test_cast_publishes_to_naily(self):
+        for i in xrange(3):
+            rpc.cast('naily', {'method': 'deploy', 'args': {'i': i}})
+        self.assertEqual(
+            self.received(),
+            [{'method': 'deploy', 'args': {'i': i}} for i in xrange(3)]
+        )
+
+    def test_cast_reuses_connection(self):
+        establish = Connection._establish_connection
+        with patch.object(Connection, '_establish_connection',
+                          autospec=True,
+                          side_effect=establish) as connect:
+            for i in xrange(5):
+                rpc.cast('naily', {'method': 'deploy', 'args': {}})
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(len(self.received()), 5)
+
+    def test_compact_cast(self):
+        node = {'uid': 1, 'meta': {'disks': ['sda']}}
+        message = {
+            'method': 'deploy',
+            'args': {
+                'nodes': [node, {'uid': 2}],
+                'attributes': {'controller_nodes': [dict(node)]}
+            }
+        }
+        with patch.dict(rpc.settings.RABBITMQ, {'compact_messages': True}):
+            rpc.cast('naily', [message])
+        self.assertEqual(
+            self.received(),
+            [[{
+                'method': 'deploy',
+                'args': {
+                    'nodes': [{'node_ref': 0}, {'uid': 2}],
+                    'attributes': {'controller_nodes': [{'node_ref': 0}]}
+                },
+                'node_blobs': [node]
+            }]]
+        )
+
+    def test_compact_keeps_unique_nodes(self):
+        message = {'args': {'nodes': [{'uid': 1}, {'uid': 1, 'x': 1}]}}
+        self.assertIs(rpc.compact(message), message)
+
+
+class TestCompactDeploymentMessage(BaseHandlers):
+
+    def tearDown(self):
+        self._wait_for_threads()
+        super(TestCompactDeploymentMessage, self).tearDown()
+
+    @fake_tasks(fake_rpc=False)
+    def test_deployment_message_size(self, mocked_rpc):
+        self.env.create(
+            cluster_kwargs={'mode': 'ha'},
+            nodes_kwargs=[
+                {'role': 'controller', 'pending_addition': True}
+                for i in xrange(3)
+            ] + [
+                {'role': 'compute', 'pending_addition': True}
+                for i in xrange(10)
+            ]
+        )
+        supertask = self.env.launch_deployment()
+        message = mocked_rpc.call_args[0][1][1]
+        self.assertEqual(message['method'], 'deploy')
+
+        plain = len(json.dumps(message))
+        compact = len(zlib.compress(json.dumps(rpc.compact(message))))
+        deployment = self.db.query(Task).filter_by(
+            parent_id=supertask.id,
+            name='deployment'
+        ).first()
+        stored = self.db.query(
+            CompressedJSON.raw_column(Task.__table__.c.cache)
+        ).filter(Task.id == deployment.id).scalar()
+        self.assertLess(compact * 10, plain)
+        self.assertLess(len(stored) * 10, plain)
+        self.assertEqual(deployment.cache, message)
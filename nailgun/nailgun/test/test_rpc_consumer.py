@@ -17,13 +17,18 @@
 import json
 import time
 import uuid
+from datetime import datetime, timedelta
 
+from mock import Mock
 from mock import patch
 
 import nailgun.rpc as rpc
 from nailgun.rpc import receiver as rcvr
+from nailgun.rpc.threaded import RPCConsumer
+from nailgun.keepalive.watcher import KeepAliveThread
 from nailgun.task.task import VerifyNetworksTask
 from nailgun.test.base import BaseHandlers
+from nailgun.test.base import QueriesCounter
 from nailgun.test.base import reverse
 from nailgun.api.models import Node
 from nailgun.api.models import Task
@@ -33,6 +38,8 @@ from nailgun.api.models import Attributes
 from nailgun.api.models import Network
 from nailgun.api.models import NetworkGroup
 from nailgun.api.models import IPAddr
+from nailgun.api.models import IPAddrRange
+from nailgun.api.models import NodeAttributes
 from nailgun.api.models import Vlan
 
 
@@ -421,6 +428,208 @@ class TestConsumer(BaseHandlers):
         self.db.refresh(self.env.nodes[0])
         self.assertEqual(self.env.nodes[0].progress, 100)
 
+    def test_deploy_resp_updates_nodes_in_one_statement(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "provisioned"}
+                for i in xrange(5)
+            ]
+        )
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deployment",
+            cluster_id=self.env.clusters[0].id,
+            status="running"
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        kwargs = {
+            'task_uuid': task.uuid,
+            'nodes': [
+                {'uid': n.id, 'status': 'deploying', 'progress': 50}
+                for n in self.env.nodes
+            ]
+        }
+        with QueriesCounter() as counter:
+            self.receiver.deploy_resp(**kwargs)
+        updates = [
+            s for s in counter.statements if s.startswith("UPDATE nodes")
+        ]
+        self.assertEqual(len(updates), 1)
+
+        for node in self.env.nodes:
+            self.db.refresh(node)
+            self.assertEqual(node.status, "deploying")
+            self.assertEqual(node.progress, 50)
+        self.db.refresh(task)
+        self.assertEqual(task.progress, 65)
+
+    def test_deploy_resp_progress_from_message_delta(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "provisioned"}
+                for i in xrange(4)
+            ]
+        )
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deployment",
+            cluster_id=self.env.clusters[0].id,
+            status="running"
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        node_ids = [n.id for n in self.env.nodes]
+        self.receiver.deploy_resp(
+            task_uuid=task.uuid,
+            nodes=[{'uid': node_ids[0], 'status': 'deploying',
+                    'progress': 0}]
+        )
+        self.db.refresh(task)
+        self.assertEqual(task.progress, 7)
+
+        with QueriesCounter() as counter:
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': node_ids[1], 'status': 'ready',
+                        'progress': 100}]
+            )
+        # nodes of cluster aren't reloaded for progress calculation
+        self.assertFalse(any(
+            s.startswith("SELECT") and "FROM nodes" in s
+            for s in counter.statements
+        ))
+        self.db.refresh(task)
+        self.assertEqual(task.progress, 32)
+
+    def test_deploy_resp_progress_follows_nodes_changes(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "provisioned"}
+                for i in xrange(4)
+            ] + [{"api": False, "status": "error", "progress": 100}]
+        )
+        cluster = self.env.clusters[0]
+        cluster.clear_pending_changes()
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deployment",
+            cluster_id=cluster.id,
+            status="running"
+        )
+        self.db.add(task)
+        self.db.commit()
+        node_ids = [n.id for n in self.env.nodes]
+
+        def progress():
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': node_ids[0], 'status': 'deploying',
+                        'progress': 0}]
+            )
+            self.db.refresh(task)
+            return task.progress
+
+        self.assertEqual(progress(), 7)
+
+        # node went offline by keepalive watcher
+        watcher = KeepAliveThread(interval=30, timeout=60)
+        watcher.started_at = datetime.now() - timedelta(hours=1)
+        self.db.query(Node).filter_by(id=node_ids[1]).update(
+            {'timestamp': watcher.started_at}
+        )
+        self.db.commit()
+        self.assertEqual(watcher.update_status_nodes(), 1)
+        self.assertEqual(progress(), 32)
+
+        # failed node needs redeployment after cluster is changed
+        cluster.add_pending_changes("attributes")
+        self.assertEqual(progress(), 46)
+
+        rcvr.NailgunReceiver._delete_nodes([node_ids[2]])
+        self.db.commit()
+        self.assertEqual(progress(), 57)
+
+    def test_deploy_resp_progress_after_node_back_online(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "provisioned"},
+                {"api": False, "status": "provisioned", "online": False}
+            ]
+        )
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deployment",
+            cluster_id=self.env.clusters[0].id,
+            status="running"
+        )
+        self.db.add(task)
+        self.db.commit()
+        deployed, offline = self.env.nodes
+
+        def progress():
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': deployed.id, 'status': 'deploying',
+                        'progress': 0}]
+            )
+            self.db.refresh(task)
+            return task.progress
+
+        self.assertEqual(progress(), 65)
+
+        resp = self.app.put(
+            reverse('NodeAgentHandler'),
+            json.dumps([{'mac': offline.mac, 'is_agent': True}]),
+            headers=self.default_headers
+        )
+        self.assertEquals(resp.status, 200)
+        self.db.refresh(offline)
+        self.assertTrue(offline.online)
+        self.assertEqual(progress(), 15)
+
+    def test_deploy_resp_offline_node(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "deploying"},
+                {"api": False, "status": "deploying"}
+            ]
+        )
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deployment",
+            cluster_id=self.env.clusters[0].id,
+            status="running"
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        offline, online = self.env.nodes
+        self.receiver.deploy_resp(
+            task_uuid=task.uuid,
+            nodes=[
+                {'uid': offline.id, 'online': False},
+                {'uid': online.id, 'progress': 10}
+            ]
+        )
+        self.db.refresh(offline)
+        self.db.refresh(online)
+        self.assertEqual(offline.progress, 100)
+        self.assertEqual(offline.error_msg, "Node is offline")
+        self.assertEqual(online.progress, 10)
+        notifications = self.db.query(Notification).filter_by(
+            node_id=offline.id,
+            topic="error"
+        ).all()
+        self.assertEqual(len(notifications), 1)
+
     def test_remove_nodes_resp(self):
         self.env.create(
             cluster_kwargs={},
@@ -559,6 +768,67 @@ class TestConsumer(BaseHandlers):
         cluster_db = self.db.query(Cluster).get(cluster_id)
         self.assertIsNone(cluster_db)
 
+    def test_remove_cluster_resp_bulk_deletes(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"api": False} for _ in xrange(5)]
+        )
+        cluster_id = self.env.clusters[0].id
+        nodes_ids = [n.id for n in self.env.nodes]
+        groups_ids = [
+            ng.id for ng in self.db.query(NetworkGroup).filter_by(
+                cluster_id=cluster_id
+            )
+        ]
+        notification_id = self.env.create_notification(
+            cluster_id=cluster_id
+        ).id
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="cluster_deletion",
+            cluster_id=cluster_id
+        )
+        self.db.add(task)
+        self.db.commit()
+        task.create_subtask("node_deletion")
+
+        kwargs = {'task_uuid': task.uuid,
+                  'progress': 100,
+                  'status': 'ready',
+                  'nodes': [{'uid': nodes_ids[0]}],
+                  'error_nodes': []}
+
+        with QueriesCounter() as counter:
+            self.receiver.remove_cluster_resp(**kwargs)
+        deletes = filter(
+            lambda s: s.startswith('DELETE'),
+            counter.statements
+        )
+        # attributes and nodes for removed node, the rest of nodes,
+        # seven kinds of cluster objects and unused vlans
+        self.assertEquals(len(deletes), 12)
+
+        self.db.expire_all()
+        self.assertIsNone(self.db.query(Cluster).get(cluster_id))
+        self.assertEquals(
+            self.db.query(Node).filter(Node.id.in_(nodes_ids)).count(), 0
+        )
+        self.assertEquals(
+            self.db.query(NodeAttributes).filter(
+                NodeAttributes.node_id.in_(nodes_ids)
+            ).count(), 0
+        )
+        self.assertEquals(
+            self.db.query(IPAddrRange).filter(
+                IPAddrRange.network_group_id.in_(groups_ids)
+            ).count(), 0
+        )
+        self.assertEquals(
+            self.db.query(Task).filter_by(cluster_id=cluster_id).count(), 0
+        )
+        notification = self.db.query(Notification).get(notification_id)
+        self.assertIsNone(notification.cluster_id)
+
     def test_remove_cluster_resp_failed(self):
         self.env.create(
             cluster_kwargs={},
@@ -609,3 +879,151 @@ class TestConsumer(BaseHandlers):
             .join(NetworkGroup).\
             filter(NetworkGroup.cluster_id == cluster_db.id).all()
         self.assertNotEqual(len(nets_db), 0)
+
+
+class TestConsumerCoalescing(BaseHandlers):
+
+    def progress_msg(self, task_uuid, nodes=None, **kwargs):
+        args = {'task_uuid': task_uuid}
+        if nodes is not None:
+            args['nodes'] = nodes
+        args.update(kwargs)
+        return {'method': 'deploy_resp', 'args': args}
+
+    def test_progress_messages_merged(self):
+        messages = [
+            (self.progress_msg('t1', [{'uid': 1, 'progress': 10}]), 1),
+            (self.progress_msg('t2', progress=5), 2),
+            (self.progress_msg('t1', [{'uid': 2, 'status': 'deploying'}]), 3),
+            (self.progress_msg('t1', [{'uid': 1, 'progress': 30}]), 4),
+        ]
+        batch = RPCConsumer.coalesce(messages)
+        self.assertEqual(len(batch), 2)
+        body, msgs = batch[0]
+        self.assertEqual(msgs, [1, 3, 4])
+        self.assertEqual(
+            body['args']['nodes'],
+            [{'uid': 1, 'progress': 30}, {'uid': 2, 'status': 'deploying'}]
+        )
+        self.assertEqual(batch[1], (messages[1][0], [2]))
+
+    def test_status_and_errors_not_merged(self):
+        messages = [
+            (self.progress_msg('t1', progress=10), 1),
+            (self.progress_msg('t1', status='error', error='Failed'), 2),
+            (self.progress_msg('t1', progress=20), 3),
+            (self.progress_msg(
+                't1', [{'uid': 1, 'status': 'error', 'progress': 50}]), 4),
+            (self.progress_msg('t1', [{'uid': 2, 'online': False}]), 5),
+            (self.progress_msg('t1', progress=30), 6),
+            (self.progress_msg('t1', progress=40), 7),
+        ]
+        batch = RPCConsumer.coalesce(messages)
+        self.assertEqual(
+            [msgs for body, msgs in batch],
+            [[1], [2], [3], [4], [5], [6, 7]]
+        )
+        self.assertEqual(batch[-1][0]['args']['progress'], 40)
+
+    def test_process_pending_acks_merged_messages(self):
+        receiver = Mock()
+        consumer = RPCConsumer(Mock(), receiver, workers=2)
+        self.addCleanup(consumer.stop_workers)
+        msgs = [Mock(), Mock(), Mock()]
+        consumer.consume_msg(self.progress_msg('t1', progress=10), msgs[0])
+        consumer.consume_msg(self.progress_msg('t1', progress=20), msgs[1])
+        consumer.consume_msg(
+            self.progress_msg('t1', status='ready', progress=100), msgs[2]
+        )
+        consumer.process_pending()
+        consumer.wait()
+
+        self.assertEqual(
+            receiver.deploy_resp.call_args_list,
+            [
+                ((), {'task_uuid': 't1', 'progress': 20}),
+                ((), {'task_uuid': 't1', 'status': 'ready',
+                      'progress': 100}),
+            ]
+        )
+        for msg in msgs:
+            msg.ack.assert_called_once_with()
+        self.assertEqual(consumer.pending, [])
+
+    def test_messages_of_cluster_processed_by_one_worker(self):
+        cluster = self.env.create_cluster(api=False)
+        tasks = []
+        for i in xrange(3):
+            task = Task(uuid=str(uuid.uuid4()), name="deploy",
+                        cluster_id=cluster.id)
+            self.db.add(task)
+            tasks.append(task)
+        self.db.commit()
+
+        receiver = Mock()
+        consumer = RPCConsumer(Mock(), receiver, workers=4)
+        self.addCleanup(consumer.stop_workers)
+        workers = set(
+            consumer.worker_for(
+                {'method': 'deploy_resp', 'args': {'task_uuid': t.uuid}}
+            ) for t in tasks
+        )
+        self.assertEqual(len(workers), 1)
+
+        for i, task in enumerate(tasks):
+            consumer.consume_msg(
+                self.progress_msg(task.uuid, status='ready'), Mock()
+            )
+        consumer.process_pending()
+        consumer.wait()
+        self.assertEqual(
+            [kw['task_uuid'] for args, kw in
+             receiver.deploy_resp.call_args_list],
+            [t.uuid for t in tasks]
+        )
+        metrics = consumer.metrics()
+        self.assertEqual(len(metrics), 4)
+        self.assertEqual(sum(m["processed"] for m in metrics), 3)
+        self.assertEqual(sum(m["queued"] for m in metrics), 0)
+
+    def test_worker_survives_failed_messages(self):
+        receiver = Mock(spec=['deploy_resp'])
+        consumer = RPCConsumer(Mock(), receiver, workers=1)
+        self.addCleanup(consumer.stop_workers)
+        msgs = [Mock(), Mock(), Mock()]
+        consumer.consume_msg(
+            {'method': 'unknown_resp', 'args': {'task_uuid': 't1'}}, msgs[0]
+        )
+        consumer.process_pending()
+        consumer.wait()
+
+        # commit after message can fail too
+        with patch.object(consumer, 'process_msg',
+                          side_effect=Exception("commit failed")):
+            consumer.consume_msg(self.progress_msg('t1', progress=10), msgs[1])
+            consumer.process_pending()
+            consumer.wait()
+
+        consumer.consume_msg(self.progress_msg('t1', progress=20), msgs[2])
+        consumer.process_pending()
+        consumer.wait()
+
+        self.assertTrue(consumer.workers[0].is_alive())
+        receiver.deploy_resp.assert_called_once_with(
+            task_uuid='t1', progress=20
+        )
+        for msg in msgs:
+            msg.ack.assert_called_once_with()
+
+    def test_unknown_task_routed_to_the_same_worker(self):
+        consumer = RPCConsumer(Mock(), Mock(), workers=4)
+        self.addCleanup(consumer.stop_workers)
+        task_uuid = str(uuid.uuid4())
+        body = {'method': 'deploy_resp', 'args': {'task_uuid': task_uuid}}
+        worker = consumer.worker_for(body)
+
+        cluster = self.env.create_cluster(api=False)
+        self.db.add(Task(uuid=task_uuid, name="deploy",
+                         cluster_id=cluster.id))
+        self.db.commit()
+        self.assertIs(consumer.worker_for(body), worker)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import uuid
+
+from mock import patch
+
+from nailgun.api.models import Node
+from nailgun.api.models import Task
+from nailgun.task.helpers import TaskHelper
+from nailgun.task.helpers import node_payloads
+from nailgun.task.task import DeploymentTask
+from nailgun.task.task import ProvisionTask
+from nailgun.test.base import BaseHandlers
+from nailgun.test.base import QueriesCounter
+
+
+class TestTaskHelpers(BaseHandlers):
+
+    def setUp(self):
+        super(TestTaskHelpers, self).setUp()
+        cluster = self.env.create_cluster(api=False)
+        self.supertask = Task(
+            uuid=str(uuid.uuid4()),
+            name="deploy",
+            cluster_id=cluster.id,
+            status="running"
+        )
+        self.db.add(self.supertask)
+        self.db.commit()
+        self.subtasks = []
+        for name, weight in (("provision", 1.0), ("deployment", 3.0)):
+            subtask = self.supertask.create_subtask(name)
+            subtask.weight = weight
+            subtask.status = "running"
+            subtask.progress = 0
+            self.subtasks.append(subtask)
+        self.db.commit()
+
+    def updates(self, statements):
+        return filter(lambda s: s.startswith('UPDATE'), statements)
+
+    def test_parent_progress_updated_incrementally(self):
+        provision, deployment = self.subtasks
+        TaskHelper.update_task_status(deployment.uuid, None, 50)
+        self.db.expire_all()
+        # (0 * 1 + 50 * 3) / 4
+        self.assertEquals(self.supertask.progress, 38)
+
+        TaskHelper.update_task_status(provision.uuid, None, 100)
+        self.db.expire_all()
+        self.assertEquals(self.supertask.progress, 63)
+        self.assertEquals(self.supertask.status, "running")
+
+    def test_unchanged_progress_not_written(self):
+        provision, deployment = self.subtasks
+        TaskHelper.update_task_status(deployment.uuid, None, 50)
+
+        with QueriesCounter() as counter:
+            TaskHelper.update_task_status(deployment.uuid, None, 50.2)
+        self.assertEquals(self.updates(counter.statements), [])
+
+        with QueriesCounter() as counter:
+            TaskHelper.update_task_status(deployment.uuid, None, 52)
+        # subtask and parent task, parent isn't loaded
+        self.assertEquals(len(self.updates(counter.statements)), 2)
+        self.db.expire_all()
+        self.assertEquals(self.supertask.progress, 39)
+
+        TaskHelper.update_task_status(provision.uuid, None, 1)
+        self.db.expire_all()
+        # (1 * 1 + 52 * 3) / 4 is still rounded to 39
+        self.assertEquals(self.supertask.progress, 39)
+
+    def test_parent_finished_with_subtasks(self):
+        for subtask in self.subtasks:
+            TaskHelper.update_task_status(subtask.uuid, "ready", 100, "ok")
+        self.db.expire_all()
+        self.assertEquals(self.supertask.status, "ready")
+        self.assertEquals(self.supertask.progress, 100)
+        self.assertEquals(self.supertask.message, "ok; ok")
+
+
+class TestNodePayloadCache(BaseHandlers):
+
+    format_node = '_DeploymentTask__format_node_for_naily'
+
+    def setUp(self):
+        super(TestNodePayloadCache, self).setUp()
+        node_payloads.invalidate()
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"role": "controller", "pending_addition": True},
+                {"role": "compute", "pending_addition": True},
+                {"role": "compute", "pending_addition": True}
+            ]
+        )
+        self.cluster = self.env.clusters[0]
+        TaskHelper.update_slave_nodes_fqdn(self.env.nodes)
+        self.task = Task(name="deployment", cluster_id=self.cluster.id)
+        self.db.add(self.task)
+        self.db.commit()
+
+    def build_message(self):
+        original = getattr(DeploymentTask, self.format_node)
+        with patch.object(DeploymentTask, self.format_node,
+                          wraps=original) as format_node:
+            with QueriesCounter() as counter:
+                message = DeploymentTask.message(self.task)
+        built = sorted(args[0].id for args, _ in format_node.call_args_list)
+        return message, built, counter.statements
+
+    def test_payloads_reused(self):
+        message, built, _ = self.build_message()
+        nodes_ids = sorted(n.id for n in self.env.nodes)
+        self.assertEquals(built, nodes_ids)
+        args = message['args']
+        self.assertEquals(
+            args['attributes']['controller_nodes'],
+            [args['nodes'][0]]
+        )
+
+        cached, built, statements = self.build_message()
+        self.assertEquals(built, [])
+        self.assertEquals(cached, message)
+        # meta of nodes isn't loaded
+        self.assertFalse(any("nodes.meta" in s for s in statements))
+        self.assertFalse(any(
+            'meta' in n.__dict__ for n in self.env.nodes
+        ))
+
+    def test_cached_payloads_not_changed_by_callers(self):
+        message, _, _ = self.build_message()
+        node = message['args']['nodes'][0]
+        node['network_data'][0]['name'] = 'changed'
+        node['meta']['tag'] = 'x'
+
+        cached, built, _ = self.build_message()
+        self.assertEquals(built, [])
+        node = cached['args']['nodes'][0]
+        self.assertNotEquals(node['network_data'][0]['name'], 'changed')
+        self.assertNotIn('tag', node['meta'])
+
+    def test_changed_meta_invalidates_payload(self):
+        self.build_message()
+        node = self.env.nodes[1]
+        node.meta = dict(node.meta, tag="x")
+        self.db.commit()
+
+        message, built, _ = self.build_message()
+        self.assertEquals(built, [node.id])
+        self.assertEquals(message['args']['nodes'][1]['meta']['tag'], "x")
+
+    def test_cluster_changes_invalidate_payloads(self):
+        self.cluster.clear_pending_changes()
+        self.build_message()
+        node = self.env.nodes[2]
+        self.cluster.add_pending_changes("disks", node_id=node.id)
+        message, built, _ = self.build_message()
+        self.assertEquals(built, [node.id])
+
+        self.cluster.add_pending_changes("networks")
+        message, built, _ = self.build_message()
+        self.assertEquals(built, sorted(n.id for n in self.env.nodes))
+
+
+class TestProvisionMessage(BaseHandlers):
+
+    def setUp(self):
+        super(TestProvisionMessage, self).setUp()
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"role": "controller", "pending_addition": True},
+                {"role": "compute", "pending_addition": True},
+                {"role": "compute", "pending_addition": True}
+            ]
+        )
+        TaskHelper.update_slave_nodes_fqdn(self.env.nodes)
+        self.task = Task(name="provision", cluster_id=self.env.clusters[0].id)
+        self.db.add(self.task)
+        self.db.commit()
+        self.syslog_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.syslog_dir)
+        super(TestProvisionMessage, self).tearDown()
+
+    @patch('nailgun.task.helpers.os.system')
+    def test_nodes_prepared_in_batches(self, mocked_system):
+        with patch.multiple('nailgun.task.task.settings',
+                            FAKE_TASKS=False, FAKE_TASKS_AMQP=False):
+            with patch('nailgun.task.helpers.settings.SYSLOG_DIR',
+                       self.syslog_dir):
+                with QueriesCounter() as counter:
+                    message = ProvisionTask.message(self.task)
+
+        statements = counter.statements
+        inserts = filter(lambda s: s.startswith('INSERT'), statements)
+        updates = filter(lambda s: s.startswith('UPDATE'), statements)
+        self.assertEquals(len(inserts), 1)
+        self.assertEquals(len(updates), 1)
+        mocked_system.assert_called_once_with("/usr/bin/pkill -HUP rsyslog")
+
+        nodes_data = message['args']['nodes']
+        self.assertEquals(len(nodes_data), len(self.env.nodes))
+        for node, node_data in zip(self.env.nodes, nodes_data):
+            self.assertEquals(node.status, "provisioning")
+            self.assertEquals(node_data['hostname'], node.fqdn)
+            self.assertTrue(
+                os.path.isdir(os.path.join(self.syslog_dir, node.fqdn))
+            )
+            for iface in node_data['interfaces'].itervalues():
+                link = os.path.join(self.syslog_dir, iface['ip_address'])
+                self.assertEquals(os.readlink(link), node.fqdn)
@@ -59,6 +59,8 @@ function(utils, models, dialogViews, navbarTemplate, nodesStatsTemplate, notific
         className: 'container',
         template: _.template(navbarTemplate),
         updateInterval: 20000,
+        eventsTimeout: 30,
+        eventsRetryInterval: 2000,
         setActive: function(element) {
             this.$('a.active').removeClass('active');
             this.$('a[href="#' + element + '"]').addClass('active');
@@ -67,16 +69,63 @@ function(utils, models, dialogViews, navbarTemplate, nodesStatsTemplate, notific
             this.registerDeferred($.timeout(this.updateInterval).done(_.bind(this.update, this)));
         },
         update: function() {
-            this.refresh().always(_.bind(this.scheduleUpdate, this));
+            this.statistics.fetch().always(_.bind(this.scheduleUpdate, this));
         },
         refresh: function() {
-            return $.when(this.statistics.fetch(), this.notifications.fetch());
+            var lastNotification = this.notifications.last();
+            var data = lastNotification ? {since_id: lastNotification.id} : {};
+            return $.when(this.statistics.fetch(), this.notifications.fetch({data: data, remove: false}));
+        },
+        fetchEvents: function(timeout) {
+            var data = {timeout: timeout};
+            if (!_.isUndefined(this.lastEventId)) {
+                data.since_id = this.lastEventId;
+            }
+            var request = $.ajax({url: '/api/events', dataType: 'json', data: data}).done(_.bind(this.handleEvents, this));
+            this.registerDeferred(request);
+            return request;
+        },
+        scheduleEventsPoll: function(delay) {
+            this.registerDeferred($.timeout(delay).done(_.bind(this.pollEvents, this)));
+        },
+        pollEvents: function() {
+            this.fetchEvents(this.eventsTimeout).done(_.bind(function(result) {
+                // server answers at once if too many clients are waiting, so empty responses are not repeated immediately
+                this.scheduleEventsPoll(result.events.length ? 0 : this.eventsRetryInterval);
+            }, this)).fail(_.bind(function(xhr, status) {
+                if (status != 'abort') {
+                    this.scheduleEventsPoll(this.updateInterval);
+                }
+            }, this));
+        },
+        handleEvents: function(result) {
+            this.lastEventId = result.last_id;
+            if (result.reset) {
+                this.refresh();
+                return;
+            }
+            var notifications = _.pluck(_.where(result.events, {type: 'notification'}), 'data');
+            if (notifications.length) {
+                this.notifications.add(notifications, {merge: true});
+                this.notifications.trigger('sync');
+            }
+            if (_.find(result.events, {type: 'node'})) {
+                this.statistics.fetch();
+            }
         },
         initialize: function(options) {
             this.elements = _.isArray(options.elements) ? options.elements : [];
             this.statistics = new models.NodesStatistics();
             this.notifications = new models.Notifications();
-            $.when(this.statistics.deferred = this.statistics.fetch(), this.notifications.deferred = this.notifications.fetch()).done(_.bind(this.scheduleUpdate, this));
+            this.statistics.deferred = this.statistics.fetch();
+            // position in events stream is taken before notifications are fetched, so no notification is missed
+            this.notifications.deferred = this.fetchEvents(0).then(_.bind(function() {
+                return this.notifications.fetch();
+            }, this));
+            $.when(this.statistics.deferred, this.notifications.deferred).done(_.bind(function() {
+                this.scheduleUpdate();
+                this.scheduleEventsPoll(0);
+            }, this));
         },
         render: function() {
             this.tearDownRegisteredSubViews();
@@ -13,6 +13,7 @@
 #    under the License.
 
 require 'json'
+require 'zlib'
 
 module Naily
   class Server
@@ -34,8 +35,8 @@ module Naily
 
     def server_loop
       loop do
-        consume_one do |payload|
-          dispatch payload
+        consume_one do |metadata, payload|
+          dispatch decompress(metadata, payload)
         end
         Thread.stop
       end
@@ -46,7 +47,7 @@ module Naily
       @consumer.on_delivery do |metadata, payload|
         metadata.ack
         Thread.new do
-          yield payload
+          yield metadata, payload
           @loop.wakeup
         end
         @consumer.cancel
@@ -65,7 +66,8 @@ module Naily
         return
       end
 
-      (messages.is_a?(Array) ? messages : [messages]).each_with_index do |message, i|
+      messages = (messages.is_a?(Array) ? messages : [messages]).map { |message| expand_node_refs message }
+      messages.each_with_index do |message, i|
         begin
           dispatch_message message
         rescue StopIteration
@@ -82,6 +84,39 @@ module Naily
       end
     end
 
+    # Messages are compressed by nailgun if compact_messages is enabled
+    def decompress(metadata, payload)
+      headers = metadata.headers || {}
+      if ['application/x-gzip', 'zlib'].include?(headers['compression'])
+        Zlib::Inflate.inflate(payload)
+      else
+        payload
+      end
+    end
+
+    # Node blobs repeated in message are sent by nailgun once in
+    # 'node_blobs' and referenced as {'node_ref' => index}
+    def expand_node_refs(message)
+      blobs = message.is_a?(Hash) && message.delete('node_blobs')
+      return message unless blobs
+
+      expand = lambda do |obj|
+        case obj
+        when Hash
+          if obj.size == 1 && obj.has_key?('node_ref')
+            Marshal.load(Marshal.dump(blobs[obj['node_ref']]))
+          else
+            Hash[obj.map { |k, v| [k, expand.call(v)] }]
+          end
+        when Array
+          obj.map { |v| expand.call(v) }
+        else
+          obj
+        end
+      end
+      expand.call(message)
+    end
+
     def dispatch_message(data)
       Naily.logger.debug "Dispatching message: #{data.inspect}"
 
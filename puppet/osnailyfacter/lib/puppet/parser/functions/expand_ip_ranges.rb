@@ -0,0 +1,30 @@
+module Puppet::Parser::Functions
+  newfunction(:expand_ip_ranges, :type => :rvalue, :doc => <<-EOS
+Expands list of IP addresses and IP ranges ('first-last')
+into list of IP addresses.
+    EOS
+  ) do |arguments|
+
+    require 'ipaddr'
+
+    if (arguments.size != 1) then
+      raise(Puppet::ParseError, "expand_ip_ranges(): Wrong number of arguments "+
+            "given #{arguments.size} for 1")
+    end
+
+    addresses = []
+    [arguments[0]].flatten.each do |item|
+      begin
+        first, last = item.split('-', 2).map { |ip| IPAddr.new(ip.strip) }
+      rescue ArgumentError
+        raise(Puppet::ParseError, "expand_ip_ranges(): bad IP range #{item}")
+      end
+      last ||= first
+      (first.to_i..last.to_i).each do |ip|
+        addresses << IPAddr.new(ip, first.family).to_s
+      end
+    end
+
+    return addresses
+  end
+end
@@ -34,7 +34,7 @@ $keystone_hash = parsejson($keystone)
 $swift_hash    = parsejson($swift)
 $cinder_hash   = parsejson($cinder)
 $access_hash   = parsejson($access)
-$floating_hash = parsejson($floating_network_range)
+$floating_hash = expand_ip_ranges(parsejson($floating_network_range))
 
 if $::hostname == $master_hostname {
   $primary_proxy = true
@@ -18,7 +18,7 @@ $swift_hash    = parsejson($swift)
 $cinder_hash   = parsejson($cinder)
 $access_hash   = parsejson($access)
 $extra_rsyslog_hash = parsejson($syslog)
-$floating_hash = parsejson($floating_network_range)
+$floating_hash = expand_ip_ranges(parsejson($floating_network_range))
 
 if $auto_assign_floating_ip == 'true' {
   $bool_auto_assign_floating_ip = true